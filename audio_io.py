@@ -0,0 +1,150 @@
+import numpy as np
+import soundfile as sf
+
+
+def _stereo(block):
+    """(channels, n) のブロックを2chにそろえる（モノラルは複製、3ch以上は前の2chだけ）"""
+    if block.shape[0] == 1:
+        return np.vstack([block, block])
+    return block[:2]
+
+
+def _channels(block, stereo):
+    """stereo なら2chにそろえ、そうでなければ元のチャンネル数のまま（3ch以上は前の2chだけ）"""
+    return _stereo(block) if stereo else block[:2]
+
+
+def _rechunk(chunks, block_size, channels, dtype):
+    """長さがバラバラな (channels, n) の塊を、block_size ずつの塊に切り直すジェネレータ"""
+    pending = np.zeros((channels, 0), dtype=dtype)
+    for chunk in chunks:
+        pending = np.concatenate([pending, chunk], axis=1)
+        while pending.shape[1] >= block_size:
+            yield pending[:, :block_size]
+            pending = pending[:, block_size:]
+    if pending.shape[1]:
+        yield pending
+
+
+def _audioread_blocks(path, block_size, dtype, stereo=True):
+    """
+    soundfile で読めない圧縮形式（m4a など）を audioread で少しずつデコードする
+    :return: (ブロックのジェネレータ, サンプリングレート, 長さ [サンプル]（分からない時は None）)
+    """
+    import audioread
+
+    f = audioread.audio_open(path)
+    channels = f.channels
+    sr = f.samplerate
+    length = int(round(f.duration * sr)) if f.duration else None
+
+    def _decode():
+        # audioread は 16bit 整数のバイト列をインターリーブで返す
+        for buf in f:
+            pcm = np.frombuffer(buf, dtype="<i2").reshape(-1, channels)
+            yield (pcm.T / 32768.0).astype(dtype)
+
+    def _blocks():
+        # 途中でやめた時も（close() やガベージコレクションで）ファイルを閉じる
+        try:
+            for block in _rechunk(_decode(), block_size, channels, dtype):
+                yield _channels(block, stereo)
+        finally:
+            f.close()
+
+    return _blocks(), sr, length
+
+
+def info(path):
+    """
+    デコードせずに曲の情報だけを読む
+    :return: (サンプリングレート, 長さ [サンプル]（audioread では概算、不明なら None）)
+    """
+    try:
+        i = sf.info(path)
+    except Exception:
+        import audioread
+
+        with audioread.audio_open(path) as f:
+            sr = f.samplerate
+            length = int(round(f.duration * sr)) if f.duration else None
+        return sr, length
+    return i.samplerate, i.frames
+
+
+def open_blocks(path, block_size, dtype="float32", with_length=False, stereo=True):
+    """
+    音楽ファイルをブロック単位で読み込む（曲全体をメモリに載せない）
+    WAV / FLAC / OGG / MP3 は soundfile、それ以外の圧縮形式は audioread で少しずつデコードします。
+    :param block_size: 1ブロックのサンプル数（最後のブロックだけ短いことがある）
+    :param with_length: True なら曲の長さ [サンプル] も返す（audioread では概算、不明なら None）
+    :param stereo: False ならモノラルを複製せず (1, block_size) のまま返す
+    :return: (ブロックのジェネレータ, サンプリングレート[, 長さ])
+        ブロックは (2, block_size) で、モノラルは左右に複製済み
+        最後まで読まずにやめる時は、ジェネレータの close() を呼ぶとすぐにファイルを閉じる
+    """
+    try:
+        info = sf.info(path)
+    except Exception:
+        blocks, sr, length = _audioread_blocks(path, block_size, dtype, stereo)
+    else:
+        sr, length = info.samplerate, info.frames
+
+        def _sf_blocks():
+            for block in sf.blocks(
+                path, blocksize=block_size, dtype=dtype, always_2d=True
+            ):
+                yield _channels(block.T, stereo)
+
+        blocks = _sf_blocks()
+
+    if with_length:
+        return blocks, sr, length
+    return blocks, sr
+
+
+def load_audio(path, block_size=2**16, dtype=np.float32, stereo=True):
+    """
+    曲全体を (2, n) の配列に読み込む（長さの制限なし）
+    長さが分かる時は最初に配列を1つだけ確保して、ブロックを順に書き込みます。
+    （librosa.load のように曲全体のデコード結果を何度もコピーしない）
+    :param stereo: False ならモノラルは (1, n) のまま返す（デコードキャッシュ用）
+    :return: (data, sr)  空の曲は (2, 0)
+    """
+    blocks, sr, length = open_blocks(
+        path, block_size, dtype, with_length=True, stereo=stereo
+    )
+    try:
+        return _read_all(blocks, length, dtype), sr
+    finally:
+        blocks.close()
+
+
+def _read_all(blocks, length, dtype):
+    """ブロックを全部読んで1つの配列にする（length は分かっていれば長さの見込み）"""
+    if length is None:
+        chunks = list(blocks)
+        if not chunks:
+            return np.zeros((2, 0), dtype=dtype)
+        return np.concatenate(chunks, axis=1)
+
+    data = None
+    pos = 0
+    extra = []
+    for block in blocks:
+        if data is None:
+            data = np.empty((block.shape[0], length), dtype=dtype)
+        n = block.shape[1]
+        if pos + n <= length:
+            data[:, pos : pos + n] = block
+        else:
+            # 概算の長さより長かった分（audioread）
+            fit = max(0, length - pos)
+            data[:, pos:] = block[:, :fit]
+            extra.append(block[:, fit:])
+        pos += n
+    if data is None:
+        return np.zeros((2, 0), dtype=dtype)
+    if extra:
+        return np.concatenate([data] + extra, axis=1)
+    return data[:, :pos]
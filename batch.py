@@ -0,0 +1,320 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import soundfile as sf
+
+import audio_io
+
+# 読み込む拡張子（GUIのファイル選択と同じ + soundfile で読める主な形式）
+AUDIO_EXTS = (".mp3", ".wav", ".flac", ".m4a", ".ogg", ".aiff", ".aif")
+
+# 書き出した曲の記録（途中で止まっても、次回は終わった曲を飛ばす）
+MANIFEST = ".music_one_f_batch.jsonl"
+
+
+def find_audio(inputs):
+    """
+    ファイルとフォルダの並びから、曲のファイルを (パス, 出力先の相対パス) で返す
+    フォルダはその中を再帰的に探し、フォルダ構成を出力先でも保つ（同じファイルは1回だけ）
+    """
+    found = []
+    seen = set()
+
+    def _add(path, rel):
+        src = os.path.normcase(os.path.abspath(path))
+        if src not in seen:
+            seen.add(src)
+            found.append((path, rel))
+
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for name in sorted(files):
+                    if name.lower().endswith(AUDIO_EXTS):
+                        path = os.path.join(root, name)
+                        _add(path, os.path.relpath(path, item))
+        elif os.path.isfile(item):
+            _add(item, os.path.basename(item))
+        else:
+            print(f"skip: {item} (not found)", file=sys.stderr)
+    return found
+
+
+def output_names(rels, fmt):
+    """
+    出力先の相対パスの並び（拡張子を fmt に変える）
+    拡張子だけ違う曲（song.wav と song.flac）や、別の入力フォルダの同じ相対パスは出力が重なって
+    後の曲が前の曲を上書きしてしまうので、重なった曲は元の拡張子を名前に残し（song_wav.flac）、
+    それでも重なれば番号を付ける（song_wav-2.flac）。入力の並びが同じなら毎回同じ名前になります。
+    """
+    ext = "." + fmt.lower()
+    stems = [os.path.splitext(rel) for rel in rels]
+    counts = {}
+    for stem, _ in stems:
+        counts[os.path.normcase(stem)] = counts.get(os.path.normcase(stem), 0) + 1
+    taken = {os.path.normcase(stem) for stem, _ in stems}
+
+    names = []
+    for stem, src_ext in stems:
+        name = stem
+        if counts[os.path.normcase(stem)] > 1:
+            base = f"{stem}_{src_ext[1:].lower()}"
+            name, n = base, 1
+            while os.path.normcase(name) in taken:
+                n += 1
+                name = f"{base}-{n}"
+            taken.add(os.path.normcase(name))
+        names.append(name + ext)
+    return names
+
+
+def estimate_bytes(path, float32=False):
+    """1曲を加工する時のメモリの山の見積もり（pipeline.STAGE_COST と同じ考え方）"""
+    from pipeline import STAGE_COST
+
+    sr, length = audio_io.info(path)
+    if length is None:
+        length = 10 * 60 * sr  # 長さが分からない時は10分とみなす
+    itemsize = 4 if float32 else 8
+    unit = 2 * length * itemsize
+    # 曲の配列 + 一番重いステージ + 書き出し用の float32
+    return int(unit * (1 + max(STAGE_COST.values())) + 2 * length * 4)
+
+
+def _render_one(job):
+    """1曲を読み込み・加工・書き出しする（プロセスプールの中で動く）"""
+    from pipeline import render_pipeline
+    from stage_profiler import stage_profiler, span
+
+    # trace の時は各段階を記録して、出力の隣に Chrome のトレース形式で書き出す
+    profile = stage_profiler() if job["trace"] else None
+    start = time.perf_counter()
+    with profile.activate() if profile else nullcontext():
+        with span("decode", "io"):
+            data, sr = audio_io.load_audio(job["input"])
+        decoded = time.perf_counter()
+
+        pipeline = render_pipeline(
+            sr, job["depths"], float32=job["float32"], seed=job["seed"]
+        )
+        data = pipeline.render(data)
+
+    # 途中で止まった時に書きかけのファイルが残らないように、別名で書いてから置き換える
+    out = job["output"]
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    partial = out + ".partial"
+    sf.write(partial, data.T, sr, format=job["format"], subtype=job["subtype"])
+    os.replace(partial, out)
+    if profile is not None:
+        profile.export_chrome(out + ".trace.json")
+
+    seconds = data.shape[1] / sr
+    elapsed = time.perf_counter() - start
+    return {
+        "input": job["input"],
+        "output": job["output"],
+        "key": job["key"],
+        "duration": seconds,
+        "decode": decoded - start,
+        "elapsed": elapsed,
+        "realtime": seconds / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+def _params_key(params):
+    """出力に効く設定のハッシュ（設定を変えたら作り直す）"""
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def load_manifest(out_dir):
+    """これまでに書き出した曲 {(入力の絶対パス, 設定のキー): 記録}"""
+    done = {}
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 途中で止まった時の書きかけの行
+            done[(entry["input"], entry["key"])] = entry
+    return done
+
+
+def run_batch(
+    inputs,
+    out_dir,
+    depths,
+    fmt="wav",
+    subtype=None,
+    float32=False,
+    seed=None,
+    workers=None,
+    max_inflight_mb=4096,
+    resume=True,
+    trace=False,
+):
+    """
+    曲をまとめて加工する（GUIなし）
+    同時に加工する曲のメモリの見積もりの合計が max_inflight_mb を超えないように、
+    プロセスプールに曲を少しずつ渡します（1曲だけなら上限を超えていても加工する）。
+    :param inputs: ファイルまたはフォルダの並び
+    :param out_dir: 書き出し先のフォルダ
+    :param depths: {"vol", "pan", "pit", "tim", "rev"} をキーにした各Depth
+    :param fmt: 書き出す形式（soundfile の format、"wav" / "flac" / "ogg" など）
+    :param resume: True なら前回までに書き出した曲（同じ設定）を飛ばす
+    :param trace: True なら曲ごとに各段階の記録を「出力.trace.json」に書き出す
+    :return: 加工した曲の記録のリスト
+    """
+    fmt = fmt.upper()
+    subtype = subtype or sf.default_subtype(fmt)
+    params = {
+        "depths": depths,
+        "format": fmt,
+        "subtype": subtype,
+        "float32": float32,
+        "seed": seed,
+    }
+    key = _params_key(params)
+
+    os.makedirs(out_dir, exist_ok=True)
+    done = load_manifest(out_dir) if resume else {}
+
+    jobs = []
+    found = find_audio(inputs)
+    names = output_names([rel for _, rel in found], fmt)
+    for (path, rel), name in zip(found, names):
+        src = os.path.abspath(path)
+        out = os.path.join(out_dir, name)
+        if (src, key) in done and os.path.exists(out):
+            print(f"skip: {rel} (already rendered)")
+            continue
+        # メモリの見積もりは曲ごとに1回だけ（読めない曲はここで失敗として飛ばす）
+        try:
+            cost = estimate_bytes(src, float32)
+        except Exception as e:
+            print(
+                f"fail: {os.path.basename(src)}: {e or type(e).__name__}",
+                file=sys.stderr,
+            )
+            continue
+        if os.path.splitext(name)[0] != os.path.splitext(rel)[0]:
+            print(f"rename: {rel} -> {name} (same output name as another file)")
+        job = dict(params, input=src, output=out, key=key, trace=trace)
+        jobs.append((job, cost))
+
+    if not jobs:
+        print("nothing to do")
+        return []
+
+    budget = max_inflight_mb * 2**20
+    workers = workers or os.cpu_count() or 1
+    results = []
+    total_audio = 0.0
+    start = time.perf_counter()
+
+    manifest = open(os.path.join(out_dir, MANIFEST), "a", encoding="utf-8")
+    pool = ProcessPoolExecutor(workers)
+    interrupted = False
+    try:
+        pending = {}  # Future → (job, 見積もりバイト数)
+        queue = list(jobs)
+        inflight = 0
+        while queue or pending:
+            # メモリの見積もりが上限に収まる間だけ、次の曲を渡す
+            while queue and len(pending) < workers:
+                job, cost = queue[0]
+                if pending and inflight + cost > budget:
+                    break
+                queue.pop(0)
+                pending[pool.submit(_render_one, job)] = (job, cost)
+                inflight += cost
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job, cost = pending.pop(future)
+                inflight -= cost
+                name = os.path.basename(job["input"])
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # 失敗した曲は記録しないので、次回また加工される
+                    print(f"fail: {name}: {e}", file=sys.stderr)
+                    continue
+                manifest.write(json.dumps(result) + "\n")
+                manifest.flush()
+                results.append(result)
+                total_audio += result["duration"]
+                print(
+                    f"[{len(results)}/{len(jobs)}] {name}: "
+                    f"{result['duration']:.1f}s audio in {result['elapsed']:.1f}s "
+                    f"({result['realtime']:.1f}x realtime)"
+                )
+    except KeyboardInterrupt:
+        interrupted = True
+        print("interrupted: run again to resume", file=sys.stderr)
+        raise
+    finally:
+        # 止められた時は待たずに終わる（書きかけの .partial は次回上書きされる）
+        pool.shutdown(wait=not interrupted, cancel_futures=True)
+        manifest.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"done: {len(results)} files, {total_audio / 60:.1f} min audio "
+        f"in {elapsed:.1f}s ({total_audio / max(elapsed, 1e-9):.1f}x realtime)"
+    )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Apply the 1/f fluctuation chain to many tracks without the GUI"
+    )
+    parser.add_argument("inputs", nargs="+", help="audio files or directories")
+    parser.add_argument("-o", "--out", required=True, help="output directory")
+    for key, label in [
+        ("vol", "Volume"),
+        ("pan", "Pan"),
+        ("pit", "Pitch"),
+        ("tim", "Timbre"),
+        ("rev", "Reverb"),
+    ]:
+        parser.add_argument(
+            f"--{key}", type=float, default=1.0, help=f"{label} depth (0 = off)"
+        )
+    parser.add_argument("--format", default="wav", help="wav, flac, ogg, ...")
+    parser.add_argument("--subtype", default=None, help="e.g. PCM_16, PCM_24, FLOAT")
+    parser.add_argument("--float32", action="store_true", help="low-memory mode")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--max-inflight-mb", type=int, default=4096)
+    parser.add_argument(
+        "--no-resume", action="store_true", help="render files even if done before"
+    )
+    parser.add_argument(
+        "--trace", action="store_true", help="write <output>.trace.json per file"
+    )
+    args = parser.parse_args()
+
+    run_batch(
+        args.inputs,
+        args.out,
+        {key: getattr(args, key) for key in ("vol", "pan", "pit", "tim", "rev")},
+        fmt=args.format,
+        subtype=args.subtype,
+        float32=args.float32,
+        seed=args.seed,
+        workers=args.workers,
+        max_inflight_mb=args.max_inflight_mb,
+        resume=not args.no_resume,
+        trace=args.trace,
+    )
@@ -0,0 +1,423 @@
+import time
+import argparse
+import numpy as np
+
+
+def _best_time(fn, repeat=3):
+    """fn() を repeat 回実行して一番速かった時間 [秒] を返す（キャッシュ作成などの初回分を除くため）"""
+    best = np.inf
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def _test_signal(seconds, sr, seed=0):
+    """ベンチマーク用のステレオ信号（ノイズに音量の山谷をつけたもの）"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    envelope = 0.5 + 0.5 * np.sin(np.linspace(0, 20 * np.pi, n)) ** 2
+    return (rng.standard_normal((2, n)) * 0.1 * envelope).astype(np.float32)
+
+
+def bench_reverb(seconds=60.0, sr=44100, repeat=3):
+    """
+    syn_rev の残響エンジンごとの処理時間
+    "conv"（IR1本）と "bank"（IRバンクのクロスフェード）、"fdn" を比べます。
+    :return: {engine: 秒}
+    """
+    from syn_reverb import syn_reverb
+
+    data = _test_signal(seconds, sr)
+    results = {}
+    for engine in ["conv", "bank", "fdn"]:
+        syn = syn_reverb()
+        results[engine] = _best_time(
+            lambda: syn.syn_rev(data.copy(), sr, seed=0, engine=engine), repeat
+        )
+    return results
+
+
+def bench_timbre(seconds=60.0, sr=44100, repeat=3):
+    """
+    syn_tim の処理時間
+    "blend"（sosfiltfilt + ブレンド）、"causal"（片方向 + ブレンド）、"sweep"（カットオフを動かす）
+    :return: {engine: 秒}
+    """
+    from syn_timbre import syn_timbre
+
+    data = _test_signal(seconds, sr)
+    results = {}
+    for name, kwargs in [
+        ("blend", {}),
+        ("causal", {"causal": True}),
+        ("sweep", {"engine": "sweep"}),
+    ]:
+        syn = syn_timbre()
+        results[name] = _best_time(
+            lambda: syn.syn_tim(data.copy(), sr, seed=0, **kwargs), repeat
+        )
+    return results
+
+
+def bench_pitch(seconds=60.0, sr=44100, repeat=3):
+    """
+    syn_pit の処理時間
+    "global"（曲全体の再生位置を作る）と、リングバッファのリサンプラー（線形 / sinc）
+    :return: {方式: 秒}
+    """
+    from syn_pitch import syn_pitch
+
+    data = _test_signal(seconds, sr)
+    results = {}
+    for name, kwargs in [
+        ("global", {}),
+        ("linear", {"streaming": True}),
+        ("sinc", {"streaming": True, "interp": "sinc"}),
+    ]:
+        syn = syn_pitch()
+        results[name] = _best_time(
+            lambda: syn.syn_pit(data.copy(), sr, seed=0, **kwargs), repeat
+        )
+    return results
+
+
+def bench_threads(seconds=60.0, sr=44100, repeat=3, workers=None):
+    """
+    render_pipeline を1スレッドと workers スレッドで比べる（結果が全く同じことも確かめる）
+    ステージごとの速さの比も表示します。
+    :return: {"serial" / "threads": 秒}
+    """
+    import os
+    from pipeline import render_pipeline
+
+    workers = workers or os.cpu_count() or 1
+    depths = {"vol": 0.5, "pan": 0.5, "pit": 0.5, "tim": 0.5, "rev": 0.5}
+    data = _test_signal(seconds, sr)
+    results, timings, outputs = {}, {}, {}
+    for name, n in [("serial", None), ("threads", workers)]:
+        best = np.inf
+        for _ in range(repeat):
+            pipeline = render_pipeline(sr, depths, seed=0, workers=n)
+            t = time.perf_counter()
+            outputs[name] = pipeline.render(data.copy())
+            sec = time.perf_counter() - t
+            if sec < best:
+                best, timings[name] = sec, pipeline.timings
+        results[name] = best
+
+    if not np.array_equal(outputs["serial"], outputs["threads"]):
+        print("warning: threaded output differs from serial output")
+    for stage, sec in timings["serial"].items():
+        threaded = timings["threads"].get(stage, 0.0)
+        speedup = sec / threaded if threaded > 0 else float("nan")
+        print(
+            f"{'threads':>8} {stage:<8} {sec:7.3f}s -> {threaded:7.3f}s ({speedup:4.2f}x)"
+        )
+    return results
+
+
+# DSP の中心部分が読み込んではいけない重いモジュール（GUI・グラフ・再生・ファイル読み込み）
+HEAVY_MODULES = ("tkinter", "matplotlib", "sounddevice", "soundfile", "librosa")
+
+# DSP の中心部分の import 時間が numpy / scipy だけの何倍までなら良いか
+IMPORT_SLACK = 1.5
+
+
+def _import_time(code, repeat=3):
+    """新しい Python で code を実行した時間の最小値 [秒]（import のキャッシュが効かない初回の時間）"""
+    import os
+    import subprocess
+    import sys
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = np.inf
+    for _ in range(repeat):
+        t = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=here)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def bench_import(seconds=None, sr=None, repeat=3):
+    """
+    起動時の import の時間を、numpy / scipy だけの時と比べる
+    DSP の中心部分（pipeline / segment_render）が重いモジュールを読み込んでいたり、
+    numpy / scipy だけの IMPORT_SLACK 倍より遅かったりしたら RuntimeError にします。
+    :return: {"baseline" / "core" / "gui": 秒}（GUI が動かない環境では "gui" は無し）
+    """
+    import os
+    import subprocess
+    import sys
+
+    check = (
+        "import sys, pipeline, segment_render\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print(' '.join(heavy))"
+    )
+    heavy = subprocess.run(
+        [sys.executable, "-c", check],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout.strip()
+    if heavy:
+        raise RuntimeError(f"the DSP core imports {heavy} at import time")
+
+    results = {
+        "baseline": _import_time("import numpy, scipy.signal, scipy.fft", repeat),
+        "core": _import_time("import pipeline, segment_render", repeat),
+    }
+    try:
+        results["gui"] = _import_time("import main", repeat)
+    except subprocess.CalledProcessError:
+        print("skip: main.py cannot be imported here (no tkinter?)")
+
+    if results["core"] > results["baseline"] * IMPORT_SLACK:
+        raise RuntimeError(
+            f"importing the DSP core took {results['core']:.3f}s "
+            f"(numpy/scipy alone: {results['baseline']:.3f}s)"
+        )
+    return results
+
+
+BENCHMARKS = {
+    "reverb": bench_reverb,
+    "timbre": bench_timbre,
+    "pitch": bench_pitch,
+    "threads": bench_threads,
+    "import": bench_import,
+}
+
+# ---- 全ステージのベンチマーク（python benchmark.py --suite） ----
+
+# 曲の長さ [秒] とサンプリングレートの組み合わせ（--durations / --rates で絞れる）
+SUITE_SECONDS = (10, 60, 600, 3600)
+SUITE_RATES = (44100, 48000, 96000)
+SUITE_DEPTHS = {"vol": 0.5, "pan": 0.5, "pit": 0.5, "tim": 0.5, "rev": 0.5}
+
+# 基準の結果の置き場所（--save-baseline で作る。マシンごとに違うので各自で作る）
+BASELINE_FILE = "benchmark_baseline.json"
+
+# 基準よりこの割合以上遅い・メモリが多い時を性能の劣化とみなす
+# （短い曲の誤差で落ちないように、差が MIN_REGRESSION_SEC / MIN_REGRESSION_MB 未満なら無視）
+REGRESSION_TOLERANCE = 0.25
+MIN_REGRESSION_SEC = 0.05
+MIN_REGRESSION_MB = 1.0
+
+
+def _measure(fn, repeat=1):
+    """
+    fn() の一番速かった時間 [秒] と、tracemalloc で測ったメモリの山 [バイト]
+    tracemalloc は遅くなるので、時間を測る回とは別にもう1回実行して測ります。
+    """
+    import gc
+    import tracemalloc
+
+    wall = _best_time(fn, repeat)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return wall, peak
+
+
+def _chain(path):
+    """
+    main.py の _process_logic と同じ流れ（読み込み → グラフ用のコピー → バケツリレー加工）
+    Tk とオーディオデバイスは使わず、再生とグラフの表示の手前まで
+    """
+    import os
+    import audio_io
+    from pipeline import render_pipeline
+
+    workers = int(os.environ.get("MUSIC_ONE_F_WORKERS", os.cpu_count() or 1))
+    long_track_sec = int(os.environ.get("MUSIC_ONE_F_LONG_TRACK_SEC", 600))
+
+    data, sr = audio_io.load_audio(path)
+    be_data = data.copy()
+    if data.shape[1] > long_track_sec * sr and workers > 1:
+        from segment_render import segment_renderer
+
+        pipeline = segment_renderer(sr, SUITE_DEPTHS, processes=workers, seed=0)
+    else:
+        pipeline = render_pipeline(sr, SUITE_DEPTHS, seed=0, workers=workers)
+    return be_data, pipeline.render(data)
+
+
+def _suite_cases(data, sr, path):
+    """(名前, 計る関数) の並び"""
+    import one_f_generator as ofg
+    from syn_volume import syn_volume
+    from syn_pan import syn_pan
+    from syn_pitch import syn_pitch
+    from syn_timbre import syn_timbre
+    from syn_reverb import syn_reverb
+
+    n = data.shape[1]
+    return [
+        ("generate_one_f", lambda: ofg.generate_one_f(n, seed=0)),
+        ("syn_vol", lambda: syn_volume().syn_vol(data.copy(), sr, seed=0)),
+        ("syn_pan", lambda: syn_pan().syn_pan(data.copy(), sr, seed=0)),
+        ("syn_pit", lambda: syn_pitch().syn_pit(data.copy(), sr, seed=0)),
+        ("syn_tim", lambda: syn_timbre().syn_tim(data.copy(), sr, seed=0)),
+        ("syn_rev", lambda: syn_reverb().syn_rev(data.copy(), sr, seed=0)),
+        ("chain", lambda: _chain(path)),
+    ]
+
+
+def run_suite(durations=SUITE_SECONDS, rates=SUITE_RATES, repeat=1, stages=None):
+    """
+    合成したステレオ信号で、各 syn_*・generate_one_f・加工の全体（_process_logic と同じ流れ）を計る
+    メモリの山は入力の信号を除いた、その処理の間に増えた分です。
+    :param stages: 計るものの名前の並び（None なら全部）
+    :return: {"meta": 環境, "results": {"名前@sr/秒s": {"wall", "realtime", "peak_mb", ...}}}
+    """
+    import os
+    import sys
+    import platform
+    import tempfile
+    import scipy
+    import soundfile as sf
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for sr in rates:
+            for seconds in durations:
+                data = _test_signal(seconds, sr)
+                # chain の読み込み用（デコードの時間も含めるので WAV に書いておく）
+                path = os.path.join(tmp, f"suite_{sr}_{seconds}.wav")
+                sf.write(path, data.T, sr, subtype="FLOAT")
+                for name, fn in _suite_cases(data, sr, path):
+                    if stages and name not in stages:
+                        continue
+                    wall, peak = _measure(fn, repeat)
+                    key = f"{name}@{sr}/{seconds:g}s"
+                    results[key] = {
+                        "stage": name,
+                        "sr": sr,
+                        "seconds": seconds,
+                        "wall": wall,
+                        "realtime": seconds / wall if wall > 0 else float("inf"),
+                        "peak_mb": peak / 2**20,
+                    }
+                    print(
+                        f"{key:<28} {wall:8.3f}s {seconds / wall:8.1f}x realtime "
+                        f"{peak / 2**20:9.1f} MB",
+                        file=sys.stderr,
+                    )
+                os.remove(path)
+                del data
+
+    meta = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "repeat": repeat,
+    }
+    return {"meta": meta, "results": results}
+
+
+def compare_baseline(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    基準より遅くなった・メモリが増えたものを文字列の並びで返す（両方にあるものだけ比べる）
+    """
+    regressions = []
+    for key, now in report["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        for field, unit, floor in [
+            ("wall", "s", MIN_REGRESSION_SEC),
+            ("peak_mb", "MB", MIN_REGRESSION_MB),
+        ]:
+            limit = base[field] * (1 + tolerance)
+            if now[field] > limit and now[field] - base[field] > floor:
+                regressions.append(
+                    f"{key}: {field} {now[field]:.3f}{unit} "
+                    f"(baseline {base[field]:.3f}{unit}, "
+                    f"+{now[field] / base[field] - 1:.0%})"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the 1/f processing stages")
+    parser.add_argument("names", nargs="*", help=f"any of {list(BENCHMARKS)}")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--sr", type=int, default=44100)
+    parser.add_argument(
+        "--repeat", type=int, default=None, help="default 3 (1 for --suite)"
+    )
+    suite = parser.add_argument_group("suite (every stage and the full chain)")
+    suite.add_argument("--suite", action="store_true", help="run the stage suite")
+    suite.add_argument(
+        "--durations", type=float, nargs="+", default=SUITE_SECONDS, help="seconds"
+    )
+    suite.add_argument("--rates", type=int, nargs="+", default=SUITE_RATES)
+    suite.add_argument("--stages", nargs="+", default=None, help="e.g. syn_rev chain")
+    suite.add_argument("--json", default=None, help="write the report here")
+    suite.add_argument("--baseline", default=BASELINE_FILE)
+    suite.add_argument(
+        "--save-baseline", action="store_true", help="store this run as the baseline"
+    )
+    suite.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    if args.suite:
+        import os
+        import sys
+        import json
+
+        # 長い曲もあるので、時間とメモリの山を1回ずつ測る
+        repeat = args.repeat or 1
+        report = run_suite(args.durations, args.rates, repeat, args.stages)
+        text = json.dumps(report, indent=2)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+
+        if args.save_baseline:
+            # 前の基準に無い組み合わせだけ足す・同じものは上書きする
+            if os.path.exists(args.baseline):
+                with open(args.baseline, encoding="utf-8") as f:
+                    stored = json.load(f)
+                stored["results"].update(report["results"])
+                stored["meta"] = report["meta"]
+                report = stored
+            with open(args.baseline, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+                f.write("\n")
+            print(f"baseline saved: {args.baseline}", file=sys.stderr)
+        elif os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+            regressions = compare_baseline(report, baseline, args.tolerance)
+            if regressions:
+                print("PERFORMANCE REGRESSION:", file=sys.stderr)
+                for line in regressions:
+                    print(f"  {line}", file=sys.stderr)
+                sys.exit(1)
+            print(f"no regressions against {args.baseline}", file=sys.stderr)
+        else:
+            print(
+                f"no baseline at {args.baseline} (use --save-baseline)", file=sys.stderr
+            )
+        sys.exit(0)
+
+    for name in args.names or BENCHMARKS:
+        results = BENCHMARKS[name](args.seconds, args.sr, args.repeat or 3)
+        base = next(iter(results.values()))
+        for key, sec in results.items():
+            # import の時間は曲の長さと関係ないので、基準との比だけ表示する
+            rate = "" if name == "import" else f"{args.seconds / sec:6.1f}x realtime, "
+            print(f"{name:>8} {key:<8} {sec:7.3f}s ({rate}{sec / base:4.2f}x)")
@@ -0,0 +1,107 @@
+import os
+import glob
+import hashlib
+import numpy as np
+
+# キャッシュのファイル名（中身のハッシュとサンプリングレート）
+CACHE_FILE = "{key}_{sr}.npy"
+
+
+def file_hash(path, chunk_size=2**20):
+    """ファイルの中身のハッシュ（ファイル名や場所が変わっても同じ曲なら同じ値）"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class decode_cache:
+    def __init__(self, directory, max_mb=2048):
+        """
+        デコード済みの音声（(channels, n) の float32）を .npy で取っておくキャッシュ
+        2回目からはデコードせずに np.load(mmap_mode="c") で開くので、読み込みはほぼ一瞬です。
+        モノラルは1chのまま取っておき（ディスクは半分）、開く時に左右に並べたビューにします。
+        （"c" はコピーオンライトなので、その場で加工してもキャッシュのファイルは変わらない）
+        合計が max_mb を超えたら、最後に使ってから一番時間が経ったファイルから消します。
+        :param directory: キャッシュの置き場所
+        :param max_mb: キャッシュ全体の上限 [MB]
+        """
+        self.directory = directory
+        self.max_bytes = max_mb * 2**20
+        # (パス, サイズ, 更新時刻) → ハッシュ（同じファイルを何度もハッシュしない）
+        self._keys = {}
+
+    def key(self, path):
+        stat = os.stat(path)
+        ident = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if ident not in self._keys:
+            self._keys[ident] = file_hash(path)
+        return self._keys[ident]
+
+    def _files(self, key="*"):
+        pattern = CACHE_FILE.format(key=key, sr="*")
+        return glob.glob(os.path.join(self.directory, pattern))
+
+    def _find(self, key):
+        found = self._files(key)
+        return found[0] if found else None
+
+    def load(self, path):
+        """
+        path の曲を (2, n) の float32 で返す（キャッシュに無ければデコードして保存する）
+        モノラルは同じ1chを左右に並べた読み取り専用のビューなので、書き換える時はコピーしてください。
+        （render_pipeline.render は読み取り専用の配列を渡されるとコピーしてから加工する）
+        :return: (data, sr)
+        """
+        key = self.key(path)
+        cached = self._find(key)
+        if cached is None:
+            cached = self._store(path, key)
+        else:
+            # 最終使用時刻として更新時刻を使う（LRUの順番）
+            os.utime(cached)
+
+        sr = int(os.path.basename(cached)[: -len(".npy")].rsplit("_", 1)[1])
+        data = np.load(cached, mmap_mode="c")
+        if data.shape[0] == 1:
+            # 左右に複製すると曲全体を読み込んでしまうので、メモリマップのままビューで並べる
+            data = np.broadcast_to(data, (2, data.shape[1]))
+        return data, sr
+
+    def _store(self, path, key):
+        from audio_io import load_audio
+
+        os.makedirs(self.directory, exist_ok=True)
+        data, sr = load_audio(path, stereo=False)
+        final = os.path.join(self.directory, CACHE_FILE.format(key=key, sr=sr))
+
+        # 書き込み途中のファイルを読まないように、別名で書いてから置き換える
+        tmp = final + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp, final)
+        del data
+
+        self.evict(keep=final)
+        return final
+
+    def evict(self, keep=None):
+        """合計が上限に収まるまで、古い順にキャッシュを消す（keep は消さない）"""
+        files = self._files()
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        for f in files:
+            if total <= self.max_bytes:
+                break
+            if f == keep:
+                continue
+            total -= os.path.getsize(f)
+            try:
+                os.remove(f)
+            except OSError:
+                pass  # Windows で他のプロセスが開いている時など（次回また消す）
+
+    def clear(self):
+        for f in self._files():
+            os.remove(f)
@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class fdn_reverb:
+    # 8本のディレイの長さ [ms]（互いに割り切れない長さにして、響きの周期を目立たせない）
+    delays_ms = [29.7, 37.1, 41.1, 43.7, 53.1, 59.3, 67.1, 73.7]
+
+    def __init__(self, sr, channels=2, t60_range=(0.8, 3.5), seed=0):
+        """
+        フィードバック・ディレイ・ネットワーク（FDN）による残響
+        部屋の広さ（残響時間）と拡散具合をサンプル列 room (0.0〜1.0) で動かせます。
+        状態はディレイ8本分だけなので、曲の長さに関係なく O(N) でブロック処理できます。
+        :param sr: サンプリングレート
+        :param channels: 入出力のチャンネル数
+        :param t60_range: room=0.0 と room=1.0 の時の残響時間 [秒]
+        :param seed: 出力タップの符号パターン用
+        """
+        self.sr = sr
+        self.channels = channels
+        self.t60_range = t60_range
+
+        self.delays = np.array([int(round(ms * sr / 1000)) for ms in self.delays_ms])
+        n_lines = len(self.delays)
+        self.n_lines = n_lines
+
+        # ディレイの一番短い長さまでは、フィードバックがブロック内に戻ってこないので
+        # まとめてベクトル計算できる
+        self.max_block = int(self.delays.min())
+        self.buffer_length = int(self.delays.max()) + self.max_block
+
+        # 入力：チャンネルを交互にディレイへ振り分ける
+        self.input_gain = np.zeros((n_lines, channels))
+        self.input_gain[np.arange(n_lines), np.arange(n_lines) % channels] = 1.0
+
+        # 出力：ディレイごとに符号を変えて左右の相関を下げる
+        rng = np.random.default_rng(seed)
+        signs = rng.choice([-1.0, 1.0], size=(channels, n_lines))
+        self.output_gain = signs / np.sqrt(n_lines / channels)
+
+        # パーフェクトシャッフル（ペアの回転と組み合わせて、数周で全ディレイが混ざる）
+        half = n_lines // 2
+        self._shuffle = np.ravel(
+            np.column_stack([np.arange(half), np.arange(half) + half])
+        )
+
+        self.reset()
+
+    def reset(self):
+        self._buffer = np.zeros((self.n_lines, self.buffer_length))
+        self._t = 0
+
+    def _feedback_matrix(self, diffusion):
+        """
+        拡散具合 diffusion (0.0〜1.0) に応じたフィードバック行列（常に直交行列なので安定）
+        ペアごとの回転角を 0（混ぜない）〜 π/4（均等に混ぜる）で動かします。
+        """
+        theta = diffusion * np.pi / 4
+        c, s = np.cos(theta), np.sin(theta)
+        rotation = np.zeros((self.n_lines, self.n_lines))
+        for i in range(0, self.n_lines, 2):
+            rotation[i : i + 2, i : i + 2] = [[c, -s], [s, c]]
+        return rotation[self._shuffle]
+
+    def process(self, x, room):
+        """
+        (channels, n) の入力に残響をかけて、Wet成分だけを返す
+        :param room: (n,) の 0.0（狭い・まばら）〜 1.0（広い・濃い）
+        """
+        n = x.shape[1]
+        out = np.empty((self.channels, n), dtype=np.result_type(x.dtype, np.float32))
+        lines = np.arange(self.n_lines)[:, np.newaxis]
+        t60_min, t60_max = self.t60_range
+
+        for start in range(0, n, self.max_block):
+            end = min(start + self.max_block, n)
+            L = end - start
+
+            # 1. 部屋の広さ → 残響時間 → 各ディレイの減衰量（ブロック内は一定）
+            r = float(np.mean(room[start:end]))
+            t60 = t60_min * (t60_max / t60_min) ** r
+            gains = 10.0 ** (-3.0 * self.delays / (t60 * self.sr))
+            matrix = self._feedback_matrix(0.3 + 0.7 * r)
+
+            # 2. ディレイの出力を読む（書き込みより max_block 以上前なので全部確定済み）
+            pos = self._t + np.arange(L)
+            read = self._buffer[
+                lines, (pos - self.delays[:, np.newaxis]) % self.buffer_length
+            ]
+
+            # 3. フィードバック + 入力 をディレイに書き込む
+            feedback = matrix @ (gains[:, np.newaxis] * read)
+            self._buffer[:, pos % self.buffer_length] = (
+                feedback + self.input_gain @ x[:, start:end]
+            )
+
+            # 4. 出力（残響時間が変わっても音量が変わらないようにエネルギーで補正）
+            norm = np.sqrt(1.0 - np.mean(gains**2))
+            out[:, start:end] = (self.output_gain @ read) * norm
+            self._t += L
+
+        return out
@@ -0,0 +1,104 @@
+import numpy as np
+
+from stage_profiler import span, traced
+
+
+@traced("normalise")
+def peak_after_gain(data, gain, chunk_size=2**16):
+    """
+    max(|data * gain|) を、掛け算した配列を作らずに求める
+    :param data: (channels, n)
+    :param gain: (n,) の倍率（全チャンネル共通）
+    """
+    peak = 0.0
+    for start in range(0, data.shape[1], chunk_size):
+        end = start + chunk_size
+        chunk_peak = np.max(np.abs(data[:, start:end]), axis=0)
+        peak = max(peak, float(np.max(chunk_peak * np.abs(gain[start:end]))))
+    return peak
+
+
+@traced("blend")
+def apply_gain(
+    data,
+    multiplier=None,
+    pan_curve=None,
+    depth_vol=1.0,
+    depth_pan=1.0,
+    chunk_size=2**16,
+):
+    """
+    Volume と Pan（と、それぞれの Depth ブレンド）を1つのゲインにまとめて、data に直接掛ける
+    syn_vol → ブレンド → syn_pan → ブレンド と順番にやった結果と同じになります。
+
+        Volume: data + (data * m / peak - data) * d_vol = data * (1 + d_vol * (m / peak - 1))
+        Pan:    x + (x * g_ch - x) * d_pan            = x * (1 + d_pan * (g_ch - 1))
+
+    ゲインはチャンクごとに作って掛けるので、曲の長さ分の一時配列は作りません。
+    :param data: (2, n) の音声（この配列を書き換える）
+    :param multiplier: syn_volume.make_curve の倍率カーブ（None なら Volume なし）
+    :param pan_curve: syn_pan.make_curve のパンカーブ（None なら Pan なし）
+    :return: data（書き換え済み）
+    """
+    # モノラル対策（syn_vol / syn_pan と同じ）
+    if np.mean(np.abs(data[1])) < 0.0001:
+        data[1] = data[0]
+
+    # syn_vol のノーマライズ（倍率を掛けた後の最大値で割る）
+    if multiplier is not None:
+        peak = peak_after_gain(data, multiplier, chunk_size)
+        scale = 1.0 / peak if peak > 0 else 1.0
+
+    for start in range(0, data.shape[1], chunk_size):
+        end = start + chunk_size
+        gain = np.ones((2, min(end, data.shape[1]) - start))
+
+        if multiplier is not None:
+            gain *= 1.0 + depth_vol * (multiplier[start:end] * scale - 1.0)
+
+        if pan_curve is not None:
+            # Constant Power Panning
+            pan = pan_curve[start:end]
+            gain[0] *= 1.0 + depth_pan * (np.sqrt(1.0 - pan) - 1.0)
+            gain[1] *= 1.0 + depth_pan * (np.sqrt(pan) - 1.0)
+
+        data[:, start:end] *= gain
+    return data
+
+
+@traced("blend")
+def blend_layer(data, layer, ratio=None, depth=1.0, normalize=False, chunk_size=2**16):
+    """
+    syn_tim / syn_rev のブレンドと Depth のブレンドを、data に直接書き込む
+    processed = data * (1 - ratio) + layer * ratio   （ratio が None なら layer そのもの）
+    data     += (processed / peak - data) * depth     （normalize=False なら peak = 1）
+    :param data: (2, n) の音声（この配列を書き換える）
+    :param layer: make_layer で作ったこもった音・Wet成分など（data と同じ形）
+    :param ratio: (n,) の混ぜる割合
+    :param normalize: True なら processed の最大値で割る（syn_rev のノーマライズ）
+    :return: data（書き換え済み）
+    """
+
+    def _processed(start, end):
+        if ratio is None:
+            return layer[:, start:end]
+        dry = data[:, start:end]
+        return dry + (layer[:, start:end] - dry) * ratio[start:end]
+
+    n = data.shape[1]
+    scale = 1.0
+    if normalize:
+        with span("normalise"):
+            peak = 0.0
+            for start in range(0, n, chunk_size):
+                peak = max(
+                    peak, float(np.max(np.abs(_processed(start, start + chunk_size))))
+                )
+        if peak > 0:
+            scale = 1.0 / peak
+
+    for start in range(0, n, chunk_size):
+        end = start + chunk_size
+        processed = _processed(start, end)
+        data[:, start:end] += (processed * scale - data[:, start:end]) * depth
+    return data
@@ -1,22 +1,42 @@
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
-import librosa
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import signal
 import threading
-import sounddevice as sd
-
-# Tkinterにグラフを埋め込むための魔法の呪文
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+import os
 
 # 既存モジュールのインポート
-from gui_play import gui_play as gp
-from syn_volume import syn_volume
-from syn_pan import syn_pan
-from syn_pitch import syn_pitch
-from syn_timbre import syn_timbre
-from syn_reverb import syn_reverb
+# （グラフ・再生・ファイル読み込みは使う時に読み込んで、起動を速くする）
+from pipeline import render_pipeline, stage_cache
+from one_f_bank import one_f_bank
+from decode_cache import decode_cache
+from stage_profiler import stage_profiler, span
+from psd_analysis import analysis_engine, zoom_window
+
+# one_f_bank.py で作ったゆらぎバンクの置き場所（無ければ毎回生成する）
+BANK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "one_f_bank")
+
+# 省メモリモードのメモリ上限 [MB]（環境変数 MUSIC_ONE_F_BUDGET_MB で変えられる）
+MEMORY_BUDGET_MB = int(os.environ.get("MUSIC_ONE_F_BUDGET_MB", 1024))
+
+# デコード済みの曲の置き場所と上限 [MB]（同じ曲ならデコードを飛ばす）
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "decode_cache")
+CACHE_MB = int(os.environ.get("MUSIC_ONE_F_CACHE_MB", 2048))
+
+# ステージの途中結果を取っておく上限 [MB]（Depth だけ変えた時はブレンドだけやり直す）
+STAGE_CACHE_MB = int(os.environ.get("MUSIC_ONE_F_STAGE_CACHE_MB", 1024))
+
+# 加工に使うスレッド数（左右のチャンネルや下準備を並列に処理する。結果は1スレッドと同じ）
+RENDER_WORKERS = int(os.environ.get("MUSIC_ONE_F_WORKERS", os.cpu_count() or 1))
+
+# これより長い曲 [秒] は区間に分けて、RENDER_WORKERS 個のプロセスで並列に加工する
+LONG_TRACK_SEC = int(os.environ.get("MUSIC_ONE_F_LONG_TRACK_SEC", 600))
+
+# グラフの PSD を何分の1に間引いてから解析するか（1 なら間引かない。長い曲を速く解析したい時に）
+ANALYSIS_DECIMATE = int(os.environ.get("MUSIC_ONE_F_ANALYSIS_DECIMATE", 1))
+
+# 1 ならプロファイルモード：各段階のメモリの山も測り、加工のたびに表をコンソールに出す
+# （tracemalloc でかなり遅くなるので、詳しく調べる時だけ）
+PROFILE = bool(int(os.environ.get("MUSIC_ONE_F_PROFILE", 0)))
 
 
 class MusicOneFApp:
@@ -39,6 +59,23 @@ class MusicOneFApp:
         self.depth_tim = tk.DoubleVar(value=1.0)
         self.depth_rev = tk.DoubleVar(value=1.0)
 
+        # リアルタイム再生（ブロック単位で加工しながら再生）
+        self.stream_mode = tk.BooleanVar(value=False)
+        # 省メモリモード（float32 のままその場で加工、MEMORY_BUDGET_MB を上限にする）
+        self.low_memory = tk.BooleanVar(value=False)
+        self.engine = None
+
+        # 作り置きのゆらぎバンク（あれば1/fゆらぎの生成を省略できる）
+        self.curve_bank = one_f_bank(BANK_DIR) if os.path.isdir(BANK_DIR) else None
+        self.audio_cache = decode_cache(CACHE_DIR, CACHE_MB)
+        self.stage_cache = stage_cache(STAGE_CACHE_MB)
+        # 同じ曲の間はゆらぎを固定する（スライダーだけ変えた時に途中結果を使い回すため）
+        self.render_seed = None
+        # 最後に加工した時の各段階の記録（Save Trace でトレースを書き出す）
+        self.profile = None
+        # グラフの解析（PSD）は裏のスレッドで行い、曲と加工の設定ごとに取っておく
+        self.analysis = analysis_engine(decimate=ANALYSIS_DECIMATE)
+
         self._create_widgets()
 
     def _create_widgets(self):
@@ -73,6 +110,17 @@ class MusicOneFApp:
         self._add_slider(frame_param, "Timbre", self.depth_tim)
         self._add_slider(frame_param, "Reverb", self.depth_rev)
 
+        ttk.Checkbutton(
+            frame_param,
+            text="Realtime Streaming (No Graph)",
+            variable=self.stream_mode,
+        ).pack(anchor="w", pady=2)
+        ttk.Checkbutton(
+            frame_param,
+            text=f"Low Memory (float32, {MEMORY_BUDGET_MB} MB budget)",
+            variable=self.low_memory,
+        ).pack(anchor="w", pady=2)
+
         # 3. 実行・停止ボタン
         frame_action = ttk.Frame(main_frame, padding=10)
         frame_action.pack(fill="x", pady=5)
@@ -85,6 +133,11 @@ class MusicOneFApp:
         btn_stop = ttk.Button(frame_action, text="STOP", command=self._stop_playback)
         btn_stop.pack(side="right", fill="x", expand=True, padx=5, ipady=5)
 
+        btn_trace = ttk.Button(
+            frame_action, text="Save Trace", command=self._save_trace
+        )
+        btn_trace.pack(side="right", padx=5, ipady=5)
+
         # ステータスバー
         lbl_status = ttk.Label(self.root, textvariable=self.status, relief="sunken")
         lbl_status.pack(side="bottom", fill="x")
@@ -103,9 +156,16 @@ class MusicOneFApp:
         )
         if path:
             self.file_path.set(path)
+            # 曲を選び直したら新しいゆらぎにする
+            self.render_seed = None
 
     def _stop_playback(self):
+        import sounddevice as sd
+
         sd.stop()
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
         self.status.set("Playback Stopped.")
 
     def _start_processing_thread(self):
@@ -114,90 +174,188 @@ class MusicOneFApp:
             messagebox.showwarning("Warning", "ファイルを選択してください！")
             return
 
+        if self.stream_mode.get():
+            self.status.set("Buffering...")
+            threading.Thread(target=self._stream_logic, daemon=True).start()
+            return
+
         self.status.set("Processing... (Please wait)")
         # 計算は重いので別スレッドで実行
         threading.Thread(target=self._process_logic, daemon=True).start()
 
+    def _stream_logic(self):
+        """先読みしながら再生するモード（曲全体の加工を待たない）"""
+        try:
+            import sounddevice as sd
+            from audio_io import open_blocks
+            from stream_engine import stream_engine
+
+            if self.engine is not None:
+                self.engine.stop()
+            sd.stop()
+
+            depths = {
+                "vol": self.depth_vol.get(),
+                "pan": self.depth_pan.get(),
+                "pit": self.depth_pit.get(),
+                "tim": self.depth_tim.get(),
+                "rev": self.depth_rev.get(),
+            }
+            blocks, sr = open_blocks(self.file_path.get(), 2048)
+            self.engine = stream_engine(sr, depths)
+            self.engine.start(
+                blocks,
+                finished_callback=lambda: self.root.after(
+                    0, self.status.set, "Playback Finished."
+                ),
+            )
+            self.root.after(0, self.status.set, "Playing (Streaming)...")
+
+        except Exception as e:
+            self.root.after(0, lambda msg=str(e): messagebox.showerror("Error", msg))
+            print(e)
+
+    def _show_progress(self, path, step):
+        """加工中の段階をステータスバーに出す（加工のスレッドから呼ばれる）"""
+        text = " > ".join(path[1:] if path[0] == "render" else path)
+        if step is not None:
+            text = f"[{step}] {text}"
+        self.root.after(0, self.status.set, f"Processing... {text}")
+
+    def _save_trace(self):
+        """最後の加工の記録を Chrome のトレース形式で保存する（chrome://tracing や Perfetto で開く）"""
+        if self.profile is None:
+            messagebox.showinfo("Info", "先に GENERATE & PLAY で加工してください")
+            return
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json", filetypes=[("Chrome Trace", "*.json")]
+        )
+        if path:
+            self.profile.export_chrome(path)
+            self.status.set(f"Trace saved: {os.path.basename(path)}")
+
     def _process_logic(self):
         """裏方で行う重い計算処理"""
+        # 各段階の処理時間（PROFILE ならメモリの山も）を記録して、進み具合をステータスバーに出す
+        profile = stage_profiler(memory=PROFILE, listener=self._show_progress)
         try:
-            path = self.file_path.get()
-
-            # 1. 読み込み
-            data, sr = librosa.load(path, mono=False, sr=None, duration=180)
-            if data.ndim == 1:
-                data = np.vstack([data, data])
-
-            be_data = data.copy()
-
-            # 2. バケツリレー加工 (GUIパラメータ注入)
-            # 各Depthを取得（スレッド内での参照は安全）
-            d_vol = self.depth_vol.get()
-            d_pan = self.depth_pan.get()
-            d_pit = self.depth_pit.get()
-            d_tim = self.depth_tim.get()
-            d_rev = self.depth_rev.get()
-
-            # (1) Volume
-            if d_vol > 0:
-                inst = syn_volume()
-                processed = inst.syn_vol(data, sr)
-                data = data + (processed - data) * d_vol
-
-            # (2) Pan
-            if d_pan > 0:
-                inst = syn_pan()
-                processed = inst.syn_pan(data, sr)
-                data = data + (processed - data) * d_pan
-
-            # (3) Pitch (ブレンド不可なので直接代入か、弱めるならmix)
-            if d_pit > 0:
-                inst = syn_pitch()
-                processed = inst.syn_pit(data, sr)
-                # Pitchはブレンドすると二重になるので、本来は内部パラメータを変えるべきだが
-                # 今回は 0 か 1 かの挙動に近い形になる
-                data = processed
-
-            # (4) Timbre
-            if d_tim > 0:
-                inst = syn_timbre()
-                processed = inst.syn_tim(data, sr)
-                data = data + (processed - data) * d_tim
-
-            # (5) Reverb
-            if d_rev > 0:
-                inst = syn_reverb()
-                processed = inst.syn_rev(data, sr)
-                data = data + (processed - data) * d_rev
-
-            # 最終ノーマライズ
-            max_val = np.max(np.abs(data))
-            if max_val > 0:
-                data = data / max_val
-
-            # 計算完了！ -> メインスレッドに「描画と再生」を依頼する
-            # root.after(0, 関数, 引数...) を使うと、安全にメインスレッドで実行できる
-            self.root.after(0, self._finish_processing, be_data, data, sr)
+            with profile.activate():
+                path = self.file_path.get()
+
+                # 1. 読み込み
+                # 長さの制限なし（ブロックごとにデコードして、曲の長さの配列1つに書き込む）
+                # 2回目からはデコード済みのキャッシュをメモリマップで開くだけ
+                with span("decode", "io"):
+                    data, sr = self.audio_cache.load(path)
+                source_key = self.audio_cache.key(path)
+
+                # グラフ（波形とPSD）は左チャンネルしか使わないので、原曲は1ch分だけ残す
+                # （原曲の PSD を取ってあれば、波形の拡大表示の部分だけ）
+                low_memory = self.low_memory.get()
+                original_key = ("original", source_key)
+                be_zoom = zoom_window(data, sr)
+                be_left = None if self.analysis.cached(original_key) else data[0].copy()
+
+                # 2. バケツリレー加工 (GUIパラメータ注入)
+                # 各Depthを取得（スレッド内での参照は安全）
+                depths = {
+                    "vol": self.depth_vol.get(),
+                    "pan": self.depth_pan.get(),
+                    "pit": self.depth_pit.get(),
+                    "tim": self.depth_tim.get(),
+                    "rev": self.depth_rev.get(),
+                }
+                if self.render_seed is None:
+                    self.render_seed = int(np.random.default_rng().integers(2**31))
+                long_track = data.shape[1] > LONG_TRACK_SEC * sr
+                if long_track and not low_memory and RENDER_WORKERS > 1:
+                    # 長い曲は区間に分けてプロセスプールで加工する（途中結果のキャッシュは使わない）
+                    from segment_render import segment_renderer
+
+                    pipeline = segment_renderer(
+                        sr,
+                        depths,
+                        processes=RENDER_WORKERS,
+                        seed=self.render_seed,
+                        curve_bank=self.curve_bank,
+                    )
+                else:
+                    # 省メモリモードでは途中結果を取っておかない（メモリの上限を優先する）
+                    pipeline = render_pipeline(
+                        sr,
+                        depths,
+                        float32=low_memory,
+                        budget_mb=MEMORY_BUDGET_MB if low_memory else None,
+                        curve_bank=self.curve_bank,
+                        seed=self.render_seed,
+                        cache=None if low_memory else self.stage_cache,
+                        source_key=source_key,
+                        workers=RENDER_WORKERS,
+                    )
+                data = pipeline.render(data)
+
+                # 計算完了！ -> メインスレッドに「再生」を依頼する
+                # root.after(0, 関数, 引数...) を使うと、安全にメインスレッドで実行できる
+                self.root.after(0, self._finish_processing, data, sr, pipeline.memory)
+
+                # グラフの解析は裏のスレッドで行い、終わったらメインスレッドで描くだけ
+                render_key = (
+                    "processed",
+                    source_key,
+                    self.render_seed,
+                    tuple(depths.items()),
+                    low_memory,
+                    type(pipeline).__name__,
+                )
+                self.analysis.submit(
+                    sr,
+                    (original_key, be_left),
+                    (render_key, data[0]),
+                    (be_zoom, zoom_window(data, sr)),
+                    callback=lambda result: self.root.after(
+                        0, self._show_stable_graph, result
+                    ),
+                )
+            if PROFILE:
+                print(profile.report())
 
         except Exception as e:
             # エラー時もメインスレッドでメッセージを出す
             self.root.after(0, lambda: messagebox.showerror("Error", str(e)))
             print(e)
+        finally:
+            # 途中で失敗した時も、そこまでの記録はトレースに書き出せるようにする
+            self.profile = profile
 
-    def _finish_processing(self, be_data, data, sr):
-        """メインスレッドで行う描画と再生"""
-        self.status.set("Playing...")
+    def _finish_processing(self, data, sr, memory):
+        """メインスレッドで行う再生（グラフは解析が終わったら _show_stable_graph で描く）"""
+        import sounddevice as sd
+
+        summary = memory.summary()
+        self.status.set(f"Playing... ({summary})" if summary else "Playing...")
 
         # 1. 再生開始 (非同期)
+        # リアルタイム再生が動いていたら止める（2つの出力が重なって鳴らないように）
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
         if data.dtype != np.float32:
             data = data.astype(np.float32)
         sd.play(data.T, sr)
 
-        # 2. グラフ描画 (安全な別ウィンドウ)
-        self._show_stable_graph(be_data, data, sr)
-
-    def _show_stable_graph(self, be_data, data, sr):
-        """Tkinter Toplevelを使った安全なグラフ表示"""
+    def _show_stable_graph(self, result):
+        """
+        Tkinter Toplevelを使った安全なグラフ表示
+        :param result: analysis_engine が裏のスレッドで作った、描くだけの配列
+        """
+        # pyplot を通さずに Figure を作る（描くたびに pyplot に図が溜まっていかない）
+        from matplotlib.figure import Figure
+
+        # Tkinterにグラフを埋め込むための魔法の呪文
+        from matplotlib.backends.backend_tkagg import (
+            FigureCanvasTkAgg,
+            NavigationToolbar2Tk,
+        )
 
         # 既にグラフウィンドウが開いていたら閉じてリセット
         if self.graph_window is not None and self.graph_window.winfo_exists():
@@ -209,39 +367,20 @@ class MusicOneFApp:
         self.graph_window.geometry("800x600")
 
         # MatplotlibのFigureを作成
-        fig, ax = plt.subplots(2, 1, figsize=(8, 6))
+        fig = Figure(figsize=(8, 6))
+        ax = fig.subplots(2, 1)
 
         # (A) Waveform
-        zoom_limit = int(0.01 * sr)
-        start_sample = int(0.5 * sr)
-        if start_sample + zoom_limit > data.shape[1]:
-            start_sample = 0
-
-        ax[0].plot(
-            be_data[0, start_sample : start_sample + zoom_limit],
-            alpha=0.8,
-            label="Original",
-        )
-        ax[0].plot(
-            data[0, start_sample : start_sample + zoom_limit],
-            alpha=0.6,
-            label="Processed",
-        )
+        be_zoom, af_zoom = result["zoom"]
+        ax[0].plot(be_zoom, alpha=0.8, label="Original")
+        ax[0].plot(af_zoom, alpha=0.6, label="Processed")
         ax[0].set_title("Waveform Zoom (0.01s)")
         ax[0].legend(loc="upper right")
 
         # (B) PSD (Ideal 1/f)
-        f_be, Pxx_be = signal.welch(be_data[0], sr, nperseg=1024)
-        f_af, Pxx_af = signal.welch(data[0], sr, nperseg=1024)
-
-        # 理想直線の計算
-        f_ideal = f_af.copy()
-        f_ideal[0] = 1e-10
-        P_ideal = 1.0 / f_ideal
-        ref_mask = (f_af > 100) & (f_af < 1000)
-        if np.sum(ref_mask) > 0:
-            scale_factor = np.mean(Pxx_af[ref_mask]) / np.mean(P_ideal[ref_mask])
-            P_ideal = P_ideal * scale_factor
+        f_be, Pxx_be = result["original"]
+        f_af, Pxx_af = result["processed"]
+        f_ideal, P_ideal = result["ideal"]
 
         ax[1].loglog(f_be, Pxx_be, label="Original", alpha=0.5)
         ax[1].loglog(f_af, Pxx_af, label="Processed")
@@ -250,7 +389,7 @@ class MusicOneFApp:
         ax[1].legend(loc="upper right")
         ax[1].grid(True, which="both", linestyle="--")
 
-        plt.tight_layout()
+        fig.tight_layout()
 
         # FigureをTkinterウィンドウに埋め込む
         canvas = FigureCanvasTkAgg(fig, master=self.graph_window)
@@ -0,0 +1,165 @@
+import os
+import json
+import argparse
+import warnings
+import numpy as np
+
+import one_f_generator as ofg
+import smoothing as smt
+
+# 移動平均の窓ごとに1ファイル（syn_volume/syn_pan は 50、syn_pitch/syn_timbre/syn_reverb は 2000）
+BANK_FILE = "one_f_w{window}.npy"
+DEFAULT_WINDOWS = (50, 2000)
+# バンクを作った時の設定（ref_length）。無い時は build_bank の既定値で作ったものとみなす
+BANK_META = "one_f_bank.json"
+DEFAULT_REF_LENGTH = 180 * 44100
+
+
+def build_bank(
+    directory,
+    n_samples,
+    window_sizes=DEFAULT_WINDOWS,
+    ref_length=DEFAULT_REF_LENGTH,
+    seed=None,
+    chunk_size=2**20,
+):
+    """
+    移動平均済みの1/fゆらぎを大量に作って .npy に書き出す（ゆらぎバンク）
+    streaming_one_f からチャンクごとに作るので、バンクがどれだけ長くてもメモリは一定です。
+    :param directory: 書き出し先のフォルダ
+    :param n_samples: 1ファイルあたりのサンプル数
+    :param window_sizes: 作り置きする移動平均の窓
+    :param ref_length: ゆらぎの振幅を合わせる長さ（generate_one_f(ref_length) 相当）
+        one_f_bank.take は切り出す長さに合わせて振幅を直すので、どの長さの曲にも使えます。
+    :param seed: int または numpy.random.Generator
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    paths = []
+    for window_size in window_sizes:
+        path = os.path.join(directory, BANK_FILE.format(window=window_size))
+        bank = np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.float32, shape=(n_samples,)
+        )
+        source = ofg.streaming_one_f(ref_length, seed=rng)
+
+        # 移動平均に必要な前後の余白（np.convolve の mode="same" と同じ中心合わせ）
+        tail = (window_size - 1) // 2
+        head = window_size - 1 - tail
+
+        # 先頭も余白から読んでおくと、端のゼロ埋めによる落ち込みが出ない
+        raw = source.read(head + tail)
+        for start in range(0, n_samples, chunk_size):
+            n = min(chunk_size, n_samples - start)
+            raw = np.concatenate([raw, source.read(n)])
+            bank[start : start + n] = smt.moving_average(raw, window_size)[
+                head : head + n
+            ]
+            raw = raw[n:]
+
+        bank.flush()
+        del bank
+        paths.append(path)
+
+    with open(os.path.join(directory, BANK_META), "w", encoding="utf-8") as f:
+        json.dump({"ref_length": int(ref_length)}, f)
+    return paths
+
+
+class one_f_bank:
+    def __init__(self, directory, seed=None, flip=True, reverse=True):
+        """
+        作り置きしたゆらぎバンクからランダムに切り出して使うクラス
+        np.load(mmap_mode="r") で開くので、使う区間だけがディスクから読まれます。
+        :param directory: build_bank で書き出したフォルダ
+        :param seed: int または numpy.random.Generator
+        :param flip: 切り出したカーブをランダムに上下反転する（中心 1 を軸に）
+        :param reverse: 切り出したカーブをランダムに時間反転する
+        """
+        self.directory = directory
+        self.rng = np.random.default_rng(seed)
+        self.flip = flip
+        self.reverse = reverse
+        self._banks = {}
+        self._used = {}  # 窓ごとの使用済み区間（同じレンダリング内で重ならないように）
+
+        self.ref_length = DEFAULT_REF_LENGTH
+        meta = os.path.join(directory, BANK_META)
+        if os.path.exists(meta):
+            with open(meta, encoding="utf-8") as f:
+                self.ref_length = json.load(f)["ref_length"]
+
+    def _open(self, window_size):
+        if window_size not in self._banks:
+            path = os.path.join(self.directory, BANK_FILE.format(window=window_size))
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No fluctuation bank for window {window_size}")
+            self._banks[window_size] = np.load(path, mmap_mode="r")
+        return self._banks[window_size]
+
+    def reset(self):
+        """レンダリングごとに呼ぶ（使用済み区間をリセット）"""
+        self._used.clear()
+
+    def fits(self, length, window_sizes=DEFAULT_WINDOWS):
+        """length サンプルのカーブをすべての窓のバンクから切り出せるか"""
+        try:
+            return all(len(self._open(w)) >= length for w in window_sizes)
+        except FileNotFoundError:
+            return False
+
+    def take(self, length, window_size, max_tries=100):
+        """
+        移動平均済みのカーブを length サンプル分切り出す
+        同じ reset() の間は、同じ窓のバンクからなるべく重ならない区間を選びます。
+        （空きが見つからない時は重なりを許して、RuntimeWarning を出して切り出す）
+        generate_one_f(length) のゆらぎは長さの平方根に反比例して小さくなるので、
+        バンクの ref_length と length の比で 1 からのずれを直して、同じ大きさに揃えます。
+        """
+        bank = self._open(window_size)
+        if length > len(bank):
+            raise ValueError(
+                f"Fluctuation bank is too short ({len(bank)} < {length} samples)"
+            )
+
+        used = self._used.setdefault(window_size, [])
+        for _ in range(max_tries):
+            start = int(self.rng.integers(0, len(bank) - length + 1))
+            end = start + length
+            if all(end <= s or start >= e for s, e in used):
+                break
+        else:
+            warnings.warn(
+                "Fluctuation bank is crowded, reusing an overlapping slice",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+        used.append((start, end))
+
+        curve = np.array(bank[start:end], dtype=np.float64)
+        curve -= 1.0
+        curve *= np.sqrt(self.ref_length / length)
+        curve += 1.0
+        if self.reverse and self.rng.random() < 0.5:
+            curve = curve[::-1].copy()
+        if self.flip and self.rng.random() < 0.5:
+            curve = 2.0 - curve
+        return curve
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a 1/f fluctuation bank")
+    parser.add_argument("directory", help="output folder")
+    parser.add_argument("--minutes", type=float, default=30.0)
+    parser.add_argument("--sr", type=int, default=44100)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    for path in build_bank(
+        args.directory,
+        int(args.minutes * 60 * args.sr),
+        ref_length=180 * args.sr,
+        seed=args.seed,
+    ):
+        print(f"Wrote {path}")
@@ -1,45 +1,83 @@
 import numpy as np
-import matplotlib.pyplot as plt
+from scipy import fft as sp_fft
+from scipy import signal
+
+from stage_profiler import traced
+
+
+@traced("1/f generation")
+def generate_one_f_batch(
+    length: int, n_curves: int = 1, dtype=np.float64, seed=None
+) -> np.ndarray:
+    """
+    独立した1/fゆらぎを n_curves 本まとめて生成する
+    実数FFT（rfft/irfft）を1回のバッチで行い、長さはFFTが速いサイズに切り上げてから切り詰めます。
+    :param length: 1本あたりのサンプル数
+    :param n_curves: 生成する本数
+    :param dtype: np.float64 または np.float32（メモリ半分）
+    :param seed: int または numpy.random.Generator（同じ seed なら同じゆらぎを再現）
+        n_curves 個の seed のリストなら、i 本目は i 番目の seed の乱数だけから作る
+        （何本まとめて作っても、それぞれのゆらぎは1本ずつ作った時と同じ）
+    :return: (n_curves, length) の配列（* 100 + 1 のスケーリングは従来通り）
+    """
+    n_fft = sp_fft.next_fast_len(length, real=True)
+
+    # 1. ホワイトノイズ生成 (-0.5 〜 0.5)
+    if isinstance(seed, (list, tuple)):
+        if len(seed) != n_curves:
+            raise ValueError(f"Expected {n_curves} seeds, got {len(seed)}")
+        white_noise = np.empty((n_curves, n_fft), dtype=dtype)
+        for row, row_seed in zip(white_noise, seed):
+            np.random.default_rng(row_seed).random(dtype=dtype, out=row)
+    else:
+        white_noise = np.random.default_rng(seed).random((n_curves, n_fft), dtype=dtype)
+    white_noise -= 0.5
+
+    # 2. 実数FFT（正の周波数だけ計算するので複素FFTの約半分の手間）
+    spectrum = sp_fft.rfft(white_noise, axis=-1)
+
+    # 3. 1/f特性の適用
+    # 従来の複素FFT版は k 番目を 1/sqrt(k)、鏡像の n-k 番目を 1/sqrt(n-k) で割っていたので、
+    # 実部だけを見ると両者の平均で割ったのと同じになる（DC成分は 1 のまま）
+    k = np.arange(spectrum.shape[-1], dtype=dtype)
+    k[0] = 1
+    weights = (1 / np.sqrt(k) + 1 / np.sqrt(n_fft - k)) / 2
+    weights[0] = 1
+    spectrum *= weights
+
+    # 4. 逆FFTで時間領域へ戻して、必要な長さに切り詰める
+    pink = sp_fft.irfft(spectrum, n=n_fft, axis=-1)[:, :length]
+
+    # 5. スケーリング
+    # ※ 既存のチューニングを維持するため、元の係数(* 100 + 1)を保持
+    pink *= 100
+    pink += 1
+    return pink.astype(dtype, copy=False)
 
 
 class generate_one_f:
-    def __init__(self, duration: int):
+    def __init__(self, duration: int, seed=None, dtype=np.float64):
         """
         初期化と同時に1/fゆらぎを生成します。
         :param duration: 生成するサンプルの長さ
+        :param seed: int または numpy.random.Generator（再現したい時だけ指定）
+        :param dtype: np.float64 または np.float32
         """
         self.duration = duration
+        self.seed = seed
+        self.dtype = dtype
         self.ifft_real_result = self._generate_pink_noise(duration)
 
     def _generate_pink_noise(self, n_samples: int) -> np.ndarray:
         """
         1/fゆらぎ（ピンクノイズ）を生成する内部メソッド
         """
-        # 1. ホワイトノイズ生成 (-0.5 〜 0.5)
-        white_noise = np.random.rand(n_samples) - 0.5
-
-        # 2. FFT（周波数領域へ変換）
-        fft_result = np.fft.fft(white_noise)
-
-        # 3. 1/f特性の適用 (振幅を 1/sqrt(f) でスケーリング)
-        # 0番目(DC成分)の除算エラーを防ぐため 1 を代入
-        freqs = np.arange(n_samples)
-        freqs[0] = 1
-
-        # ピンクノイズ化フィルタ
-        pink_spectrum = fft_result / np.sqrt(freqs)
-
-        # 4. IFFT（時間領域へ戻す）
-        ifft_result = np.fft.ifft(pink_spectrum)
-
-        # 5. 実部の取り出しとスケーリング
-        # ※ 既存のチューニングを維持するため、元の係数(* 100 + 1)を保持
-        final_signal = ifft_result.real * 100 + 1
-
-        return final_signal
+        return generate_one_f_batch(n_samples, 1, self.dtype, self.seed)[0]
 
     def one_f_visualize(self):
         """生成されたゆらぎをグラフで確認"""
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(10, 4))
         plt.plot(self.ifft_real_result)
         plt.title("1/f Fluctuation (Pink Noise)")
@@ -49,6 +87,192 @@ class generate_one_f:
         plt.show()
 
 
+def control_length(length: int, sr: int, control_sr: float) -> int:
+    """コントロールレートで必要な点数（音声の最後のサンプルまで補間できるように1点余分）"""
+    return int(np.ceil((length - 1) * control_sr / sr)) + 2
+
+
+class control_one_f:
+    def __init__(
+        self, length: int, sr: int, control_sr: float = 500, raw=None, seed=None
+    ):
+        """
+        1/fゆらぎを間引いたレート（コントロールレート）で生成するクラス
+        ゆらぎは数Hzでしか動かないので、音声と同じレートで作る必要はありません。
+        使う場所で expand() を呼んで、音声レートに線形補間して引き伸ばします。
+        :param length: 音声側のサンプル数
+        :param sr: 音声のサンプリングレート
+        :param control_sr: ゆらぎを生成するレート（200Hz〜1kHz 程度）
+        :param raw: generate_one_f_batch で作り置きしたカーブ（control_length 点以上）
+        :param seed: int または numpy.random.Generator
+        """
+        self.length = length
+        self.sr = sr
+        self.control_sr = control_sr
+        self.hop = sr / control_sr  # コントロール1点あたりの音声サンプル数
+
+        n_control = control_length(length, sr, control_sr)
+        if raw is None:
+            raw = generate_one_f(n_control, seed=seed).ifft_real_result
+        raw = raw[:n_control]
+
+        # 同じ周波数成分でも、短く作ると振幅が sqrt(length / n_control) 倍になるので戻しておく
+        # （* 100 + 1 の中心 1 はそのまま）
+        scale = np.sqrt(n_control / length)
+        self.ifft_real_result = (raw - 1) * scale + 1
+
+    @traced("interpolation")
+    def expand(self, curve: np.ndarray, start: int = 0, n_samples: int = None):
+        """
+        コントロールレートのカーブを音声レートに線形補間する
+        :param start: 音声側の開始サンプル
+        :param n_samples: 音声側のサンプル数（省略時は最後まで）
+        """
+        if n_samples is None:
+            n_samples = self.length - start
+        positions = (start + np.arange(n_samples)) / self.hop
+        return np.interp(positions, np.arange(len(curve)), curve)
+
+
+def one_f_curve(
+    length: int,
+    sr: int,
+    curve_fn,
+    control_sr: float = None,
+    raw=None,
+    seed=None,
+    bank=None,
+    window_size: int = None,
+):
+    """
+    1/fゆらぎを生成し、curve_fn で加工した音声レートのカーブを返す
+    :param curve_fn: curve_fn(raw, hop, smoothed) の形の加工関数（hop はコントロール1点あたりのサンプル数）
+    :param control_sr: 指定するとコントロールレートで生成・加工してから引き伸ばす
+    :param raw: generate_one_f_batch で作り置きした生カーブ（省略時はここで生成）
+    :param seed: int または numpy.random.Generator
+    :param bank: one_f_bank.one_f_bank（指定すると移動平均済みのカーブを切り出して使う）
+    :param window_size: bank から切り出す時の移動平均の窓
+    :return: (生成器, 音声レートのカーブ)
+    """
+    if bank is not None:
+        if control_sr is not None:
+            raise ValueError("A fluctuation bank cannot be combined with control_sr")
+        return None, curve_fn(bank.take(length, window_size), 1.0, True)
+
+    if control_sr is None:
+        if raw is None:
+            gen = generate_one_f(length, seed=seed)
+            raw = gen.ifft_real_result
+        else:
+            gen = None
+        return gen, curve_fn(raw[:length], 1.0)
+
+    gen = control_one_f(length, sr, control_sr, raw=raw, seed=seed)
+    return gen, gen.expand(curve_fn(gen.ifft_real_result, gen.hop))
+
+
+class streaming_one_f:
+    def __init__(self, ref_length: int, seed=None, dtype=np.float64):
+        """
+        1/fゆらぎを少しずつ（チャンク単位で）作り続けるクラス
+        1オクターブおきの時定数を持つ1次IIRローパス（AR(1)）を並べ、ホワイトノイズを通して足し合わせます。
+        各フィルタが同じ分散を持つと、足し合わせたスペクトルは 1/f になります。
+        フィルタの状態を持ち越すので、チャンクの境目でも途切れず、メモリも一定です。
+        :param ref_length: generate_one_f(ref_length) と同じ振幅・最低周波数になるように合わせる長さ
+        :param seed: int または numpy.random.Generator
+        :param dtype: 出力の型
+        """
+        self.ref_length = ref_length
+        self.dtype = dtype
+        self.rng = np.random.default_rng(seed)
+
+        # 1/ref_length（FFT版の最低周波数）〜 ナイキストまで 1オクターブおきに極を置く
+        n_poles = max(1, int(np.floor(np.log2(ref_length / 2))) + 1)
+        freqs = 2.0 ** np.arange(n_poles) / ref_length
+        self.poles = np.exp(-2 * np.pi * freqs)
+        # 各フィルタの出力分散を1にする係数（入力は分散 1/12 の一様ノイズ）
+        self.inputs = np.sqrt(12 * (1 - self.poles**2))
+
+        # FFT版の片側スペクトル密度 σ²/(2fN)（σ² = 1/12）に合わせるゲイン
+        # （1オクターブおきに並べた分散1のAR(1)の和は、おおよそ 1/(f ln2)）
+        self.gain = np.sqrt((1 / 12) * np.log(2) / (2 * ref_length))
+
+        # 定常状態から始める（最初のチャンクだけ振幅が小さい、を防ぐ）
+        self._state = self.rng.standard_normal(n_poles)
+
+    def read(self, n_samples: int) -> np.ndarray:
+        """続きのゆらぎを n_samples 分返す（* 100 + 1 のスケーリングは generate_one_f と同じ）"""
+        # 正規乱数より一様乱数の方が速い（フィルタを通すとほぼ正規分布になる）
+        white_noise = self.rng.random((len(self.poles), n_samples)) - 0.5
+        pink = np.zeros(n_samples)
+        for i, (pole, b) in enumerate(zip(self.poles, self.inputs)):
+            y, _ = signal.lfilter(
+                [b], [1, -pole], white_noise[i], zi=[pole * self._state[i]]
+            )
+            if n_samples > 0:
+                self._state[i] = y[-1]
+            pink += y
+
+        return (pink * (self.gain * 100) + 1).astype(self.dtype, copy=False)
+
+
+class one_f_blocks:
+    def __init__(self, segment_length: int, curve_fn=None, fade_length: int = None):
+        """
+        1/fゆらぎをブロック単位で少しずつ取り出すためのクラス（ストリーミング再生用）
+        ゆらぎは streaming_one_f から途切れなく読み出し、segment_length ごとに curve_fn で加工します。
+        加工（平均引きや正規化）は区間ごとなので、区間を少し重ねてクロスフェードでつなぎます。
+        :param segment_length: 1区間のサンプル数（メモリ使用量はこの長さで頭打ち）
+        :param curve_fn: 区間ごとの生カーブに掛ける加工（スムージング・正規化など）
+        :param fade_length: クロスフェードの長さ（省略時は区間の1/8）
+        """
+        self.segment_length = segment_length
+        self.curve_fn = curve_fn
+        if fade_length is None:
+            fade_length = segment_length // 8
+        self.fade_length = fade_length
+
+        self.source = streaming_one_f(segment_length)
+        self._buffer = np.zeros(0)
+        self._tail = None
+        self._overlap = np.zeros(0)
+
+    def _next_segment(self) -> np.ndarray:
+        # 前の区間の終わり（fade_length 分）と同じ生カーブから始めて、新しい分だけ読み足す
+        new = self.source.read(self.segment_length - len(self._overlap))
+        raw = np.concatenate([self._overlap, new])
+        self._overlap = raw[len(raw) - self.fade_length :]
+        if self.curve_fn is not None:
+            raw = self.curve_fn(raw)
+        return raw
+
+    def _extend(self):
+        segment = self._next_segment()
+        fade = self.fade_length
+
+        if self._tail is not None and fade > 0:
+            # 前の区間の終わりと新しい区間の頭を重ねてつなぐ（段差によるプチノイズ防止）
+            ramp = np.linspace(0.0, 1.0, fade)
+            segment = segment.copy()
+            segment[:fade] = self._tail * (1 - ramp) + segment[:fade] * ramp
+
+        # 末尾は次の区間とのクロスフェード用に取っておく
+        if fade > 0:
+            body, self._tail = segment[:-fade], segment[-fade:]
+        else:
+            body = segment
+        self._buffer = np.concatenate([self._buffer, body])
+
+    def read(self, n_samples: int) -> np.ndarray:
+        """続きのゆらぎを n_samples 分返す"""
+        while len(self._buffer) < n_samples:
+            self._extend()
+
+        out = self._buffer[:n_samples]
+        self._buffer = self._buffer[n_samples:]
+        return out
+
+
 # テスト用
 if __name__ == "__main__":
     gen = generate_one_f(1000)
@@ -0,0 +1,192 @@
+import numpy as np
+from scipy import fft as sp_fft
+
+from stage_profiler import traced
+
+
+def partition_ir(ir, block_size):
+    """
+    IRを block_size ごとに区切って、それぞれ 2*block_size 点で FFT する（後ろ半分はゼロ）
+    :return: (区画数, block_size + 1) の複素スペクトル
+    """
+    ir = np.asarray(ir, dtype=np.float64)
+    n_parts = max(1, int(np.ceil(len(ir) / block_size)))
+    parts = np.zeros((n_parts, block_size))
+    parts.flat[: len(ir)] = ir
+    return sp_fft.rfft(parts, n=2 * block_size, axis=-1)
+
+
+def stack_spectra(spectra_list, gains=None):
+    """
+    複数のIRの分割スペクトルを (IRの数, 区画数, block_size + 1) にまとめる
+    区画数が違うものは後ろをゼロで埋めて一番長いIRに揃えます。
+    :param gains: IRごとに掛ける倍率（音量を揃えたい時）
+    """
+    n_parts = max(len(spectra) for spectra in spectra_list)
+    n_bins = spectra_list[0].shape[-1]
+    stacked = np.zeros((len(spectra_list), n_parts, n_bins), dtype=np.complex128)
+    for i, spectra in enumerate(spectra_list):
+        stacked[i, : len(spectra)] = spectra
+        if gains is not None:
+            stacked[i] *= gains[i]
+    return stacked
+
+
+class partitioned_convolver:
+    def __init__(self, ir=None, block_size=4096, channels=2, ir_spectra=None):
+        """
+        一様分割FFT畳み込み（Uniformly Partitioned Overlap-Save）
+        IRを block_size ごとに区切って周波数領域で持っておき、入力をブロック単位で畳み込みます。
+        メモリはIRの長さとブロックサイズだけで決まり、曲の長さには依存しません。
+        :param ir: インパルス応答（1次元）
+        :param block_size: 1区画のサンプル数（小さいほど低遅延、大きいほどオフライン向き）
+        :param channels: 同時に処理するチャンネル数（全チャンネルを1回のFFTでまとめて処理）
+        :param ir_spectra: partition_ir で作り置きしたスペクトル（指定時は ir は不要）
+            stack_spectra でまとめた複数IRのスペクトルを渡すと、入力のFFTを共有して
+            全IRを同時に畳み込みます（IRバンク）。
+        """
+        self.block_size = block_size
+        self.channels = channels
+        self.fft_size = 2 * block_size
+
+        # IRを区切って、それぞれ FFT しておく
+        if ir_spectra is None:
+            ir_spectra = partition_ir(ir, block_size)
+        self.ir_spectra = ir_spectra
+        # 内部では常に (IRの数, 区画数, ビン数) で扱う
+        self.n_irs = ir_spectra.shape[0] if ir_spectra.ndim == 3 else None
+        self._spectra = ir_spectra if self.n_irs else ir_spectra[np.newaxis]
+        self.n_parts = self._spectra.shape[1]
+
+        self.reset()
+
+    def reset(self):
+        """状態（入力の履歴）をクリアする"""
+        n_bins = self.block_size + 1
+        # 過去の入力スペクトル（リングバッファ、_head が一番新しい）
+        self._fdl = np.zeros(
+            (self.channels, self.n_parts - 1, n_bins), dtype=np.complex128
+        )
+        self._head = -1
+        self._prev = np.zeros((self.channels, self.block_size))
+        self._cur = np.zeros((self.channels, self.block_size))
+        self._fill = 0
+        self._acc = None
+
+    def process(self, block, weights=None):
+        """
+        (channels, n) のブロックを畳み込んで、同じ長さの出力を返す（遅延なし）
+        n は block_size と揃っていると一番速いですが、任意の長さでも正しく動きます。
+        IRバンクの時は (IRの数, channels, n) を返します。
+        :param weights: IRバンクの時に (IRの数, n) を渡すと、サンプルごとの重みで
+            各IRの出力を混ぜた (channels, n) を返す（クロスフェード）
+        """
+        block = np.asarray(block)
+        n = block.shape[1]
+        out = np.empty((len(self._spectra), self.channels, n))
+        B = self.block_size
+
+        pos = 0
+        while pos < n:
+            take = min(B - self._fill, n - pos)
+            self._cur[:, self._fill : self._fill + take] = block[:, pos : pos + take]
+
+            # 古い区画の寄与はブロックが変わるまで同じなので1回だけ計算する
+            if self._acc is None:
+                self._acc = self._past_contribution()
+
+            # Overlap-Save： [前のブロック, 今のブロック] をFFTして後ろ半分を使う
+            frame = np.concatenate([self._prev, self._cur], axis=1)
+            spectrum = sp_fft.rfft(frame, axis=-1)
+            y = sp_fft.irfft(
+                spectrum * self._spectra[:, np.newaxis, 0] + self._acc,
+                n=self.fft_size,
+                axis=-1,
+            )[..., B:]
+
+            # まだ埋まっていない部分はゼロ扱いだが、因果的なので手前の出力は正しい
+            out[..., pos : pos + take] = y[..., self._fill : self._fill + take]
+            self._fill += take
+            pos += take
+
+            # ブロックが埋まったら履歴に送る
+            if self._fill == B:
+                if self.n_parts > 1:
+                    self._head = (self._head + 1) % (self.n_parts - 1)
+                    self._fdl[:, self._head] = spectrum
+                self._prev, self._cur = self._cur, self._prev
+                self._cur[:] = 0
+                self._fill = 0
+                self._acc = None
+
+        if weights is not None:
+            return np.einsum("in,icn->cn", weights, out)
+        if self.n_irs is None:
+            return out[0]
+        return out
+
+    def _past_contribution(self):
+        """過去の入力スペクトル × IRの2区画目以降 の和（IRごと）"""
+        n_past = self.n_parts - 1
+        if n_past == 0:
+            return 0.0
+
+        # リングの並びに合わせて IR 側を逆順に見る（コピーせずにビューで済ませる）
+        # スロット s の入力には、IRの (head - s) % n_past + 1 番目の区画が掛かる
+        head = self._head % n_past
+        ir_rev = self._spectra[:, ::-1]
+        acc = np.einsum(
+            "cpk,ipk->ick",
+            self._fdl[:, : head + 1],
+            ir_rev[:, n_past - 1 - head : n_past],
+        )
+        if head + 1 < n_past:
+            acc += np.einsum(
+                "cpk,ipk->ick",
+                self._fdl[:, head + 1 :],
+                ir_rev[:, : n_past - 1 - head],
+            )
+        return acc
+
+    @traced("convolution")
+    def convolve(self, data, weights=None):
+        """
+        曲全体を畳み込む（signal.fftconvolve(..., mode="full")[:length] と同じ結果）
+        内部ではブロックごとに処理するので、巨大なFFTは使いません。
+        :param weights: IRバンクの時の (IRの数, length) のクロスフェード（process と同じ）
+        """
+        self.reset()
+        length = data.shape[1]
+        # 出力は入力と同じ精度（float32 の曲なら float32 で返す）
+        dtype = np.result_type(data.dtype, np.float32)
+        if self.n_irs is None or weights is not None:
+            out = np.empty((self.channels, length), dtype=dtype)
+        else:
+            out = np.empty((self.n_irs, self.channels, length), dtype=dtype)
+        for start in range(0, length, self.block_size):
+            end = min(start + self.block_size, length)
+            w = None if weights is None else weights[:, start:end]
+            out[..., start:end] = self.process(data[:, start:end], w)
+        return out
+
+
+# テスト用
+if __name__ == "__main__":
+    import time
+    from scipy import signal
+
+    sr = 44100
+    data = np.random.randn(2, sr * 30)
+    ir = np.random.randn(sr * 3) * np.exp(-np.linspace(0, 12, sr * 3))
+
+    t = time.perf_counter()
+    ref = signal.fftconvolve(data, ir[np.newaxis, :], mode="full", axes=-1)
+    ref = ref[:, : data.shape[1]]
+    t_ref = time.perf_counter() - t
+
+    t = time.perf_counter()
+    out = partitioned_convolver(ir, block_size=8192).convolve(data)
+    t_part = time.perf_counter() - t
+
+    err = np.max(np.abs(ref - out)) / np.max(np.abs(ref))
+    print(f"fftconvolve {t_ref:.3f}s / partitioned {t_part:.3f}s (rel err {err:.2e})")
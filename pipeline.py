@@ -0,0 +1,631 @@
+import time
+import threading
+import warnings
+import tracemalloc
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import one_f_generator as ofg
+import gain_stage as gs
+from stage_profiler import span, peak_watch, thread_initializer
+from syn_volume import syn_volume
+from syn_pan import syn_pan
+from syn_pitch import syn_pitch
+from syn_timbre import syn_timbre, lowpass_sos
+from syn_reverb import syn_reverb
+
+# バケツリレーの順番
+STAGES = ("vol", "pan", "pit", "tim", "rev")
+
+# ステージごとに増えるメモリの見積もり（曲の配列 data.nbytes の何倍か）
+# 60秒のステレオで実測した値に少し余裕を持たせたもの
+STAGE_COST = {
+    "gain": 3.5,  # Volume / Pan のカーブと、コントロールレートからの引き伸ばし
+    "pit": 4.5,  # 曲全体の再生位置と、チャンネルごとの補間結果
+    "pit_stream": 2.5,  # 速度マップだけ（リングバッファなので音声のコピーは無し）
+    "tim": 5.0,  # こもった音 + 係数 + sosfiltfilt の作業領域
+    "rev": 4.0,  # Wet成分 + 係数 + 分割畳み込みの作業領域
+}
+
+
+class memory_budget:
+    def __init__(self, limit_mb=None, baseline=0, measure=False):
+        """
+        tracemalloc でステージごとのメモリの山を測り、上限を超えそうなら止める
+        tracemalloc は遅くなるので、上限がある時か measure=True の時だけ動かします。
+        それ以外は、すでに誰か（メモリも測るプロファイラなど）が動かしている時だけ測り、
+        動いていなければ check / record は何もしない（summary は空）。
+        :param limit_mb: 上限 [MB]（None なら止めない）
+        :param baseline: 測り始める前からある配列のバイト数（曲の配列など）
+        :param measure: True なら上限が無くてもステージごとの山を測る
+        """
+        self.limit = None if limit_mb is None else limit_mb * 2**20
+        self.baseline = baseline
+        self.measure = measure or self.limit is not None
+        self.tracing = False  # with の中で測っているか
+        self.peaks = {}  # ステージ名 → そのステージ中の最大使用量 [MB]
+        self._started = False
+
+    def __enter__(self):
+        if self.measure and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+        self.tracing = tracemalloc.is_tracing()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracing = False
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+        return False
+
+    def check(self, name, expected):
+        """
+        ステージを始める前に、見積もり expected バイトを足しても上限に収まるか確かめる
+        収まらない時は、途中でメモリ不足になる前に MemoryError で止める
+        """
+        if not self.tracing:
+            return
+        # 入れ子の span の測定と山を取り合わないように、reset_peak() の代わりに peak_watch で測る
+        self._watch = peak_watch()
+        if self.limit is None:
+            return
+        current, _ = tracemalloc.get_traced_memory()
+        need = self.baseline + current + expected
+        if need > self.limit:
+            raise MemoryError(
+                f"Stage '{name}' needs about {need / 2**20:.0f} MB, "
+                f"over the {self.limit / 2**20:.0f} MB budget"
+            )
+
+    def record(self, name):
+        """直前の check からの最大使用量を記録する（見積もりが外れて上限を超えていたら警告）"""
+        if not self.tracing:
+            return
+        peak = self._watch.stop()
+        self.peaks[name] = (self.baseline + peak) / 2**20
+        if self.limit is not None and self.baseline + peak > self.limit:
+            warnings.warn(
+                f"Stage '{name}' peaked at {self.peaks[name]:.0f} MB, "
+                f"over the {self.limit / 2**20:.0f} MB budget",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+
+    def summary(self):
+        """ステージごとの山を1行にまとめた文字列（ステータスバー用、測っていない時は空）"""
+        if not self.peaks:
+            return ""
+        stages = ", ".join(f"{k} {v:.0f}" for k, v in self.peaks.items())
+        return f"peak {self.peak_mb:.0f} MB ({stages})"
+
+    @property
+    def peak_mb(self):
+        return max(self.peaks.values(), default=self.baseline / 2**20)
+
+
+def _nbytes(value):
+    """キャッシュに入れる値（配列・タプル）の合計バイト数"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+def _freeze(value):
+    """キャッシュした配列を後から書き換えてしまわないように読み取り専用にする"""
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, tuple):
+        for v in value:
+            _freeze(v)
+    return value
+
+
+class stage_cache:
+    def __init__(self, limit_mb=1024):
+        """
+        ステージの途中結果を取っておくキャッシュ（ステージ後の音声・こもった音・Wet成分・ゆらぎ）
+        キーは (曲のハッシュ, シード, モード, ステージ, 上流の状態)。
+        Depth だけ変えて加工し直す時は、Depth に関係ない重い計算を飛ばしてブレンドだけやり直せます。
+        合計が limit_mb を超えたら、最後に使ってから一番時間が経ったものから捨てます（LRU）。
+        :param limit_mb: 上限 [MB]
+        """
+        self.limit = limit_mb * 2**20
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()  # 先読みのスレッドからも使うので
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+
+    def put(self, key, value):
+        """value（配列またはタプル）を読み取り専用にして取っておき、そのまま返す"""
+        size = _nbytes(value)
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= _nbytes(self._items.pop(key))
+            if size > self.limit:
+                return value  # 上限より大きいものは取っておかない
+            while self.nbytes + size > self.limit:
+                _, old = self._items.popitem(last=False)
+                self.nbytes -= _nbytes(old)
+            self._items[key] = _freeze(value)
+            self.nbytes += size
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+class render_pipeline:
+    # float32 モードで1/fゆらぎを作るレート [Hz]
+    control_sr = 500
+
+    def __init__(
+        self,
+        sr,
+        depths,
+        float32=False,
+        budget_mb=None,
+        curve_bank=None,
+        seed=None,
+        cache=None,
+        source_key=None,
+        workers=None,
+        measure_memory=False,
+    ):
+        """
+        曲全体をまとめて加工するオフラインのバケツリレー（GUIなし）
+        :param depths: {"vol", "pan", "pit", "tim", "rev"} をキーにした各Depth
+        :param float32: True なら float32 のままその場で加工する省メモリモード
+            （1/fゆらぎはコントロールレートで作り、Pitch はリングバッファで読み出す）
+        :param budget_mb: メモリの上限 [MB]（超えそうなステージの手前で MemoryError）
+        :param curve_bank: one_f_bank.one_f_bank（作り置きのゆらぎを切り出して使う）
+        :param seed: int または numpy.random.Generator（ゆらぎを再現したい時）
+        :param cache: stage_cache（途中結果を使い回す。seed を int で固定した時だけ当たる）
+        :param source_key: 曲を区別するキー（decode_cache.key の中身のハッシュなど）
+        :param workers: スレッド数（2以上なら左右のチャンネルと、互いに関係ない下準備を並列に処理する）
+            並列にしても各計算の中身は同じなので、結果は1スレッドの時と全く同じです。
+        :param measure_memory: True なら budget_mb が無くてもステージごとのメモリの山を測る
+            （tracemalloc で遅くなるので既定では測らない。memory.summary() が空になる）
+        """
+        self.sr = sr
+        self.depths = {key: depths.get(key, 0.0) for key in STAGES}
+        self.float32 = float32
+        self.budget_mb = budget_mb
+        self.curve_bank = curve_bank
+        self.rng = np.random.default_rng(seed)
+        self.dtype = np.float32 if float32 else np.float64
+        self.workers = workers
+        self.measure_memory = measure_memory
+        self.memory = None  # render 後に memory_budget（ステージごとの山）が入る
+        self.timings = {}  # render 後にステージごとの処理時間 [秒] が入る
+
+        self.cache = cache
+        self.source_key = source_key
+        if cache is not None and source_key is None:
+            raise ValueError("source_key is required when using a stage cache")
+
+        # ステージごとに別のシードでゆらぎを作る
+        # （あるステージを on/off したり、先読みで順番が変わっても、他のステージのゆらぎが変わらない）
+        self.seed = seed if isinstance(seed, (int, np.integer)) else None
+        if self.seed is None:
+            self.seed = int(self.rng.integers(2**63))
+        children = np.random.SeedSequence(self.seed).spawn(len(STAGES))
+        self._stage_seeds = dict(zip(STAGES, children))
+
+    def _curves(self, length, steps):
+        """
+        (これから加工するステージの1/fゆらぎの生カーブ, ゆらぎバンク)
+        生カーブは (ステージ数, n) をまとめて1回のFFTで作る（float32 モードはコントロールレート）。
+        各行はそのステージのシード self._seed(key) の乱数だけから作るので、あるステージを on/off したり、
+        キャッシュから途中で再開しても、他のステージのゆらぎは変わりません。
+        """
+        bank = self.curve_bank
+        if bank is not None and bank.fits(length):
+            # バンクから重ならない区間を切り出す（生成コストほぼゼロ）
+            bank.reset()
+            return {}, bank
+        names = {name for name, _ in steps}
+        keys = [
+            key
+            for key in STAGES
+            if self.depths[key] > 0
+            and ("vol+pan" if key in ("vol", "pan") else key) in names
+        ]
+        if not keys:
+            return {}, None
+        if self.float32:
+            length = ofg.control_length(length, self.sr, self.control_sr)
+        seeds = [self._seed(key) for key in keys]
+        batch = ofg.generate_one_f_batch(length, len(keys), np.float32, seed=seeds)
+        return dict(zip(keys, batch)), None
+
+    def _steps(self):
+        """有効なステージの (名前, Depth) の並び（Volume と Pan は1つのゲインにまとめる）"""
+        d = self.depths
+        steps = []
+        if d["vol"] > 0 or d["pan"] > 0:
+            steps.append(("vol+pan", (d["vol"], d["pan"])))
+        for key in ("pit", "tim", "rev"):
+            if d[key] > 0:
+                steps.append((key, d[key]))
+        return steps
+
+    def _key(self, *parts):
+        return (self.source_key, self.seed, self.float32, self._length) + parts
+
+    def _cached(self, parts, compute):
+        """キャッシュにあればそれを、無ければ compute() を計算して取っておく"""
+        if self.cache is None:
+            return compute()
+        key = self._key(*parts)
+        value = self.cache.get(key)
+        if value is None:
+            value = self.cache.put(key, compute())
+        return value
+
+    def _seed(self, key):
+        """ステージ key のゆらぎのシード"""
+        return np.random.default_rng(self._stage_seeds[key])
+
+    def render(self, data):
+        """
+        (2, n) または (n,) の音声を加工して返す
+        float32 モードでは渡した配列をその場で書き換えます（コピーを作らない）。
+        キャッシュがある時は、上流の Depth が同じ一番後ろのステージ後の音声から再開します。
+        """
+        if data.ndim == 1:
+            data = np.vstack([data, data])
+        data = data.astype(self.dtype, copy=False)
+        if not data.flags.writeable:
+            # 読み取り専用（デコードキャッシュのモノラルのビューなど）は、その場で書き換えられないのでコピーする
+            data = np.array(data)
+        # モノラル対策（各 syn_* と同じ）
+        if np.mean(np.abs(data[1])) < 0.0001:
+            data[1] = data[0]
+
+        self._length = data.shape[1]
+        unit = data.nbytes
+
+        # ステージ i の後の状態 = それまでの (名前, Depth) の並び
+        steps = self._steps()
+        states = [tuple(steps[:i]) for i in range(len(steps) + 1)]
+
+        # 途中まで同じ設定で加工した音声があれば、そこから再開する
+        start = 0
+        if self.cache is not None:
+            for i in reversed(range(len(states))):
+                snapshot = self.cache.get(self._key("data", states[i]))
+                if snapshot is not None:
+                    data[...] = snapshot
+                    start = i
+                    break
+            else:
+                self.cache.put(self._key("data", ()), np.array(data))
+
+        pool = None
+        if self.workers is not None and self.workers > 1:
+            # プロファイラが動いていれば、プールのスレッドの区間も記録させる
+            pool = ThreadPoolExecutor(self.workers, initializer=thread_initializer())
+        self._pool = pool
+        self.timings = {}
+
+        self.memory = memory_budget(
+            self.budget_mb, baseline=data.nbytes, measure=self.measure_memory
+        )
+        try:
+            with self.memory as budget, span("render", "pipeline"):
+                t = time.perf_counter()
+                with span("curves", "stage"):
+                    curves, bank = self._curves(self._length, steps[start:])
+                    self._raw_curves = curves
+                    self._bank = bank
+                    self._control_sr = (
+                        self.control_sr if self.float32 and bank is None else None
+                    )
+                    self._prefetch = self._start_prefetch(steps[start:])
+                self.timings["curves"] = time.perf_counter() - t
+
+                for i in range(start, len(steps)):
+                    name, _ = steps[i]
+                    cost_name = {"vol+pan": "gain"}.get(name, name)
+                    if name == "pit" and self.float32:
+                        cost_name = "pit_stream"
+                    # ステータスバーの進み具合は「何段目 / 全部で何段」
+                    with span(name, "stage", step=f"{i + 1}/{len(steps)}"):
+                        budget.check(name, STAGE_COST[cost_name] * unit)
+                        t = time.perf_counter()
+                        stage = getattr(self, "_" + name.replace("vol+pan", "gain"))
+                        stage(data, states[i])
+                        self.timings[name] = time.perf_counter() - t
+                        budget.record(name)
+                    if self.cache is not None:
+                        key = self._key("data", states[i + 1])
+                        self.cache.put(key, np.array(data))
+
+                # 最終ノーマライズ
+                with span("normalise"):
+                    max_val = np.max(np.abs(data))
+                    if max_val > 0:
+                        data /= max_val
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            self._pool = None
+        return data
+
+    def _start_prefetch(self, steps):
+        """
+        互いに関係ない下準備（Volume / Pan / Pitch のゆらぎ、フィルタ設計、IRの合成）を
+        スレッドプールに投げておく（プールが無い時は何もしない）
+        :return: {名前: Future}
+        """
+        if self._pool is None:
+            return {}
+        names = {name for name, _ in steps}
+        futures = {}
+        # ゆらぎバンクは切り出す順番で結果が変わるので、先読みしない
+        if self._bank is None:
+            for key, cls in [("vol", syn_volume), ("pan", syn_pan), ("pit", syn_pitch)]:
+                stage = "vol+pan" if key in ("vol", "pan") else key
+                if self.depths[key] > 0 and stage in names:
+                    futures[key] = self._pool.submit(self._curve, key, cls())
+        # lru_cache に載せておくだけ（後でステージが同じ引数で呼ぶ）
+        if "tim" in names:
+            futures["sos"] = self._pool.submit(
+                lowpass_sos, self.sr, syn_timbre.cutoff, syn_timbre.filter_order
+            )
+        if "rev" in names:
+            inst = syn_reverb()
+            futures["ir"] = self._pool.submit(
+                inst._ir_spectra, self.sr, 3.0, inst.conv_block
+            )
+        return futures
+
+    def _make_curve(self, key, inst):
+        """Volume / Pan / Pitch のゆらぎ（先読みしてあればその結果を待つ）"""
+        future = self._prefetch.get(key)
+        if future is not None:
+            return future.result()
+        return self._curve(key, inst)
+
+    def _curve(self, key, inst):
+        """ゆらぎを作る（キャッシュありなら使い回す）"""
+        return self._cached(
+            ("curve", key),
+            lambda: inst.make_curve(
+                self._length,
+                self.sr,
+                control_sr=self._control_sr,
+                raw_curve=self._raw_curves.get(key),
+                seed=self._seed(key),
+                curve_bank=self._bank,
+            ),
+        )
+
+    def _gain(self, data, state):
+        """(1) Volume + (2) Pan（1つのゲインにまとめてその場で掛ける）"""
+        d = self.depths
+        multiplier = pan_curve = None
+        if d["vol"] > 0:
+            multiplier = self._make_curve("vol", syn_volume())
+        if d["pan"] > 0:
+            pan_curve = self._make_curve("pan", syn_pan())
+        gs.apply_gain(data, multiplier, pan_curve, d["vol"], d["pan"])
+
+    def _pit(self, data, state):
+        """(3) Pitch（ブレンドすると二重になるので、その場で読み出し直す）"""
+        inst = syn_pitch()
+        speed_map = self._make_curve("pit", inst)
+        inst.resample(data, speed_map, streaming=self.float32, executor=self._pool)
+
+    def _tim_layer(self, data, state):
+        """Timbre のこもった音と係数（上流の状態が同じなら Depth に関係なく同じ）"""
+        return self._cached(
+            ("tim", state),
+            lambda: syn_timbre().make_layer(
+                data,
+                self.sr,
+                control_sr=self._control_sr,
+                raw_curve=self._raw_curves.get("tim"),
+                seed=self._seed("tim"),
+                curve_bank=self._bank,
+                executor=self._pool,
+            ),
+        )
+
+    def _tim(self, data, state):
+        """(4) Timbre"""
+        muffled, mix_ratio = self._tim_layer(data, state)
+        gs.blend_layer(data, muffled, mix_ratio, self.depths["tim"])
+
+    def _rev(self, data, state):
+        """(5) Reverb（syn_rev と同じく、混ぜた後の最大値でノーマライズ）"""
+        wet, mix_ratio = self._rev_layer(data, state)
+        gs.blend_layer(data, wet, mix_ratio, self.depths["rev"], normalize=True)
+
+    def _rev_layer(self, data, state):
+        """
+        Reverb のWet成分と深さのゆらぎ
+        キャッシュがある時は Timbre の Depth を除いた上流の状態をキーにします。
+        Reverb は入力に対して線形なので、Timbre 後の音 x = base + d_tim * delta に対して
+        wet(x) = wet(x_ref) + (d_tim - d_ref) * wet(delta) と足し合わせで作り直せます。
+        （delta の畳み込みは Timbre の Depth を初めて変えた時の1回だけ）
+        """
+        inst = syn_reverb()
+        if self.cache is None:
+            return inst.make_layer(
+                data,
+                self.sr,
+                control_sr=self._control_sr,
+                raw_curve=self._raw_curves.get("rev"),
+                seed=self._seed("rev"),
+                curve_bank=self._bank,
+                executor=self._pool,
+            )
+
+        # Timbre の手前の状態（Timbre が無ければ state と同じ）
+        has_tim = bool(state) and state[-1][0] == "tim"
+        base = state[:-1] if has_tim else state
+        d_tim = self.depths["tim"] if has_tim else 0.0
+        key = self._key("rev", base)
+
+        entry = self.cache.get(key)
+        if entry is None:
+            mix_ratio = inst.make_curve(
+                self._length,
+                self.sr,
+                control_sr=self._control_sr,
+                raw_curve=self._raw_curves.get("rev"),
+                seed=self._seed("rev"),
+                curve_bank=self._bank,
+            )
+            wet = inst.make_wet(data, self.sr, mix_ratio, executor=self._pool)
+            entry = self.cache.put(key, (wet, d_tim, mix_ratio, None))
+
+        wet_ref, d_ref, mix_ratio, wet_delta = entry
+        if d_tim != d_ref:
+            if wet_delta is None:
+                wet_delta = self._rev_delta(base, inst, mix_ratio)
+            if wet_delta is None:
+                # 材料がキャッシュから追い出されていたら、今の入力で作り直す
+                wet = inst.make_wet(data, self.sr, mix_ratio, executor=self._pool)
+                self.cache.put(key, (wet, d_tim, mix_ratio, None))
+                wet_ref, d_ref = wet, d_tim
+            else:
+                self.cache.put(key, (wet_ref, d_ref, mix_ratio, wet_delta))
+                wet_ref = wet_ref + (d_tim - d_ref) * wet_delta
+
+        # Wet成分の音量を整える（make_layer と同じ）
+        with span("normalise"):
+            wet = wet_ref / np.max(np.abs(wet_ref), axis=1, keepdims=True)
+        return wet, mix_ratio
+
+    def _rev_delta(self, base, inst, mix_ratio):
+        """Timbre の Depth 1.0 分の変化 delta の残響（材料がキャッシュに無ければ None）"""
+        before = self.cache.get(self._key("data", base))
+        layer = self.cache.get(self._key("tim", base))
+        if before is None or layer is None:
+            return None
+        muffled, tim_ratio = layer
+        delta = muffled - before
+        if tim_ratio is not None:
+            delta *= tim_ratio
+        return inst.make_wet(delta, self.sr, mix_ratio, executor=self._pool)
+
+
+class block_pipeline:
+    # ブロック処理のメソッド名（バケツリレーの順番は STAGES と同じ）
+    block_methods = {
+        "vol": (syn_volume, "syn_vol_block"),
+        "pan": (syn_pan, "syn_pan_block"),
+        "pit": (syn_pitch, "syn_pit_block"),
+        "tim": (syn_timbre, "syn_tim_block"),
+        "rev": (syn_reverb, "syn_rev_block"),
+    }
+
+    def __init__(self, sr, depths, block_size=2048):
+        """
+        ブロック単位で加工するバケツリレー（メモリはブロックの大きさ分だけ）
+        :param depths: {"vol", "pan", "pit", "tim", "rev"} をキーにした各Depth
+        :param block_size: 1回に流すサンプル数（Reverb の分割畳み込みの区画もこれに揃える）
+        """
+        self.sr = sr
+        self.block_size = block_size
+        self.stages = []
+        for key in STAGES:
+            depth = depths.get(key, 0.0)
+            if depth > 0:
+                cls, method = self.block_methods[key]
+                inst = cls()
+                if key == "rev":
+                    inst.init_block(sr, block_size=block_size)
+                else:
+                    inst.init_block(sr)
+                self.stages.append((key, getattr(inst, method), depth))
+
+        # ブロック処理で増える遅延（最後に無音を流し込んで吐き出させる）
+        self.latency = sum(
+            getattr(method.__self__, "latency", 0) for _, method, _ in self.stages
+        )
+
+    def process(self, block):
+        """1ブロック分をバケツリレー加工して返す（ノーマライズはしない）"""
+        data = block.astype(np.float32)
+        for key, method, depth in self.stages:
+            processed = method(data)
+            if key == "pit":
+                # Pitchはブレンドすると二重になるので直接代入
+                data = processed
+            else:
+                data = data + (processed - data) * depth
+        return data
+
+    def run(self, blocks):
+        """
+        ブロックのジェネレータを加工して返すジェネレータ
+        最後に遅延分の無音を流して、バッファに残った音を出し切る
+        """
+        for block in blocks:
+            yield self.process(block)
+        tail = self.latency
+        while tail > 0:
+            n = min(self.block_size, tail)
+            yield self.process(np.zeros((2, n), dtype=np.float32))
+            tail -= n
+
+
+def render_file(in_path, out_path, depths, block_size=2**16):
+    """
+    曲をブロック単位で読み込み・加工して out_path に書き出す（長さの制限なし）
+    メモリはブロックの大きさ分だけなので、ライブ録音やDJミックスのような長い曲も扱えます。
+    1回目で加工しながら float32 で書き出し、2回目で全体の最大値を使ってその場でノーマライズします。
+    :return: 書き出したサンプル数
+    """
+    # ファイルの読み書きは使う時に読み込む（加工だけなら numpy / scipy で足りる）
+    import soundfile as sf
+    from audio_io import open_blocks
+
+    blocks, sr = open_blocks(in_path, block_size)
+    chain = block_pipeline(sr, depths, block_size)
+
+    # 1回目：加工して書き出す（Pitch の遅れの分だけ先頭を捨てて長さをそろえる）
+    peak = 0.0
+    skip = chain.latency
+    written = 0
+    with sf.SoundFile(out_path, "w", samplerate=sr, channels=2, subtype="FLOAT") as out:
+        for block in chain.run(blocks):
+            if skip:
+                cut = min(skip, block.shape[1])
+                block = block[:, cut:]
+                skip -= cut
+            if block.shape[1] == 0:
+                continue
+            peak = max(peak, float(np.max(np.abs(block))))
+            out.write(block.T)
+            written += block.shape[1]
+
+    # 2回目：ファイルの中身をブロックごとに読み直して、最大値で割って上書きする
+    if peak > 0:
+        with sf.SoundFile(out_path, "r+") as out:
+            for start in range(0, written, block_size):
+                out.seek(start)
+                block = out.read(block_size, dtype="float32")
+                out.seek(start)
+                out.write(block / peak)
+    return written
@@ -0,0 +1,211 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from scipy import fft as sp_fft
+from scipy import signal
+
+# グラフの波形の拡大表示（main.py の Waveform Zoom と同じ位置と長さ [秒]）
+ZOOM_START_SEC = 0.5
+ZOOM_SEC = 0.01
+
+
+def zoom_window(data, sr):
+    """波形の拡大表示に使う左チャンネルの区間（コピー）"""
+    zoom = int(ZOOM_SEC * sr)
+    start = int(ZOOM_START_SEC * sr)
+    if start + zoom > data.shape[1]:
+        start = 0
+    return np.array(data[0, start : start + zoom])
+
+
+class welch_accumulator:
+    def __init__(self, sr, nperseg=1024, decimate=1):
+        """
+        ブロックを少しずつ渡せる Welch 法のPSD（signal.welch(x, sr, nperseg=nperseg) と同じ結果）
+        区間（Hann窓・半分重ね・平均を引く）のパワーを足し込んでいくだけなので、
+        曲全体の区間を一度に作らず、メモリはブロックの大きさ分で済みます。
+        :param decimate: 2 以上なら、ローパスを通して 1/decimate に間引いてから解析する
+            （PSD は sr / decimate / 2 [Hz] までになるが、長い曲でも速い）
+        """
+        self.decimate = max(1, int(decimate))
+        self.sr = sr / self.decimate
+        self.nperseg = nperseg
+        self.step = nperseg - nperseg // 2
+        self.window = signal.get_window("hann", nperseg)
+        self._power = np.zeros(nperseg // 2 + 1)
+        self._count = 0
+        self._tail = np.zeros(0)
+
+        if self.decimate > 1:
+            # 間引いた後のナイキスト周波数の手前で切る（状態を持ち越す片方向のフィルタ）
+            self._sos = signal.butter(8, 0.8 / self.decimate, output="sos")
+            self._zi = np.zeros((self._sos.shape[0], 2))
+            self._phase = 0  # 次のブロックで最初に残すサンプルの位置
+
+    def _decimate(self, x):
+        y, self._zi = signal.sosfilt(self._sos, x, zi=self._zi)
+        kept = y[self._phase :: self.decimate]
+        self._phase = (self._phase - len(x)) % self.decimate
+        return kept
+
+    def feed(self, block):
+        """(n,) のブロックを足し込む"""
+        x = np.asarray(block, dtype=np.float64)
+        if self.decimate > 1:
+            x = self._decimate(x)
+        buf = np.concatenate([self._tail, x])
+        n = self.nperseg
+        if len(buf) < n:
+            self._tail = buf
+            return
+        n_seg = (len(buf) - n) // self.step + 1
+        segments = np.lib.stride_tricks.sliding_window_view(buf, n)[:: self.step]
+        segments = segments[:n_seg]
+        segments = segments - segments.mean(axis=1, keepdims=True)
+        spectrum = sp_fft.rfft(segments * self.window, axis=-1)
+        self._power += np.sum(spectrum.real**2 + spectrum.imag**2, axis=0)
+        self._count += n_seg
+        # 次の区間の始まりから後ろだけ残す
+        self._tail = buf[n_seg * self.step :]
+
+    def result(self):
+        """:return: (周波数 [Hz], PSD)  何も渡されていなければ空の配列"""
+        if self._count == 0 and len(self._tail) == 0:
+            return np.zeros(0), np.zeros(0)
+        if self._count == 0:
+            # 1区間に満たない短い曲（signal.welch と同じく区間を短くする）
+            return signal.welch(self._tail, self.sr, nperseg=len(self._tail))
+        psd = self._power / self._count
+        psd /= self.sr * np.sum(self.window**2)
+        # 片側スペクトル（DC とナイキスト以外は負の周波数の分を足す）
+        if self.nperseg % 2:
+            psd[1:] *= 2
+        else:
+            psd[1:-1] *= 2
+        return sp_fft.rfftfreq(self.nperseg, 1 / self.sr), psd
+
+
+def ideal_line(f, psd, band=(100, 1000)):
+    """
+    理想的な 1/f の直線（band [Hz] の平均パワーが psd と同じになるように合わせる）
+    :return: (周波数, パワー)（DC は 1e-10 Hz として計算、f が空なら空）
+    """
+    if len(f) == 0:
+        return f.copy(), psd.copy()
+    f_ideal = f.copy()
+    f_ideal[0] = 1e-10
+    p_ideal = 1.0 / f_ideal
+    mask = (f > band[0]) & (f < band[1])
+    if np.sum(mask) > 0:
+        p_ideal = p_ideal * np.mean(psd[mask]) / np.mean(p_ideal[mask])
+    return f_ideal, p_ideal
+
+
+class analysis_engine:
+    def __init__(self, nperseg=1024, decimate=1, block_size=2**16, max_items=16):
+        """
+        グラフ（波形とPSD）の解析を裏のスレッドで行い、結果を加工ごとに取っておく
+        PSD は welch_accumulator にブロックを順に渡して作るので、Tk のメインスレッドを止めません。
+        新しい解析を頼むと、前の解析は途中で打ち切ります（古い結果は返さない）。
+        :param decimate: welch_accumulator の間引き（1 なら間引かない）
+        :param max_items: 取っておく PSD の数（古いものから捨てる）
+        """
+        self.nperseg = nperseg
+        self.decimate = decimate
+        self.block_size = block_size
+        self.max_items = max_items
+        self._psd = OrderedDict()  # キー → (周波数, PSD)
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def cached(self, key):
+        """key の PSD を取っておいてあるか"""
+        with self._lock:
+            return key in self._psd
+
+    def psd(self, key, x, sr, generation=None):
+        """
+        (n,) の x の PSD を返す（key が同じなら2回目からは計算しない）
+        generation が古くなったら途中でやめて None を返す
+        """
+        with self._lock:
+            if key in self._psd:
+                self._psd.move_to_end(key)
+                return self._psd[key]
+        if x is None:
+            return None  # 取っておいたはずの PSD が捨てられていた（描かずに終わる）
+
+        acc = welch_accumulator(sr, self.nperseg, self.decimate)
+        for start in range(0, len(x), self.block_size):
+            if generation is not None and generation != self._generation:
+                return None
+            acc.feed(x[start : start + self.block_size])
+        result = acc.result()
+
+        with self._lock:
+            self._psd[key] = result
+            while len(self._psd) > self.max_items:
+                self._psd.popitem(last=False)
+        return result
+
+    def submit(self, sr, original, processed, zoom, callback):
+        """
+        グラフに描く配列を裏のスレッドで作って、callback(結果) を呼ぶ（呼ぶのも裏のスレッド）
+        :param original: (原曲のキー, (n,) の左チャンネル)  PSD を取ってある時は配列は None でよい
+        :param processed: (加工後のキー, (n,) の左チャンネル)
+        :param zoom: (原曲, 加工後) の波形の拡大表示の区間（zoom_window）
+        :return: スレッド
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+
+        def _run():
+            psds = []
+            for key, x in (original, processed):
+                psd = self.psd(key, x, sr, generation)
+                if psd is None:
+                    return  # 新しい解析が始まった
+                psds.append(psd)
+            (f_be, p_be), (f_af, p_af) = psds
+            f_ideal, p_ideal = ideal_line(f_af, p_af)
+            result = {
+                "sr": sr,
+                "zoom": zoom,
+                "original": (f_be, p_be),
+                "processed": (f_af, p_af),
+                "ideal": (f_ideal, p_ideal),
+            }
+            if generation == self._generation:
+                callback(result)
+
+        thread = threading.Thread(target=_run, daemon=True)
+        thread.start()
+        return thread
+
+
+# テスト用
+if __name__ == "__main__":
+    import time
+
+    sr = 44100
+    x = np.random.default_rng(0).standard_normal(sr * 60)
+
+    t = time.perf_counter()
+    f_ref, p_ref = signal.welch(x, sr, nperseg=1024)
+    t_ref = time.perf_counter() - t
+
+    t = time.perf_counter()
+    acc = welch_accumulator(sr)
+    for start in range(0, len(x), 10000):  # 区間の長さで割り切れないブロック
+        acc.feed(x[start : start + 10000])
+    f, p = acc.result()
+    t_acc = time.perf_counter() - t
+    err = np.max(np.abs(p - p_ref) / p_ref)
+    print(f"welch {t_ref:.3f}s / streaming {t_acc:.3f}s (max rel err {err:.2e})")
+
+    acc = welch_accumulator(sr, decimate=4)
+    for start in range(0, len(x), 10000):
+        acc.feed(x[start : start + 10000])
+    f, p = acc.result()
+    print(f"decimate 4: {f[-1]:.0f} Hz max, mean PSD {np.mean(p[f < 4000]):.2e}")
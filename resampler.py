@@ -0,0 +1,150 @@
+import numpy as np
+from functools import lru_cache
+
+
+@lru_cache(maxsize=8)
+def sinc_table(taps=16, phases=128, cutoff=0.95):
+    """
+    窓付きsinc補間のポリフェーズ表 (phases + 1, taps)（読み取り専用）
+    行 i は「読み出し位置の小数部 = i / phases」の時に、floor(位置) の前後 taps 本に掛ける重み。
+    :param cutoff: ナイキストに対する通過域（1.0 未満にして折り返しを抑える）
+    """
+    frac = np.arange(phases + 1)[:, np.newaxis] / phases
+    offsets = np.arange(-(taps // 2 - 1), taps // 2 + 1)
+    x = offsets - frac  # 読み出し位置からの距離
+
+    # Blackman窓（|x| = taps/2 でゼロになる）
+    half = taps / 2
+    window = 0.42 + 0.5 * np.cos(np.pi * x / half) + 0.08 * np.cos(2 * np.pi * x / half)
+    table = cutoff * np.sinc(cutoff * x) * window
+
+    # どの位相でも直流のゲインが 1 になるように揃える
+    table /= np.sum(table, axis=1, keepdims=True)
+    table.setflags(write=False)
+    return table
+
+
+class variable_resampler:
+    def __init__(self, latency=2048, interp="linear", taps=16, phases=128):
+        """
+        可変速で読み出すリサンプラー（ストリーミング用）
+        リングバッファに書き込んだ入力を、速度カーブで進む小数の読み出し位置から補間して読みます。
+        読み出し位置は本来の位置から ±drift_limit 以内に抑えるので、曲の長さと同期がずれません。
+        :param latency: 読み出し位置を書き込み位置より遅らせるサンプル数（ゆらぎで先読みできる幅）
+        :param interp: "linear"（線形補間）または "sinc"（窓付きsincのポリフェーズ補間）
+        :param taps: sinc補間のタップ数（偶数）
+        :param phases: sinc補間の表の分割数（間の位相は表を線形補間する）
+        """
+        if interp == "linear":
+            self.taps = 2
+            self._table = None
+        elif interp == "sinc":
+            self.taps = taps
+            self._table = sinc_table(taps, phases)
+        else:
+            raise ValueError(f"Unknown interpolation: {interp}")
+        self.latency = latency
+        self.interp = interp
+        self.phases = phases
+
+        # floor(読み出し位置) の前後に使うサンプル
+        self._offsets = np.arange(-(self.taps // 2 - 1), self.taps // 2 + 1)
+        # sinc は先のサンプルも使うので、その分だけ先読みできる幅が減る
+        self.drift_limit = latency - self.taps // 2 - 1
+        if self.drift_limit < 1:
+            raise ValueError("latency is too short for the interpolation taps")
+
+        self.reset()
+
+    def reset(self):
+        """状態（リングバッファと読み出し位置）をクリアする"""
+        self._ring = None
+        self._mask = 0
+        self._written = 0  # これまでに書き込んだサンプル数
+        self._read_pos = -float(self.latency)  # 次に読む位置（小数）
+
+    def _reserve(self, channels, n, dtype):
+        """n サンプル書き込んでも読み出しに必要な範囲が消えない大きさのリングを用意する"""
+        need = n + 2 * self.latency + self.taps + 2
+        if self._ring is not None and self._ring.shape[1] >= need:
+            return
+
+        # 添字をビットマスクで回せるように2の累乗にする
+        size = 1 << (need - 1).bit_length()
+        ring = np.zeros((channels, size), dtype=dtype)
+        if self._ring is not None:
+            # 古いリングに残っている分を、同じ通し番号の位置に移す
+            keep = np.arange(max(0, self._written - self._ring.shape[1]), self._written)
+            ring[:, keep & (size - 1)] = self._ring[:, keep & self._mask]
+        self._ring = ring
+        self._mask = size - 1
+
+    def _weights(self, frac):
+        """小数部 (n,) → sinc補間の重み (n, taps)"""
+        p = frac * self.phases
+        i = np.minimum(p.astype(np.int64), self.phases - 1)
+        f = (p - i)[:, np.newaxis]
+        return self._table[i] * (1.0 - f) + self._table[i + 1] * f
+
+    def process(self, block, speed):
+        """
+        (channels, n) のブロックを書き込んで、同じ長さを可変速で読み出す（latency サンプル遅れる）
+        :param speed: (n,) の再生速度（1.0 = 通常速度）
+        """
+        n = block.shape[1]
+        self._reserve(block.shape[0], n, block.dtype)
+
+        # 1. 入力をリングに書き込む（最初は空なので、書き込み前の位置はゼロ扱い）
+        self._ring[:, (self._written + np.arange(n)) & self._mask] = block
+        self._written += n
+
+        # 2. 速度カーブから読み出し位置を作る
+        positions = self._read_pos + np.concatenate(
+            [[0.0], np.cumsum(speed[:-1], dtype=np.float64)]
+        )
+
+        # 3. ズレすぎ防止：本来の位置から ±drift_limit 以内に収める
+        nominal = np.arange(self._written - n, self._written) - self.latency
+        positions = np.clip(
+            positions, nominal - self.drift_limit, nominal + self.drift_limit
+        )
+        self._read_pos = positions[-1] + speed[-1]
+
+        # 4. 補間
+        base = np.floor(positions).astype(np.int64)
+        frac = positions - base
+        if self._table is None:
+            # 線形は2点だけなので、直接拾って混ぜる方が速い
+            left = self._ring[:, base & self._mask]
+            right = self._ring[:, (base + 1) & self._mask]
+            return (left + (right - left) * frac.astype(block.dtype)).astype(
+                block.dtype, copy=False
+            )
+
+        # 前後 taps 本をまとめて拾って、重みを掛けて足す
+        weights = self._weights(frac).astype(block.dtype)
+        window = self._ring[:, (base[:, np.newaxis] + self._offsets) & self._mask]
+        out = np.einsum("cnt,nt->cn", window, weights)
+        return out.astype(block.dtype, copy=False)
+
+
+# テスト用
+if __name__ == "__main__":
+    import time
+
+    sr = 44100
+    t = np.arange(sr * 10) / sr
+    tone = np.vstack([np.sin(2 * np.pi * 440 * t)] * 2)
+    speed = 1.0 + 0.003 * np.sin(2 * np.pi * 0.5 * t)
+
+    for interp in ["linear", "sinc"]:
+        res = variable_resampler(interp=interp)
+        start = time.perf_counter()
+        out = np.concatenate(
+            [
+                res.process(tone[:, i : i + 2048], speed[i : i + 2048])
+                for i in range(0, tone.shape[1], 2048)
+            ],
+            axis=1,
+        )
+        print(f"{interp}: {time.perf_counter() - start:.3f}s for 10s stereo")
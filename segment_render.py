@@ -0,0 +1,218 @@
+import os
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from scipy import signal
+
+import gain_stage as gs
+from pipeline import render_pipeline
+from partitioned_conv import partitioned_convolver
+from syn_pitch import syn_pitch
+from syn_timbre import syn_timbre, lowpass_sos
+from syn_reverb import syn_reverb
+
+
+def _run_shared(fn, specs, *args):
+    """
+    (名前, 形, dtype) の共有メモリを配列として開いて fn(*配列, *args) を呼ぶ（プロセス側）
+    配列を手放してから閉じないと、共有メモリを閉じられない
+    """
+    handles = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    arrays = [
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        for shm, (_, shape, dtype) in zip(handles, specs)
+    ]
+    try:
+        fn(*arrays, *args)
+    finally:
+        arrays.clear()
+        for shm in handles:
+            shm.close()
+
+
+def _pit_segment(src, dst, index, start, end):
+    """
+    Pitch：出力の [start, end) を、曲全体の再生位置から読み出す
+    np.interp は読む範囲の前後だけ渡しても計算が同じなので、順番に処理した時と全く同じになる
+    """
+    pos = index[start:end]
+    lo = int(np.floor(pos[0]))
+    hi = min(src.shape[1], int(pos[-1]) + 2)
+    for ch in range(src.shape[0]):
+        dst[ch, start:end] = np.interp(pos, np.arange(lo, hi), src[ch, lo:hi])
+
+
+def _tim_segment(src, dst, ratio, sr, depth, context, start, end):
+    """
+    Timbre：前後に context サンプルの余白をつけて sosfiltfilt し、[start, end) だけ混ぜる
+    ローパスの応答は余白の中で消えるので、曲全体をまとめてフィルタした時と区別できない
+    """
+    lo = max(0, start - context)
+    hi = min(src.shape[1], end + context)
+    sos = lowpass_sos(sr, syn_timbre.cutoff, syn_timbre.filter_order)
+    muffled = np.empty((src.shape[0], end - start), dtype=src.dtype)
+    for ch in range(src.shape[0]):
+        muffled[ch] = signal.sosfiltfilt(sos, src[ch, lo:hi])[start - lo : end - lo]
+    dst[:, start:end] = src[:, start:end]
+    gs.blend_layer(dst[:, start:end], muffled, ratio[start:end], depth)
+
+
+def _rev_segment(src, wet, sr, preroll, start, end):
+    """
+    Reverb：IRの長さ分だけ手前（preroll）から畳み込んで、[start, end) のWet成分を書き込む
+    前の区間の残響の尾は、手前から畳み込み直すことで引き継がれる
+    """
+    inst = syn_reverb()
+    _, ir_spectra = inst._ir_spectra(sr, 3.0, inst.conv_block)
+    conv = partitioned_convolver(
+        block_size=inst.conv_block, channels=src.shape[0], ir_spectra=ir_spectra
+    )
+    lo = max(0, start - preroll)
+    wet[:, start:end] = conv.convolve(src[:, lo:end])[:, start - lo :]
+
+
+class segment_renderer(render_pipeline):
+    # 1区間の長さ [秒]（Reverb の分割畳み込みの区画の倍数に切り上げる）
+    segment_sec = 20.0
+    # Timbre の sosfiltfilt の前後の余白 [秒]
+    filter_context_sec = 0.5
+
+    def __init__(self, sr, depths, processes=None, seed=None, curve_bank=None):
+        """
+        長い曲を区間に分けて、プロセスプールで並列に加工する（render_pipeline の既定モードと同じ音）
+        曲は multiprocessing.shared_memory に置いて、各プロセスはコピーせずに読み書きします。
+        1/fゆらぎ・Pitch の再生位置・Wet成分のノーマライズは曲全体で1回だけ作るので、
+        区間の境目でゆらぎや時間の伸び縮みが途切れません。
+        :param processes: プロセス数（None なら CPU 数）
+        """
+        super().__init__(sr, depths, seed=seed, curve_bank=curve_bank)
+        self.processes = processes or os.cpu_count() or 1
+        self._shared = []
+
+    def _share(self, shape, dtype=np.float64):
+        """共有メモリの配列を作る（render の最後にまとめて解放する）"""
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape)) * dtype.itemsize)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        self._shared.append(shm)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        return array, (shm.name, shape, dtype.str)
+
+    def _segments(self):
+        """[start, end) の区間の並び（Reverb の区画の境目に揃える）"""
+        block = syn_reverb.conv_block
+        size = max(block, int(np.ceil(self.segment_sec * self.sr / block)) * block)
+        return [
+            (start, min(start + size, self._length))
+            for start in range(0, self._length, size)
+        ]
+
+    def _map(self, fn, specs, *args):
+        """全区間を fn(*共有メモリの配列, *args, start, end) でプロセスプールに投げて、終わるまで待つ"""
+        futures = [
+            self._processes.submit(_run_shared, fn, specs, *args, start, end)
+            for start, end in self._segments()
+        ]
+        for future in futures:
+            future.result()
+
+    def render(self, data):
+        """(2, n) または (n,) の音声を加工して、新しい配列で返す"""
+        if data.ndim == 1:
+            data = np.vstack([data, data])
+        if data.shape[1] == 0:
+            return np.array(data, dtype=np.float64)
+        try:
+            return self._render_shared(data)
+        finally:
+            self._release()
+
+    def _release(self):
+        """共有メモリの配列を手放してから、全部閉じて消す"""
+        self._processes = None
+        self._scratch = None
+        for shm in self._shared:
+            try:
+                shm.close()
+            except BufferError:
+                # 例外のトレースバックなどがまだ配列を持っている（消すだけにして、元の例外を隠さない）
+                pass
+            shm.unlink()
+        self._shared = []
+
+    def _render_shared(self, data):
+        shared, self._data_spec = self._share(data.shape)
+        shared[...] = data
+        self._scratch, self._scratch_spec = self._share(data.shape)
+        with ProcessPoolExecutor(self.processes) as pool:
+            self._processes = pool
+            out = super().render(shared)
+        return np.array(out)
+
+    def _pit(self, data, state):
+        """(3) Pitch：再生位置は曲全体で作り、読み出しだけ区間ごとに並列"""
+        inst = syn_pitch()
+        speed_map = self._make_curve("pit", inst)
+        index, index_spec = self._share((self._length,))
+        index[...] = inst.time_index(speed_map, self._length)
+        self._scratch[...] = data
+        specs = [self._scratch_spec, self._data_spec, index_spec]
+        self._map(_pit_segment, specs)
+
+    def _tim(self, data, state):
+        """(4) Timbre：ゆらぎは曲全体で作り、フィルタとブレンドは区間ごとに並列"""
+        ratio, ratio_spec = self._share((self._length,))
+        ratio[...] = syn_timbre().make_curve(
+            self._length,
+            self.sr,
+            raw_curve=self._raw_curves.get("tim"),
+            seed=self._seed("tim"),
+            curve_bank=self._bank,
+        )
+        context = int(self.filter_context_sec * self.sr)
+        self._scratch[...] = data
+        self._map(
+            _tim_segment,
+            [self._scratch_spec, self._data_spec, ratio_spec],
+            self.sr,
+            self.depths["tim"],
+            context,
+        )
+
+    def _rev(self, data, state):
+        """(5) Reverb：Wet成分は区間ごとに並列、ノーマライズとブレンドは曲全体で"""
+        inst = syn_reverb()
+        mix_ratio = inst.make_curve(
+            self._length,
+            self.sr,
+            raw_curve=self._raw_curves.get("rev"),
+            seed=self._seed("rev"),
+            curve_bank=self._bank,
+        )
+        ir, _ = inst._ir_spectra(self.sr, 3.0, inst.conv_block)
+        preroll = int(np.ceil(len(ir) / inst.conv_block)) * inst.conv_block
+        specs = [self._data_spec, self._scratch_spec]
+        self._map(_rev_segment, specs, self.sr, preroll)
+
+        # make_layer と同じ音量合わせ（チャンネルごとの最大値）
+        wet = self._scratch
+        wet /= np.max(np.abs(wet), axis=1, keepdims=True)
+        gs.blend_layer(data, wet, mix_ratio, self.depths["rev"], normalize=True)
+
+
+# テスト用
+if __name__ == "__main__":
+    import time
+
+    sr = 44100
+    data = np.random.default_rng(0).standard_normal((2, sr * 120)) * 0.1
+    depths = {"vol": 0.5, "pan": 0.5, "pit": 0.5, "tim": 0.5, "rev": 0.5}
+
+    t = time.perf_counter()
+    serial = render_pipeline(sr, depths, seed=0).render(data.copy())
+    print(f"serial:   {time.perf_counter() - t:.2f}s")
+
+    t = time.perf_counter()
+    parallel = segment_renderer(sr, depths, seed=0).render(data)
+    print(f"segments: {time.perf_counter() - t:.2f}s")
+    print(f"max diff: {np.max(np.abs(serial - parallel)):.2e}")
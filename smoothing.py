@@ -0,0 +1,106 @@
+import numpy as np
+from scipy import signal
+
+from stage_profiler import traced
+
+
+@traced("smoothing")
+def moving_average(x, window_size):
+    """
+    移動平均（np.convolve(x, np.ones(w) / w, mode="same") と同じ結果）
+    累積和の差で計算するので、window_size がいくら大きくても O(N) で終わります。
+    :param x: 1次元の信号
+    :param window_size: 窓の長さ（サンプル数）
+    :return: x と同じ dtype（整数は float64）。累積和だけ float64 で計算します
+    """
+    x = np.asarray(x, dtype=np.result_type(x, np.float32))
+    n = len(x)
+    if window_size <= 1:
+        return x.copy()
+    if n < window_size:
+        # 信号が窓より短い時は np.convolve の出力長が変わるので、そのまま任せる
+        kernel = np.ones(window_size) / window_size
+        return np.convolve(x, kernel, mode="same").astype(x.dtype, copy=False)
+
+    # 平均を引いてから累積和をとる（桁落ち対策）
+    offset = np.mean(x, dtype=np.float64)
+    csum = np.empty(n + 1)
+    csum[0] = 0.0
+    np.cumsum(x - offset, out=csum[1:], dtype=np.float64)
+
+    # mode="same" の中心合わせ： 出力 i は x[i+off-w+1 : i+off+1] の和
+    # 範囲外はゼロ埋め扱いなので、累積和の両端を延長しておけばスライスの差だけで済む
+    off = (window_size - 1) // 2
+    head = window_size - off - 1
+    tail = off
+    csum = np.concatenate([np.zeros(head), csum, np.full(tail, csum[-1])])
+    total = csum[window_size : window_size + n] - csum[:n]
+
+    # 平均を足し戻す（端では窓に入っている本数分だけ）
+    total += offset * window_size
+    if head > 0:
+        total[:head] -= offset * np.arange(head, 0, -1)
+    if tail > 0:
+        total[n - tail :] -= offset * np.arange(1, tail + 1)
+    total /= window_size
+    return total.astype(x.dtype, copy=False)
+
+
+def cascaded_boxcar(x, window_size, passes=2):
+    """
+    移動平均を passes 回重ねる（2回で三角窓、3回以上でガウス窓に近づく）
+    1回だけよりも周波数特性のサイドローブが小さく、より滑らかになります。
+    """
+    y = x
+    for _ in range(passes):
+        y = moving_average(y, window_size)
+    return y
+
+
+@traced("smoothing")
+def one_pole(x, window_size):
+    """
+    1次IIRローパス（指数移動平均）
+    時定数を window_size サンプル相当に合わせます。状態が1つなのでストリーミングにも向きます。
+    ※ 片方向フィルタなので、移動平均と違って少し遅れます
+    """
+    alpha = 1.0 / window_size
+    x = np.asarray(x, dtype=np.result_type(x, np.float32))
+    x64 = x.astype(np.float64, copy=False)
+    zi = [(1 - alpha) * x64[0]] if len(x) else [0.0]
+    y, _ = signal.lfilter([alpha], [1, -(1 - alpha)], x64, zi=zi)
+    return y.astype(x.dtype, copy=False)
+
+
+def smooth(x, window_size, method="boxcar", passes=2):
+    """
+    スムージングの窓口
+    :param method: "boxcar"（移動平均）, "cascade"（多重移動平均）, "one_pole"（1次IIR）
+    """
+    if method == "boxcar":
+        return moving_average(x, window_size)
+    if method == "cascade":
+        return cascaded_boxcar(x, window_size, passes)
+    if method == "one_pole":
+        return one_pole(x, window_size)
+    raise ValueError(f"Unknown smoothing method: {method}")
+
+
+# テスト用
+if __name__ == "__main__":
+    import time
+
+    raw = np.random.rand(48000 * 10)
+    for w in [50, 2000]:
+        t = time.perf_counter()
+        ref = np.convolve(raw, np.ones(w) / w, mode="same")
+        t_conv = time.perf_counter() - t
+
+        t = time.perf_counter()
+        fast = moving_average(raw, w)
+        t_fast = time.perf_counter() - t
+
+        err = np.max(np.abs(ref - fast))
+        print(
+            f"w={w}: convolve {t_conv:.3f}s / cumsum {t_fast:.3f}s (max err {err:.2e})"
+        )
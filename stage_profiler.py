@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# 今動いている stage_profiler（None の時や、記録するスレッドでない時の span は何もしない）
+_active = None
+
+# 測定中の peak_watch（tracemalloc の山をリセットする前に、全員に今までの山を渡す）
+_watchers = set()
+_watch_lock = threading.Lock()
+
+_NULL = nullcontext()
+
+
+def _fold():
+    """今までの山を測定中の peak_watch 全員に渡してから、tracemalloc の山をリセットする"""
+    current, peak = tracemalloc.get_traced_memory()
+    for watch in _watchers:
+        watch.peak = max(watch.peak, peak)
+    tracemalloc.reset_peak()
+    return current
+
+
+class peak_watch:
+    def __init__(self):
+        """
+        tracemalloc のメモリの山を、入れ子や別スレッドの測定と互いに壊さずに測る
+        tracemalloc.reset_peak() は1つしかないので、リセットする前に今までの山を
+        測定中の全員に渡しておきます（tracemalloc が止まっている時は全部 0）。
+        """
+        with _watch_lock:
+            self.start = _fold()
+            self.peak = self.start
+            _watchers.add(self)
+
+    def stop(self):
+        """測り始めてからの最大使用量 [バイト]（測り始めた時点の使用量を含む）"""
+        with _watch_lock:
+            _fold()
+            _watchers.discard(self)
+        return self.peak
+
+
+def span(name, cat="dsp", **args):
+    """
+    処理の区間を記録する（with span("convolution"): ...）
+    プロファイラが動いていない時は何もしないので、ブロック処理の中でも使える
+    """
+    prof = _active
+    if prof is None or not prof.recording():
+        return _NULL
+    return prof.span(name, cat, **args)
+
+
+def traced(name, cat="dsp"):
+    """関数全体を span(name) で囲むデコレータ"""
+
+    def _wrap(fn):
+        @functools.wraps(fn)
+        def _traced(*a, **kw):
+            prof = _active
+            if prof is None or not prof.recording():
+                return fn(*a, **kw)
+            with prof.span(name, cat):
+                return fn(*a, **kw)
+
+        return _traced
+
+    return _wrap
+
+
+def thread_initializer():
+    """
+    ThreadPoolExecutor(n, initializer=thread_initializer()) で、プールのスレッドの区間も
+    今動いているプロファイラに記録させる（動いていなければ None）
+    """
+    return None if _active is None else _active.adopt
+
+
+class stage_profiler:
+    def __init__(self, memory=True, listener=None):
+        """
+        加工の各段階（デコード・1/f生成・スムージング・フィルタ・畳み込み・補間・ブレンド・ノーマライズ）の
+        処理時間・CPU時間・メモリの山を記録する
+        activate() の間だけ、各モジュールの span / traced がこのプロファイラに記録されます。
+        記録するのは activate() を呼んだスレッドと、adopt() したスレッド（加工のスレッドプール）だけで、
+        同時に動いているリアルタイム再生やグラフの解析のスレッドの区間は混ざりません。
+        :param memory: True なら tracemalloc でメモリの山も測る（かなり遅くなるので、トレースを取る時だけ）
+        :param listener: 区間が始まるたびに (区間の名前の並び, 進み具合 "3/4" または None) で呼ばれる
+            activate() を呼んだスレッドの区間だけ（ステータスバーの表示用）
+        """
+        self.memory = memory
+        self.listener = listener
+        self.events = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._owner = None
+
+    @contextmanager
+    def activate(self):
+        """この with の間、span / traced をこのプロファイラに記録する"""
+        global _active
+        started = False
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started = True
+        previous, _active = _active, self
+        self._owner = threading.get_ident()
+        self.adopt()
+        try:
+            yield self
+        finally:
+            _active = previous
+            self._owner = None
+            self._local.recording = False
+            if started:
+                tracemalloc.stop()
+
+    def adopt(self):
+        """呼んだスレッドの区間も記録する（スレッドプールの initializer 用）"""
+        self._local.recording = True
+
+    def recording(self):
+        """呼んだスレッドの区間を記録するか"""
+        return getattr(self._local, "recording", False)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name, cat="dsp", **args):
+        tid = threading.get_ident()
+        owner = tid == self._owner
+        stack = self._stack()
+        stack.append((name, args))
+        if owner and self.listener is not None:
+            step = next((a["step"] for _, a in reversed(stack) if "step" in a), None)
+            self.listener(tuple(n for n, _ in stack), step)
+
+        watch = peak_watch() if self.memory and tracemalloc.is_tracing() else None
+        # 呼んだスレッドの CPU 時間は、スレッドプールに投げた分も含めるためプロセス全体で測る
+        clock = time.process_time if owner else time.thread_time
+        cpu = clock()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = clock() - cpu
+            stack.pop()
+            event = {
+                "name": name,
+                "cat": cat,
+                "start": start - self._origin,
+                "wall": wall,
+                "cpu": cpu,
+                "tid": tid,
+                "thread": threading.current_thread().name,
+                "depth": len(stack),
+                "args": args,
+            }
+            if watch is not None:
+                event["peak"] = watch.stop() - watch.start
+            with self._lock:
+                self.events.append(event)
+
+    def summary(self):
+        """区間の名前ごとの合計 {名前: {"count", "wall", "cpu", "peak_mb"}}（始まった順）"""
+        totals = {}
+        for event in sorted(self.events, key=lambda e: e["start"]):
+            total = totals.setdefault(
+                event["name"], {"count": 0, "wall": 0.0, "cpu": 0.0, "peak_mb": 0.0}
+            )
+            total["count"] += 1
+            total["wall"] += event["wall"]
+            total["cpu"] += event["cpu"]
+            total["peak_mb"] = max(total["peak_mb"], event.get("peak", 0) / 2**20)
+        return totals
+
+    def report(self):
+        """summary を表にした文字列（コンソール用）"""
+        lines = [f"{'step':<16} {'n':>4} {'wall':>8} {'cpu':>8} {'peak':>9}"]
+        for name, t in self.summary().items():
+            lines.append(
+                f"{name:<16} {t['count']:>4} {t['wall']:7.3f}s {t['cpu']:7.3f}s "
+                f"{t['peak_mb']:6.1f} MB"
+            )
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """
+        Chrome のトレースイベント形式（chrome://tracing や Perfetto でそのまま開ける）
+        区間は "X"（開始時刻と長さ）イベントで、CPU時間とメモリの山は args に入れます。
+        """
+        pid = os.getpid()
+        tids = {}
+        trace = []
+        for event in sorted(self.events, key=lambda e: (e["tid"], e["start"])):
+            if event["tid"] not in tids:
+                tids[event["tid"]] = len(tids)
+                trace.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": tids[event["tid"]],
+                        "args": {"name": event["thread"]},
+                    }
+                )
+            args = dict(event["args"], cpu_ms=round(event["cpu"] * 1e3, 3))
+            if "peak" in event:
+                args["peak_mb"] = round(event["peak"] / 2**20, 3)
+            trace.append(
+                {
+                    "name": event["name"],
+                    "cat": event["cat"],
+                    "ph": "X",
+                    "ts": round(event["start"] * 1e6, 1),
+                    "dur": round(event["wall"] * 1e6, 1),
+                    "pid": pid,
+                    "tid": tids[event["tid"]],
+                    "args": args,
+                }
+            )
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def export_chrome(self, path):
+        """chrome_trace を JSON ファイルに書き出す"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+
+# テスト用
+if __name__ == "__main__":
+    import sys
+    import numpy as np
+    from pipeline import render_pipeline
+
+    # __main__ として動いている時は、各モジュールが読み込む stage_profiler とは別物なので読み直す
+    from stage_profiler import stage_profiler
+
+    sr = 44100
+    data = np.random.default_rng(0).standard_normal((2, sr * 30)) * 0.1
+    depths = {"vol": 0.5, "pan": 0.5, "pit": 0.5, "tim": 0.5, "rev": 0.5}
+
+    prof = stage_profiler(listener=lambda path, step: print(step, " > ".join(path)))
+    with prof.activate():
+        render_pipeline(sr, depths, seed=0, workers=2).render(data)
+    print(prof.report())
+    out = sys.argv[1] if len(sys.argv) > 1 else "trace.json"
+    print(f"trace: {prof.export_chrome(out)}")
@@ -0,0 +1,137 @@
+import threading
+import queue
+import numpy as np
+import sounddevice as sd
+
+from pipeline import block_pipeline
+from audio_io import open_blocks
+
+
+class stream_engine:
+    def __init__(self, sr, depths, block_size=2048, lookahead=0.5):
+        """
+        ブロック単位で加工しながら再生するリアルタイムエンジン
+        :param depths: {"vol", "pan", "pit", "tim", "rev"} をキーにした各Depth
+        :param block_size: 1回のコールバックで再生するサンプル数
+        :param lookahead: 再生位置より先に加工しておく秒数
+        """
+        self.sr = sr
+        self.block_size = block_size
+        self.max_blocks = max(1, int(np.ceil(lookahead * sr / block_size)))
+
+        self.chain = block_pipeline(sr, depths, block_size)
+        self.latency = self.chain.latency
+
+        self.peak = 1.0  # ノーマライズ用（これまでの最大値）
+        self.stream = None
+        self._queue = queue.Queue(maxsize=self.max_blocks)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pending = np.zeros((2, 0), dtype=np.float32)
+
+    def process_block(self, block):
+        """1ブロック分をバケツリレー加工して返す"""
+        data = self.chain.process(block)
+
+        # 曲全体の最大値は分からないので、これまでの最大値でノーマライズ
+        max_val = np.max(np.abs(data)) if data.size else 0.0
+        self.peak = max(self.peak, max_val)
+        return (data / self.peak).astype(np.float32)
+
+    def _render_loop(self, blocks):
+        """再生位置の少し先までを加工し続ける（別スレッド）"""
+        try:
+            for block in blocks:
+                if self._stop_event.is_set():
+                    return
+                self._put(self.process_block(block))
+
+            # 遅延分の無音を流して、バッファに残った音を出し切る
+            tail = self.latency
+            while tail > 0 and not self._stop_event.is_set():
+                n = min(self.block_size, tail)
+                self._put(self.process_block(np.zeros((2, n), dtype=np.float32)))
+                tail -= n
+        finally:
+            # 途中で止めた時も、読み込み中のファイルを閉じる
+            close = getattr(blocks, "close", None)
+            if close is not None:
+                close()
+            self._put(None)
+
+    def _put(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _callback(self, outdata, frames, time, status):
+        """sounddevice のコールバック（オーディオスレッド）"""
+        # 必要なサンプル数が溜まるまでキューから取り出す
+        finished = False
+        while self._pending.shape[1] < frames:
+            try:
+                block = self._queue.get_nowait()
+            except queue.Empty:
+                break  # 加工が間に合わない時は無音で埋める
+            if block is None:
+                finished = True
+                break
+            self._pending = np.concatenate([self._pending, block], axis=1)
+
+        n = min(frames, self._pending.shape[1])
+        outdata[:n] = self._pending[:, :n].T
+        outdata[n:] = 0
+        self._pending = self._pending[:, n:]
+
+        if finished:
+            raise sd.CallbackStop
+
+    def start(self, blocks, finished_callback=None):
+        """ブロックのジェネレータを受け取って再生を開始する"""
+        self._thread = threading.Thread(
+            target=self._render_loop, args=(blocks,), daemon=True
+        )
+        self._thread.start()
+
+        # 先読み分が溜まるまで待ってから再生（最初の音が出るまで1秒未満）
+        while (
+            self._queue.qsize() < self.max_blocks
+            and self._thread.is_alive()
+            and not self._stop_event.is_set()
+        ):
+            self._stop_event.wait(0.01)
+
+        self.stream = sd.OutputStream(
+            samplerate=self.sr,
+            channels=2,
+            dtype="float32",
+            blocksize=self.block_size,
+            callback=self._callback,
+            finished_callback=finished_callback,
+        )
+        self.stream.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+
+# テスト用
+if __name__ == "__main__":
+    from gui_play import gui_play as gp
+
+    path = gp().gui_get_music()
+    if path:
+        blocks, sr = open_blocks(path, 2048)
+        engine = stream_engine(
+            sr, {"vol": 1.0, "pan": 1.0, "pit": 1.0, "tim": 1.0, "rev": 1.0}
+        )
+        done = threading.Event()
+        engine.start(blocks, finished_callback=done.set)
+        done.wait()
@@ -1,28 +1,38 @@
-from gui_play import gui_play as gp
 import one_f_generator as ofg
-import librosa
-import matplotlib.pyplot as plt
+import smoothing as smt
 import numpy as np
 
 
 class syn_pan:
+    # 1/fゆらぎの移動平均の窓
+    window_size = 50
+
     def __init__(self):
         self.sr = 44100
         # グラフ表示用にデータを保持する変数を初期化
         self.data = None
 
     def get_file_path(self):
+        from gui_play import gui_play as gp
+        from audio_io import load_audio
+
         self.file = gp()
         self.file_path = self.file.gui_get_music()
         if not self.file_path:
             return None, None
 
-        self.data, self.sr = librosa.load(
-            self.file_path, mono=False, sr=None, duration=180
-        )
+        self.data, self.sr = load_audio(self.file_path)
         return self.data, self.sr
 
-    def syn_pan(self, data, sr):
+    def syn_pan(
+        self, data, sr, control_sr=None, raw_curve=None, seed=None, curve_bank=None
+    ):
+        """
+        :param control_sr: 指定するとゆらぎを間引いたレートで生成する
+        :param raw_curve: generate_one_f_batch で作り置きした生カーブ（省略時はここで生成）
+        :param seed: int または numpy.random.Generator（ゆらぎを再現したい時）
+        :param curve_bank: one_f_bank.one_f_bank（作り置きのゆらぎを切り出して使う）
+        """
         # 1. モノラル対策
         if data.ndim == 1:
             data = np.vstack([data, data])
@@ -32,16 +42,59 @@ class syn_pan:
 
         length = data.shape[1]
 
-        # 1/fゆらぎ生成
-        self.one_f = ofg.generate_one_f(length)
-        raw_pan = self.one_f.ifft_real_result
+        # 1/fゆらぎ生成（control_sr 指定時は間引いたレートで作って引き伸ばす）
+        pan_curve = self.make_curve(length, sr, control_sr, raw_curve, seed, curve_bank)
 
+        # ---------------------------------------------------------
+        # 【修正3】左右に割り振る（Constant Power Panning）
+        # ---------------------------------------------------------
+        # 単純な足し算ではなく sqrt を使うと、真ん中でも音が痩せません
+        left_gain = np.sqrt(1.0 - pan_curve)
+        right_gain = np.sqrt(pan_curve)
+
+        # 元データを書き換える
+        pan_data = data.copy()
+        pan_data[0] = data[0] * left_gain
+        pan_data[1] = data[1] * right_gain
+
+        # 【重要】グラフ表示用に、加工後のデータをクラス変数に保存しておく
+        self.data = pan_data
+
+        return pan_data
+
+    def make_curve(
+        self, length, sr, control_sr=None, raw_curve=None, seed=None, curve_bank=None
+    ):
+        """
+        パンのカーブ（0.0 = 左 〜 1.0 = 右）だけを作る（音には掛けない。gain_stage でまとめて掛ける時用）
+        引数は syn_pan と同じです。
+        """
+        self.one_f, pan_curve = ofg.one_f_curve(
+            length,
+            sr,
+            self._pan_curve,
+            control_sr,
+            raw_curve,
+            seed,
+            bank=curve_bank,
+            window_size=self.window_size,
+        )
+        return pan_curve
+
+    def _pan_curve(self, raw_pan, hop=1.0, smoothed=False):
+        """
+        :param hop: コントロールレート1点あたりのサンプル数（音声レートなら 1.0）
+        :param smoothed: True なら移動平均済み（ゆらぎバンクから取ったカーブ）とみなす
+        """
         # ---------------------------------------------------------
         # 【修正1】ゆらぎを滑らかにする（ざざざノイズ対策）
         # ---------------------------------------------------------
-        window_size = 50
-        window = np.ones(window_size) / window_size
-        pan_signal = np.convolve(raw_pan, window, mode="same")
+        # コントロールレート換算
+        window_size = max(1, int(round(self.window_size / hop)))
+        if smoothed:
+            pan_signal = raw_pan
+        else:
+            pan_signal = smt.moving_average(raw_pan, window_size)
 
         # ---------------------------------------------------------
         # 【修正2】数値を 0.0(左) 〜 1.0(右) に強制的に収める
@@ -59,23 +112,25 @@ class syn_pan:
         # 0.0 〜 1.0 に変換（0.5がセンター）
         # ※ 0.8を掛けているのは、完全に0や1になると片耳が聞こえなくなるのを防ぐため
         pan_curve = (pan_signal * 0.8 + 1.0) / 2.0
-
-        # ---------------------------------------------------------
-        # 【修正3】左右に割り振る（Constant Power Panning）
-        # ---------------------------------------------------------
-        # 単純な足し算ではなく sqrt を使うと、真ん中でも音が痩せません
-        left_gain = np.sqrt(1.0 - pan_curve)
-        right_gain = np.sqrt(pan_curve)
-
-        # 元データを書き換える
-        pan_data = data.copy()
-        pan_data[0] = data[0] * left_gain
-        pan_data[1] = data[1] * right_gain
-
-        # 【重要】グラフ表示用に、加工後のデータをクラス変数に保存しておく
-        self.data = pan_data
-
-        return pan_data
+        return pan_curve
+
+    # ---------------------------------------------------------
+    # ブロック処理API（ストリーミング再生用）
+    # ---------------------------------------------------------
+    def init_block(self, sr, segment_sec=4.0):
+        """ブロック処理の状態を初期化する"""
+        self.sr = sr
+        self.latency = 0
+        # 正規化（平均引き・最大値割り）は区間ごとに行う
+        self.curve = ofg.one_f_blocks(int(segment_sec * sr), self._pan_curve)
+
+    def syn_pan_block(self, block):
+        """(2, n) のブロックを左右に振り分けて返す"""
+        pan_curve = self.curve.read(block.shape[1])
+        pan_block = np.empty_like(block)
+        pan_block[0] = block[0] * np.sqrt(1.0 - pan_curve)
+        pan_block[1] = block[1] * np.sqrt(pan_curve)
+        return pan_block
 
     def get_lfri(self):
         # 加工後のデータがあればそれを返す
@@ -85,6 +140,8 @@ class syn_pan:
             return np.array([]), np.array([])
 
     def vid(self, lf, ri):
+        import matplotlib.pyplot as plt
+
         # データが空なら何もしない
         if len(lf) == 0:
             return
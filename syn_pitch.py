@@ -1,11 +1,17 @@
-from gui_play import gui_play as gp
 import one_f_generator as ofg
-import librosa
-import matplotlib.pyplot as plt
+import smoothing as smt
 import numpy as np
+from resampler import variable_resampler
+from stage_profiler import traced
 
 
 class syn_pitch:
+    # 1/fゆらぎの移動平均の窓（かなり大きくして、変化をゆっくりにする）
+    window_size = 2000
+    # streaming=True で読み出しを遅らせる幅と、1回に処理するブロック
+    stream_latency = 2048
+    stream_block = 8192
+
     def __init__(self):
         self.sr = 44100
         # グラフ用データ保存
@@ -13,17 +19,37 @@ class syn_pitch:
         self.af_data = None
 
     def get_file_path(self):
+        from gui_play import gui_play as gp
+        from audio_io import load_audio
+
         self.file = gp()
         self.file_path = self.file.gui_get_music()
         if not self.file_path:
             return None, None
 
-        self.data, self.sr = librosa.load(
-            self.file_path, mono=False, sr=None, duration=180
-        )
+        self.data, self.sr = load_audio(self.file_path)
         return self.data, self.sr
 
-    def syn_pit(self, data, sr):
+    def syn_pit(
+        self,
+        data,
+        sr,
+        control_sr=None,
+        raw_curve=None,
+        seed=None,
+        curve_bank=None,
+        streaming=False,
+        interp="linear",
+    ):
+        """
+        :param control_sr: 指定するとゆらぎを間引いたレートで生成する
+        :param raw_curve: generate_one_f_batch で作り置きした生カーブ（省略時はここで生成）
+        :param seed: int または numpy.random.Generator（ゆらぎを再現したい時）
+        :param curve_bank: one_f_bank.one_f_bank（作り置きのゆらぎを切り出して使う）
+        :param streaming: True ならリングバッファのリサンプラーでブロックごとに読み出す
+            （曲全体の再生位置を作らないので、曲の長さ分の一時配列が要らない）
+        :param interp: streaming=True の時の補間（"linear" または "sinc"）
+        """
         # グラフ比較用に加工前のコピーを取っておく
         self.be_data = data.copy()
 
@@ -35,18 +61,126 @@ class syn_pitch:
 
         length = data.shape[1]
 
-        # 1/fゆらぎ生成
-        self.one_f = ofg.generate_one_f(length)
-        raw_fluctuation = self.one_f.ifft_real_result
+        # 1/fゆらぎ生成（control_sr 指定時は間引いたレートで作って引き伸ばす）
+        speed_map = self.make_curve(length, sr, control_sr, raw_curve, seed, curve_bank)
+
+        data = self.resample(data, speed_map, streaming, interp)
+
+        # 加工後データを保存（グラフ用）
+        self.af_data = data
+
+        return data
+
+    def make_curve(
+        self, length, sr, control_sr=None, raw_curve=None, seed=None, curve_bank=None
+    ):
+        """速度マップ（1.0 = 通常速度）だけを作る（引数は syn_pit と同じ）"""
+        self.one_f, speed_map = ofg.one_f_curve(
+            length,
+            sr,
+            self._speed_map,
+            control_sr,
+            raw_curve,
+            seed,
+            bank=curve_bank,
+            window_size=self.window_size,
+        )
+        return speed_map
+
+    @traced("interpolation")
+    def resample(
+        self, data, speed_map, streaming=False, interp="linear", executor=None
+    ):
+        """
+        速度マップに沿って (2, n) の data を読み出し直す（data をその場で書き換えて返す）
+        :param streaming: True ならリングバッファのリサンプラーでブロックごとに読み出す
+        :param interp: streaming=True の時の補間（"linear" または "sinc"）
+        :param executor: concurrent.futures の Executor（左右のチャンネルを並列に処理する）
+            チャンネルごとの計算は順番に処理した時と全く同じなので、結果は変わりません。
+        """
+        length = data.shape[1]
+        channel_map = map if executor is None else executor.map
+        if streaming:
+            if executor is None or interp != "linear":
+                # sinc は einsum の足し算の順番がチャンネル数で変わるので、まとめて処理する
+                return self._stream_resample(data, speed_map, interp)
+            # チャンネルごとに別のリサンプラーで読み出す（読み出し位置の計算は同じ）
+            list(
+                executor.map(
+                    lambda ch: self._stream_resample(
+                        data[ch : ch + 1], speed_map, interp
+                    ),
+                    range(data.shape[0]),
+                )
+            )
+            return data
+
+        dirty_time_index = self.time_index(speed_map, length)
+
+        # ---------------------------------------------------------
+        # リサンプリング（補間）
+        # ---------------------------------------------------------
+        original_index = np.arange(length)
+
+        # 左右で「同じゆらぎ」を適用（位相ズレを防ぐため）
+        # ※左右で違うゆらぎにすると、位相がおかしくなって気持ち悪くなります
+        def _interp(ch):
+            data[ch] = np.interp(dirty_time_index, original_index, data[ch])
+
+        list(channel_map(_interp, range(2)))
+        return data
+
+    def time_index(self, speed_map, length):
+        """速度マップ → 出力の各サンプルで読む、元の曲の位置（小数）"""
+        # 累積和をとって「再生位置（インデックス）」に変換
+        dirty_time_index = np.cumsum(speed_map, dtype=np.float64)
+
+        # 尺合わせ（曲の長さに強制的に戻す）
+        # これをしないと曲の長さが変わってバケツリレーが壊れます
+        return dirty_time_index / dirty_time_index[-1] * (length - 1)
+
+    def _stream_resample(self, data, speed_map, interp):
+        """
+        曲全体を variable_resampler にブロックごとに通す（data をその場で書き換える）
+        リサンプラーの遅れ（stream_latency）は、最後に無音を流して先頭を捨てることで打ち消します。
+        出力は入力より latency だけ手前に書き込むので、まだ読んでいない入力を壊すことはありません。
+        （読み出しに必要な過去の入力はリングバッファ側に残っている）
+        """
+        length = data.shape[1]
+        latency = self.stream_latency
+        resampler = variable_resampler(latency=latency, interp=interp)
+        for start in range(0, length + latency, self.stream_block):
+            end = min(start + self.stream_block, length + latency)
+            block = data[:, start:end]
+            if block.shape[1] < end - start:
+                # 曲の終わりを過ぎた分は無音（速度は 1.0）
+                pad = end - start - block.shape[1]
+                block = np.pad(block, ((0, 0), (0, pad)))
+            speed = np.ones(end - start)
+            speed[: max(0, min(end, length) - start)] = speed_map[start:end]
+
+            processed = resampler.process(block, speed)
+            # 出力の通し番号は latency だけ遅れているので、その分ずらして書き込む
+            lo = max(start, latency)
+            data[:, lo - latency : end - latency] = processed[:, lo - start :]
+        return data
 
+    def _speed_map(self, raw_fluctuation, hop=1.0, smoothed=False):
+        """
+        :param hop: コントロールレート1点あたりのサンプル数（音声レートなら 1.0）
+        :param smoothed: True なら移動平均済み（ゆらぎバンクから取ったカーブ）とみなす
+        """
         # ---------------------------------------------------------
         # 【修正1】ゆらぎを「ゆったり」にする（移動平均）
         # ---------------------------------------------------------
         # Pitchは変化が急だと「ビブラート」になり、酔います。
         # 変化を遅くして「ワウ（うねり）」にします。
-        window_size = 2000  # かなり大きくして、変化をゆっくりにする
-        window = np.ones(window_size) / window_size
-        smooth_fluctuation = np.convolve(raw_fluctuation, window, mode="same")
+        # コントロールレート換算
+        window_size = max(1, int(round(self.window_size / hop)))
+        if smoothed:
+            smooth_fluctuation = raw_fluctuation
+        else:
+            smooth_fluctuation = smt.moving_average(raw_fluctuation, window_size)
 
         # ---------------------------------------------------------
         # 【修正2】係数の微調整（ここがエモさの肝）
@@ -60,30 +194,30 @@ class syn_pitch:
         # 時間軸の「歪みマップ」を作る
         # 1.0 = 通常速度, 1.003 = 少し速い, 0.997 = 少し遅い
         speed_map = 1.0 + (smooth_fluctuation * depth)
+        return speed_map
 
-        # 累積和をとって「再生位置（インデックス）」に変換
-        dirty_time_index = np.cumsum(speed_map)
+    # ---------------------------------------------------------
+    # ブロック処理API（ストリーミング再生用）
+    # ---------------------------------------------------------
+    def init_block(self, sr, segment_sec=4.0, latency=2048, interp="linear"):
+        """
+        ブロック処理の状態を初期化する
+        :param latency: 読み出し位置を書き込み位置より遅らせるサンプル数（ゆらぎで先読みできる幅）
+        :param interp: "linear"（線形補間）または "sinc"（窓付きsincのポリフェーズ補間）
+        """
+        self.sr = sr
+        self.latency = latency
+        self.curve = ofg.one_f_blocks(int(segment_sec * sr), self._speed_map)
+        self._resampler = variable_resampler(latency=latency, interp=interp)
 
-        # 尺合わせ（曲の長さに強制的に戻す）
-        # これをしないと曲の長さが変わってバケツリレーが壊れます
-        dirty_time_index = dirty_time_index / dirty_time_index[-1] * (length - 1)
-
-        # ---------------------------------------------------------
-        # リサンプリング（補間）
-        # ---------------------------------------------------------
-        original_index = np.arange(length)
-
-        # 左右で「同じゆらぎ」を適用（位相ズレを防ぐため）
-        # ※左右で違うゆらぎにすると、位相がおかしくなって気持ち悪くなります
-        data[0] = np.interp(dirty_time_index, original_index, data[0])
-        data[1] = np.interp(dirty_time_index, original_index, data[1])
-
-        # 加工後データを保存（グラフ用）
-        self.af_data = data
-
-        return data
+    def syn_pit_block(self, block):
+        """(channels, n) のブロックを可変速で読み出して返す（latency サンプル遅れる）"""
+        speed_map = self.curve.read(block.shape[1])
+        return self._resampler.process(block, speed_map)
 
     def vid(self):
+        import matplotlib.pyplot as plt
+
         # データが無いなら何もしない
         if self.be_data is None or self.af_data is None:
             return
@@ -1,46 +1,148 @@
-from gui_play import gui_play as gp
 import one_f_generator as ofg
-import librosa
-import matplotlib.pyplot as plt
+import smoothing as smt
 import numpy as np
-from scipy import signal  # 畳み込み用
+from functools import lru_cache
+from partitioned_conv import partitioned_convolver, partition_ir, stack_spectra
+from fdn_reverb import fdn_reverb
+from stage_profiler import span
+
+
+def _make_ir(sr, duration, rng):
+    """ホワイトノイズに減衰カーブを掛けたIR（rng は np.random か Generator）"""
+    length = int(sr * duration)
+    # 1. ホワイトノイズ生成
+    ir = rng.standard_normal(length)
+
+    # 2. 減衰カーブ（指数関数的に音が小さくなる）
+    # 最後のほうはゼロになるように
+    decay = np.exp(-np.linspace(0, 12, length))
+
+    # 3. ノイズにカーブを適用
+    ir = ir * decay
+    return ir
+
+
+@lru_cache(maxsize=8)
+def _cached_ir(sr, duration, seed):
+    """(sr, duration, seed) ごとにIRを作り置きする（読み取り専用）"""
+    ir = _make_ir(sr, duration, np.random.default_rng(seed))
+    ir.setflags(write=False)
+    return ir
+
+
+@lru_cache(maxsize=8)
+def _cached_ir_spectra(sr, duration, seed, block_size):
+    """IRの分割スペクトルを、使っているブロックサイズごとに作り置きする（読み取り専用）"""
+    spectra = partition_ir(_cached_ir(sr, duration, seed), block_size)
+    spectra.setflags(write=False)
+    return spectra
+
+
+def _stack_rooms(irs, spectra_list):
+    """IRバンクのスペクトルをまとめる（どの部屋でも同じ音量になるようにエネルギーで揃える）"""
+    gains = [1.0 / np.sqrt(np.sum(ir**2)) for ir in irs]
+    return stack_spectra(spectra_list, gains)
+
+
+@lru_cache(maxsize=4)
+def _cached_room_spectra(sr, durations, seed, block_size):
+    """部屋の広さ違いのIRバンクを作り置きする（読み取り専用）"""
+    spectra = _stack_rooms(
+        [_cached_ir(sr, d, seed) for d in durations],
+        [_cached_ir_spectra(sr, d, seed, block_size) for d in durations],
+    )
+    spectra.setflags(write=False)
+    return spectra
 
 
 class syn_reverb:
+    # 1/fゆらぎの移動平均の窓
+    window_size = 2000
+    # オフライン処理での分割畳み込みのブロック（大きいほど速い）
+    conv_block = 16384
+    # IRの seed（固定の「綺麗なホール」を使い回す。None にすると毎回新しいIRを作る）
+    ir_seed = 0
+    # engine="bank" で使うIRの長さ [秒]（狭い部屋 → 広い部屋）
+    room_durations = (1.0, 1.8, 3.0, 4.5)
+
     def __init__(self):
         self.sr = 44100
         self.be_data = None
         self.af_data = None
 
     def get_file_path(self):
+        from gui_play import gui_play as gp
+        from audio_io import load_audio
+
         self.file = gp()
         self.file_path = self.file.gui_get_music()
         if not self.file_path:
             return None, None
 
-        self.data, self.sr = librosa.load(
-            self.file_path, mono=False, sr=None, duration=180
-        )
+        self.data, self.sr = load_audio(self.file_path)
         return self.data, self.sr
 
-    def generate_ir(self, sr, duration=2.5):
+    def generate_ir(self, sr, duration=2.5, seed=None):
         """
         人工的な残響（インパルス応答）を作成するメソッド
         ホワイトノイズに減衰カーブを掛けて「響き」を作ります
+        :param seed: 指定すると (sr, duration, seed) ごとにキャッシュしたIRを返す（読み取り専用）
+        """
+        if seed is not None:
+            return _cached_ir(sr, duration, seed)
+        return _make_ir(sr, duration, np.random)
+
+    def _ir_spectra(self, sr, duration, block_size):
         """
-        length = int(sr * duration)
-        # 1. ホワイトノイズ生成
-        ir = np.random.randn(length)
+        IRと分割畳み込み用のスペクトルを返す（ir_seed があればキャッシュから）
+        :return: (ir, spectra)
+        """
+        if self.ir_seed is not None:
+            ir = self.generate_ir(sr, duration, seed=self.ir_seed)
+            spectra = _cached_ir_spectra(sr, duration, self.ir_seed, block_size)
+            return ir, spectra
+        ir = self.generate_ir(sr, duration)
+        return ir, partition_ir(ir, block_size)
 
-        # 2. 減衰カーブ（指数関数的に音が小さくなる）
-        # 最後のほうはゼロになるように
-        decay = np.exp(-np.linspace(0, 12, length))
+    def _room_spectra(self, sr, block_size):
+        """
+        room_durations の長さのIRをまとめたスペクトル（ir_seed があればキャッシュから）
+        同じ seed なら全部屋で同じノイズを使うので、減衰だけが違うIRになります。
+        """
+        if self.ir_seed is not None:
+            return _cached_room_spectra(
+                sr, tuple(self.room_durations), self.ir_seed, block_size
+            )
+        irs = [self.generate_ir(sr, d) for d in self.room_durations]
+        return _stack_rooms(irs, [partition_ir(ir, block_size) for ir in irs])
 
-        # 3. ノイズにカーブを適用
-        ir = ir * decay
-        return ir
+    def _room_weights(self, room):
+        """
+        部屋の広さ (n,) を IRバンクのクロスフェード (IRの数, n) に変換する
+        隣り合う2つのIRだけを直線で混ぜます。
+        """
+        n_rooms = len(self.room_durations)
+        pos = room * (n_rooms - 1)
+        return np.clip(1.0 - np.abs(pos - np.arange(n_rooms)[:, np.newaxis]), 0.0, 1.0)
 
-    def syn_rev(self, data, sr):
+    def syn_rev(
+        self,
+        data,
+        sr,
+        control_sr=None,
+        raw_curve=None,
+        seed=None,
+        curve_bank=None,
+        engine="conv",
+    ):
+        """
+        :param control_sr: 指定するとゆらぎを間引いたレートで生成する
+        :param raw_curve: generate_one_f_batch で作り置きした生カーブ（省略時はここで生成）
+        :param seed: int または numpy.random.Generator（ゆらぎを再現したい時）
+        :param curve_bank: one_f_bank.one_f_bank（作り置きのゆらぎを切り出して使う）
+        :param engine: "conv"（固定IRの畳み込み）、"bank"（長さ違いのIRをクロスフェード）
+            または "fdn"（部屋の広さごと揺らぐFDN）
+        """
         self.be_data = data.copy()
         self.sr = sr
 
@@ -49,57 +151,201 @@ class syn_reverb:
         elif np.mean(np.abs(data[1])) < 0.0001:
             data[1] = data[0].copy()
 
-        length = data.shape[1]
+        # 1. 残響音（Wet成分）と、残響の深さのゆらぎを作る
+        wet_signal, mix_ratio = self.make_layer(
+            data, sr, control_sr, raw_curve, seed, curve_bank, engine
+        )
 
         # ---------------------------------------------------------
-        # 1. 残響音（Wet成分）を作る
+        # 2. ブレンド（Dry + Wet）
         # ---------------------------------------------------------
-        # 毎回IRを作ると重いので、固定の「綺麗なホール」を作る
-        ir = self.generate_ir(sr, duration=3.0)  # 3秒の残響
+        # 原音(data) と 残響音(wet_signal) を mix_ratio で混ぜる
+        processed_data = data * (1 - mix_ratio) + wet_signal * mix_ratio
+
+        # 最終ノーマライズ（Reverbは音量が足されて膨らむので必須）
+        max_val = np.max(np.abs(processed_data))
+        if max_val > 0:
+            processed_data = processed_data / max_val
 
-        # 高速畳み込み（FFTConvolve）
-        # 通常のconvolveだと日が暮れるほど遅いので、fftconvolveは必須
-        wet_left = signal.fftconvolve(data[0], ir, mode="full")[:length]
-        wet_right = signal.fftconvolve(data[1], ir, mode="full")[:length]
+        self.af_data = processed_data
+        return processed_data
+
+    def make_layer(
+        self,
+        data,
+        sr,
+        control_sr=None,
+        raw_curve=None,
+        seed=None,
+        curve_bank=None,
+        engine="conv",
+        executor=None,
+    ):
+        """
+        ブレンド前の材料だけを作る（data は書き換えない。引数は syn_rev と同じ）
+        Wet成分は data と同じ dtype で返すので、float32 のまま加工を続けられます。
+        :param data: (2, n) の音声（モノラル対策は済ませておく）
+        :param executor: concurrent.futures の Executor（畳み込みを左右並列に処理する）
+        :return: (音量を揃えたWet成分, 残響の深さのゆらぎ)
+        """
+        mix_ratio = self.make_curve(
+            data.shape[1], sr, control_sr, raw_curve, seed, curve_bank
+        )
+        wet_signal = self.make_wet(data, sr, mix_ratio, engine, executor)
 
         # Wet成分の音量を整える（原音と同じくらいのパワーにする）
-        wet_left = wet_left / np.max(np.abs(wet_left))
-        wet_right = wet_right / np.max(np.abs(wet_right))
+        with span("normalise"):
+            wet_signal /= np.max(np.abs(wet_signal), axis=1, keepdims=True)
+        return wet_signal, mix_ratio
 
-        wet_signal = np.vstack([wet_left, wet_right])
+    def make_curve(
+        self, length, sr, control_sr=None, raw_curve=None, seed=None, curve_bank=None
+    ):
+        """残響の深さのゆらぎ（0.0〜0.6）だけを作る（引数は syn_rev と同じ）"""
+        self.sr = sr
+        # 1/fゆらぎで「残響の深さ」を変える
+        # （control_sr 指定時は間引いたレートで作って引き伸ばす）
+        self.one_f, mix_ratio = ofg.one_f_curve(
+            length,
+            sr,
+            self._mix_ratio,
+            control_sr,
+            raw_curve,
+            seed,
+            bank=curve_bank,
+            window_size=self.window_size,
+        )
+        return mix_ratio
 
-        # ---------------------------------------------------------
-        # 2. 1/fゆらぎで「残響の深さ」を変える
-        # ---------------------------------------------------------
-        self.one_f = ofg.generate_one_f(length)
-        raw_mix = self.one_f.ifft_real_result
+    def make_wet(self, data, sr, mix_ratio, engine="conv", executor=None):
+        """
+        音量を揃える前の残響音（Wet成分）を作る
+        どのエンジンも入力に対して線形（wet(a + k*b) = wet(a) + k*wet(b)）なので、
+        パイプラインのキャッシュは上流の Depth が変わっても作り直さずに足し合わせで済ませます。
+        :param mix_ratio: make_curve で作った深さのゆらぎ（FDN と IRバンクの部屋の広さに使う）
+        :param executor: concurrent.futures の Executor（畳み込みを左右並列に処理する）
+            FDN は左右のチャンネルを混ぜるので並列にしません。
+        """
+        if executor is not None and engine != "fdn":
+            # 畳み込みはチャンネルごとに独立で、1ch ずつでも結果は全く同じ
+            wet = list(
+                executor.map(
+                    lambda ch: self.make_wet(data[ch : ch + 1], sr, mix_ratio, engine),
+                    range(data.shape[0]),
+                )
+            )
+            return np.concatenate(wet, axis=0)
+
+        if engine == "fdn":
+            # FDN：深さと同じゆらぎで部屋の広さ（残響時間・拡散）も動かす
+            # 状態はディレイ8本分だけなので、曲が長くても O(N) で済む
+            with span("fdn"):
+                wet_signal = fdn_reverb(sr).process(data, self._room_size(mix_ratio))
+        elif engine == "conv":
+            # 毎回IRを作ると重いので、固定の「綺麗なホール」を作る
+            # （IRとそのFFTはキャッシュされるので、2回目以降は作り直さない）
+            _, ir_spectra = self._ir_spectra(sr, 3.0, self.conv_block)  # 3秒の残響
+
+            # 高速畳み込み（分割FFT畳み込み）
+            # fftconvolve と同じ結果だが、曲全体の巨大なFFTを使わないのでメモリが増えない
+            # 左右のチャンネルは1回のFFTでまとめて処理する
+            conv = partitioned_convolver(
+                block_size=self.conv_block,
+                channels=data.shape[0],
+                ir_spectra=ir_spectra,
+            )
+            wet_signal = conv.convolve(data)
+        elif engine == "bank":
+            # 長さの違うIRを同時に畳み込んで、部屋の広さに応じて隣同士をクロスフェード
+            # 入力のFFTは全IRで共有するので、コストはIRの数だけで決まる
+            # （聞こえる部屋の広さが何通りあっても増えない）
+            conv = partitioned_convolver(
+                block_size=self.conv_block,
+                channels=data.shape[0],
+                ir_spectra=self._room_spectra(sr, self.conv_block),
+            )
+            weights = self._room_weights(self._room_size(mix_ratio))
+            wet_signal = conv.convolve(data, weights)
+        else:
+            raise ValueError(f"Unknown reverb engine: {engine}")
+        return wet_signal
+
+    def _room_size(self, mix_ratio):
+        """深さ 0.0〜0.6 を部屋の広さ 0.0〜1.0 に読み替える（深い時ほど広い部屋）"""
+        return np.clip(mix_ratio / 0.6, 0.0, 1.0)
 
+    def _mix_ratio(self, raw_mix, hop=1.0, smoothed=False):
+        """
+        :param hop: コントロールレート1点あたりのサンプル数（音声レートなら 1.0）
+        :param smoothed: True なら移動平均済み（ゆらぎバンクから取ったカーブ）とみなす
+        """
         # 移動平均（ノイズ対策：Reverbの切り替えもゆっくりが鉄則）
-        window_size = 2000
-        window = np.ones(window_size) / window_size
-        smooth_mix = np.convolve(raw_mix, window, mode="same")
+        # コントロールレート換算
+        window_size = max(1, int(round(self.window_size / hop)))
+        if smoothed:
+            smooth_mix = raw_mix
+        else:
+            smooth_mix = smt.moving_average(raw_mix, window_size)
 
         # 正規化 & スケーリング
         # 0.0(Dry) 〜 0.6(Wet 60%) くらいの間を揺らがせる
         # Reverb成分が100%になるとお風呂すぎて何かわからなくなるので抑えめに
         smooth_mix = (smooth_mix - np.mean(smooth_mix)) * 2.0  # 振幅調整
-        mix_ratio = np.clip(smooth_mix + 0.3, 0.0, 0.6)
+        return np.clip(smooth_mix + 0.3, 0.0, 0.6)
 
-        # ---------------------------------------------------------
-        # 3. ブレンド（Dry + Wet）
-        # ---------------------------------------------------------
-        # 原音(data) と 残響音(wet_signal) を mix_ratio で混ぜる
-        processed_data = data * (1 - mix_ratio) + wet_signal * mix_ratio
+    # ---------------------------------------------------------
+    # ブロック処理API（ストリーミング再生用）
+    # ---------------------------------------------------------
+    def init_block(self, sr, segment_sec=4.0, block_size=2048, engine="conv"):
+        """
+        ブロック処理の状態を初期化する
+        :param block_size: 分割畳み込みの区画（再生ブロックと揃えると一番速い）
+        :param engine: "conv"（固定IRの畳み込み）、"bank"（長さ違いのIRをクロスフェード）
+            または "fdn"（部屋の広さごと揺らぐFDN）
+        """
+        self.sr = sr
+        self.latency = 0
+        self.engine = engine
+        self.curve = ofg.one_f_blocks(int(segment_sec * sr), self._mix_ratio)
+        if engine == "fdn":
+            # FDNは残響時間が変わってもエネルギーを揃えてあるので、そのままの音量で使う
+            self._fdn = fdn_reverb(sr)
+            return
+        if engine == "bank":
+            # IRごとにエネルギーを揃えてあるので、そのままの音量で使う
+            self._conv = partitioned_convolver(
+                block_size=block_size,
+                channels=2,
+                ir_spectra=self._room_spectra(sr, block_size),
+            )
+            return
+        if engine != "conv":
+            raise ValueError(f"Unknown reverb engine: {engine}")
 
-        # 最終ノーマライズ（Reverbは音量が足されて膨らむので必須）
-        max_val = np.max(np.abs(processed_data))
-        if max_val > 0:
-            processed_data = processed_data / max_val
+        ir, ir_spectra = self._ir_spectra(sr, 3.0, block_size)
+        # 曲全体のピークは分からないので、IRのエネルギーでWetの音量を揃える
+        self._wet_gain = 1.0 / np.sqrt(np.sum(ir**2))
+        self._conv = partitioned_convolver(
+            block_size=block_size, channels=2, ir_spectra=ir_spectra
+        )
 
-        self.af_data = processed_data
-        return processed_data
+    def syn_rev_block(self, block):
+        """(channels, n) のブロックに残響を足して返す（分割畳み込み または FDN）"""
+        n = block.shape[1]
+        mix_ratio = self.curve.read(n)
+        if self.engine == "fdn":
+            wet_block = self._fdn.process(block, self._room_size(mix_ratio))
+        elif self.engine == "bank":
+            weights = self._room_weights(self._room_size(mix_ratio))
+            wet_block = self._conv.process(block, weights)
+        else:
+            wet_block = self._conv.process(block) * self._wet_gain
+
+        return block * (1 - mix_ratio) + wet_block * mix_ratio
 
     def vid(self):
+        import matplotlib.pyplot as plt
+
         if self.be_data is None or self.af_data is None:
             return
 
@@ -1,29 +1,85 @@
-from gui_play import gui_play as gp
 import one_f_generator as ofg
-import librosa
-import matplotlib.pyplot as plt
+import smoothing as smt
 import numpy as np
+from functools import lru_cache
 from scipy import signal  # フィルター用
+from stage_profiler import span
+
+
+@lru_cache(maxsize=16)
+def lowpass_sos(sr, cutoff, order=4):
+    """
+    バターワースのローパスを2次セクション（SOS）で作り置きする
+    (b, a) 形式より低いカットオフでも数値的に安定です。
+    ※ sosfilt は書き込み可能な配列しか受け付けないので、読み取り専用にはしていません（書き換え禁止）
+    """
+    return signal.butter(order, cutoff / (sr / 2), btype="low", output="sos")
+
+
+@lru_cache(maxsize=8)
+def lowpass_bank(sr, cutoffs, order=4):
+    """
+    カットオフ違いのローパスをまとめたフィルタバンク (カットオフの数, セクション数, 6)
+    係数を補間すると DC ゲインがずれるので、細かいカットオフごとに設計し直したものを並べます。
+    （lowpass_sos のキャッシュを押し出さないように、ここで直接設計する）
+    """
+    return np.stack(
+        [signal.butter(order, c / (sr / 2), btype="low", output="sos") for c in cutoffs]
+    )
 
 
 class syn_timbre:
+    # 1/fゆらぎの移動平均の窓
+    window_size = 2000
+    # こもらせる時のローパスのカットオフ [Hz] と次数
+    cutoff = 1000
+    filter_order = 4
+    # engine="sweep" でカットオフを動かす範囲 [Hz]・バンクの段数・係数を切り替える間隔
+    sweep_range = (1000, 16000)
+    sweep_steps = 9
+    sweep_hop = 256
+    # バンクの1段を何個のカットオフに細かく分けて設計するかと、1ホップで動ける細かい段の数
+    # （16 と 4 なら、端から端まで 32 ホップ = 44.1kHz で約 0.19 秒かけて動く）
+    sweep_resolution = 16
+    sweep_slew = 4
+
     def __init__(self):
         self.sr = 44100
         self.be_data = None
         self.af_data = None
 
     def get_file_path(self):
+        from gui_play import gui_play as gp
+        from audio_io import load_audio
+
         self.file = gp()
         self.file_path = self.file.gui_get_music()
         if not self.file_path:
             return None, None
 
-        self.data, self.sr = librosa.load(
-            self.file_path, mono=False, sr=None, duration=180
-        )
+        self.data, self.sr = load_audio(self.file_path)
         return self.data, self.sr
 
-    def syn_tim(self, data, sr):
+    def syn_tim(
+        self,
+        data,
+        sr,
+        control_sr=None,
+        raw_curve=None,
+        seed=None,
+        curve_bank=None,
+        causal=False,
+        engine="blend",
+    ):
+        """
+        :param control_sr: 指定するとゆらぎを間引いたレートで生成する
+        :param raw_curve: generate_one_f_batch で作り置きした生カーブ（省略時はここで生成）
+        :param seed: int または numpy.random.Generator（ゆらぎを再現したい時）
+        :param curve_bank: one_f_bank.one_f_bank（作り置きのゆらぎを切り出して使う）
+        :param causal: True なら片方向のフィルタ（ブロック処理と同じ音、計算は半分）
+        :param engine: "blend"（原音と1kHzローパスを混ぜる）または
+            "sweep"（ローパスのカットオフそのものを動かす、常に片方向）
+        """
         # グラフ比較用に保存
         self.be_data = data.copy()
         self.sr = sr  # srを確実に保存
@@ -34,39 +90,240 @@ class syn_timbre:
         elif np.mean(np.abs(data[1])) < 0.0001:
             data[1] = data[0].copy()
 
-        length = data.shape[1]
+        # 2. こもった音と、ゆらぎの係数を作る
+        muffled_data, mix_ratio = self.make_layer(
+            data, sr, control_sr, raw_curve, seed, curve_bank, causal, engine
+        )
+
+        # 3. ブレンド（sweep はフィルタの出力そのまま）
+        if mix_ratio is None:
+            processed_data = muffled_data
+        else:
+            processed_data = data * (1 - mix_ratio) + muffled_data * mix_ratio
+
+        self.af_data = processed_data
+
+        return processed_data
+
+    def make_layer(
+        self,
+        data,
+        sr,
+        control_sr=None,
+        raw_curve=None,
+        seed=None,
+        curve_bank=None,
+        causal=False,
+        engine="blend",
+        executor=None,
+    ):
+        """
+        ブレンド前の材料だけを作る（data は書き換えない。引数は syn_tim と同じ）
+        こもった音は data と同じ dtype で返すので、float32 のまま加工を続けられます。
+        :param data: (2, n) の音声（モノラル対策は済ませておく）
+        :param executor: concurrent.futures の Executor（sosfiltfilt を左右並列に処理する）
+        :return: (こもった音, 1/fゆらぎの係数)  sweep の時は (加工後の音, None)
+        """
+        mix_ratio = self.make_curve(
+            data.shape[1], sr, control_sr, raw_curve, seed, curve_bank
+        )
+
+        if engine == "sweep":
+            # カットオフを動かしながらブロックごとにフィルタ（コピーは出力の1つだけ）
+            self.init_filter(data.shape[0])
+            with span("filter"):
+                return self._sweep(data, self._sweep_position(mix_ratio)), None
+        if engine != "blend":
+            raise ValueError(f"Unknown timbre engine: {engine}")
+        with span("filter"):
+            return self._filter(data, sr, causal, executor), mix_ratio
+
+    def _filter(self, data, sr, causal=False, executor=None):
+        """make_layer のこもった音（ローパスを通した data）"""
+        # フィルター作成（SOS形式、(sr, cutoff) ごとにキャッシュ）
+        sos = lowpass_sos(sr, self.cutoff, self.filter_order)
 
-        # 2. フィルター作成
-        nyquist = sr / 2
-        cutoff = 1000 / nyquist
-        b, a = signal.butter(4, cutoff, btype="low")
+        if causal:
+            self.init_filter(data.shape[0])
+            muffled_data = self._lowpass(data).astype(data.dtype, copy=False)
+        elif data.dtype == np.float64 and executor is None:
+            # sosfiltfiltで位相ズレなし（左右のチャンネルを1回の呼び出しでまとめて処理する）
+            muffled_data = signal.sosfiltfilt(sos, data, axis=-1)
+        else:
+            # float32 の時はチャンネルごとに書き込んで、float64 の一時配列を1チャンネル分に抑える
+            # （チャンネルごとの結果は axis=-1 でまとめた時と全く同じ）
+            muffled_data = np.empty_like(data)
 
-        muffled_data = np.zeros_like(data)
-        # filtfiltで位相ズレなし
-        muffled_data[0] = signal.filtfilt(b, a, data[0])
-        muffled_data[1] = signal.filtfilt(b, a, data[1])
+            def _filt(ch):
+                muffled_data[ch] = signal.sosfiltfilt(sos, data[ch])
 
-        # 3. 1/fゆらぎ係数
-        self.one_f = ofg.generate_one_f(length)
-        raw_ratio = self.one_f.ifft_real_result
+            channel_map = map if executor is None else executor.map
+            list(channel_map(_filt, range(data.shape[0])))
+        return muffled_data
 
+    def make_curve(
+        self, length, sr, control_sr=None, raw_curve=None, seed=None, curve_bank=None
+    ):
+        """こもった音を混ぜる割合のゆらぎだけを作る（引数は syn_tim と同じ）"""
+        self.sr = sr
+        # 1/fゆらぎ係数（control_sr 指定時は間引いたレートで作って引き伸ばす）
+        self.one_f, mix_ratio = ofg.one_f_curve(
+            length,
+            sr,
+            self._mix_ratio,
+            control_sr,
+            raw_curve,
+            seed,
+            bank=curve_bank,
+            window_size=self.window_size,
+        )
+        return mix_ratio
+
+    def _mix_ratio(self, raw_ratio, hop=1.0, smoothed=False):
+        """
+        :param hop: コントロールレート1点あたりのサンプル数（音声レートなら 1.0）
+        :param smoothed: True なら移動平均済み（ゆらぎバンクから取ったカーブ）とみなす
+        """
         # 移動平均（ノイズ対策）
-        window_size = 2000
-        window = np.ones(window_size) / window_size
-        smooth_ratio = np.convolve(raw_ratio, window, mode="same")
+        # コントロールレート換算
+        window_size = max(1, int(round(self.window_size / hop)))
+        if smoothed:
+            smooth_ratio = raw_ratio
+        else:
+            smooth_ratio = smt.moving_average(raw_ratio, window_size)
 
         # 正規化
         smooth_ratio = (smooth_ratio - np.mean(smooth_ratio)) * 8.0
-        mix_ratio = np.clip(smooth_ratio + 0.3, 0.0, 1.0)
+        return np.clip(smooth_ratio + 0.3, 0.0, 1.0)
 
-        # 4. ブレンド
-        processed_data = data * (1 - mix_ratio) + muffled_data * mix_ratio
+    def _sweep_cutoffs(self):
+        """
+        フィルタバンクのカットオフ（対数で等間隔、ナイキストの手前まで）
+        バンクの1段を sweep_resolution 個に分けるので、位置 p は (p * sweep_resolution) 番目
+        """
+        low, high = self.sweep_range
+        high = min(high, 0.45 * self.sr)
+        n = (self.sweep_steps - 1) * self.sweep_resolution + 1
+        return tuple(float(c) for c in np.geomspace(low, high, n))
 
-        self.af_data = processed_data
+    def _sweep_position(self, mix_ratio):
+        """
+        こもり具合 0.0〜1.0 をフィルタバンクの位置に読み替える
+        1.0 で一番低いカットオフ（blend の 1kHz と同じ）、0.0 で一番高いカットオフ
+        """
+        return (1.0 - mix_ratio) * (self.sweep_steps - 1)
 
-        return processed_data
+    def _sweep(self, x, position):
+        """
+        (channels, n) を、カットオフが動くローパスに通す（状態を持ち越すので続けて呼べる）
+        sweep_hop サンプルごとに、その区間の平均位置に一番近いカットオフで設計し直した
+        SOS に切り替えます。切り替えても過渡応答が出ないように、
+          - 各セクションの状態は過去2サンプルの入出力（直接形 I）で持ち、係数に合わせて作り直す
+          - 1ホップで動ける位置は sweep_slew 段まで
+        :param position: (n,) のフィルタバンク上の位置（0 〜 sweep_steps - 1）
+        """
+        n = x.shape[1]
+        out = np.empty(x.shape, dtype=np.result_type(x.dtype, np.float32))
+        starts = np.arange(0, n, self.sweep_hop)
+
+        # 区間ごとの平均位置（1点だけ拾うと細かい揺れで係数が飛んでプチっと鳴る）
+        p = np.add.reduceat(position, starts) / np.diff(np.append(starts, n))
+        targets = np.rint(p * self.sweep_resolution).astype(int)
+        targets = np.clip(targets, 0, len(self._bank) - 1)
+
+        # 1ホップごとの位置（1ホップで動けるのは sweep_slew 段まで）
+        indices = np.empty(len(targets), dtype=int)
+        for i, target in enumerate(targets):
+            if self._sweep_index is None:
+                self._sweep_index = target
+            else:
+                step = target - self._sweep_index
+                self._sweep_index += max(-self.sweep_slew, min(self.sweep_slew, step))
+            indices[i] = self._sweep_index
+
+        # 位置が変わらない間のホップはまとめて1回で通す
+        changes = np.flatnonzero(np.diff(indices)) + 1
+        for first, last in zip(np.append(0, changes), np.append(changes, len(indices))):
+            start, end = starts[first], min(starts[last - 1] + self.sweep_hop, n)
+            out[:, start:end] = self._sweep_block(
+                self._bank[indices[first]], x[:, start:end]
+            )
+        return out
+
+    def _sweep_block(self, sos, x):
+        """
+        (channels, n) を sos に1回で通す（係数を変えた直後でも過渡応答が出ない）
+        各セクションの状態は過去2サンプルの入出力（直接形 I）で持ちます。これは係数と関係ないので、
+        新しい係数に合わせて sosfilt（転置直接形 II）の状態を作り直せる。
+        通した後の各セクションの出力は、最後の状態から逆算する（a2 はバンク全体で 0.04 以上）
+        """
+        xh, yh = (
+            self._sweep_x,
+            self._sweep_y,
+        )  # (セクション数, channels, 2) = [n-2, n-1]
+        b1, b2, a1, a2 = (sos[:, j, np.newaxis] for j in (1, 2, 4, 5))
+        zi = np.empty_like(xh)
+        zi[:, :, 0] = (
+            b1 * xh[:, :, 1] + b2 * xh[:, :, 0] - a1 * yh[:, :, 1] - a2 * yh[:, :, 0]
+        )
+        zi[:, :, 1] = b2 * xh[:, :, 1] - a2 * yh[:, :, 1]
+        y, zf = signal.sosfilt(sos, x, axis=-1, zi=zi)
+
+        u = np.concatenate([xh[0], x], axis=1)[:, -2:]  # 1段目の入力の最後の2サンプル
+        for k in range(len(sos)):
+            last = (b2[k] * u[:, 1] - zf[k, :, 1]) / a2[k]
+            prev = (
+                b1[k] * u[:, 1] + b2[k] * u[:, 0] - a1[k] * last - zf[k, :, 0]
+            ) / a2[k]
+            xh[k] = u
+            yh[k, :, 0], yh[k, :, 1] = prev, last
+            u = yh[k]
+        return y
+
+    # ---------------------------------------------------------
+    # ブロック処理API（ストリーミング再生用）
+    # ---------------------------------------------------------
+    def init_filter(self, channels=2):
+        """片方向ローパスの状態をクリアする（self.sr のフィルタを使う）"""
+        self._sos = lowpass_sos(self.sr, self.cutoff, self.filter_order)
+        self._bank = lowpass_bank(self.sr, self._sweep_cutoffs(), self.filter_order)
+        self._zi = np.zeros((len(self._sos), channels, 2))
+        # sweep の各セクションの過去2サンプルの入出力と、今のバンク上の位置
+        self._sweep_x = np.zeros((self._bank.shape[1], channels, 2))
+        self._sweep_y = np.zeros((self._bank.shape[1], channels, 2))
+        self._sweep_index = None
+
+    def _lowpass(self, x):
+        """(channels, n) を片方向ローパスに通す（状態を持ち越すので続けて呼べる）"""
+        y, self._zi = signal.sosfilt(self._sos, x, axis=-1, zi=self._zi)
+        return y
+
+    def init_block(self, sr, segment_sec=4.0, engine="blend"):
+        """
+        ブロック処理の状態を初期化する
+        ※ filtfilt は曲全体が必要なので、ブロック処理では片方向の sosfilt（状態持ち越し）で代用
+        :param engine: "blend" または "sweep"（syn_tim と同じ）
+        """
+        if engine not in ("blend", "sweep"):
+            raise ValueError(f"Unknown timbre engine: {engine}")
+        self.sr = sr
+        self.latency = 0
+        self.engine = engine
+        self.init_filter()
+        self.curve = ofg.one_f_blocks(int(segment_sec * sr), self._mix_ratio)
+
+    def syn_tim_block(self, block):
+        """(channels, n) のブロックにこもり具合の揺らぎを掛けて返す"""
+        mix_ratio = self.curve.read(block.shape[1])
+        if self.engine == "sweep":
+            return self._sweep(block, self._sweep_position(mix_ratio))
+
+        muffled_block = self._lowpass(block)
+        return block * (1 - mix_ratio) + muffled_block * mix_ratio
 
     def vid(self):
+        import matplotlib.pyplot as plt
+
         if self.be_data is None or self.af_data is None:
             return
 
@@ -1,28 +1,39 @@
-from gui_play import gui_play as gp
 import one_f_generator as ofg
-import librosa
-import matplotlib.pyplot as plt
+import smoothing as smt
 import numpy as np
 
 
 class syn_volume:
+    # 1/fゆらぎの移動平均の窓（大きくするほど滑らか。推奨: 50〜100）
+    window_size = 50
+
     def __init__(self):
         # 初期値（エラー回避用）
         self.sr = 44100
 
     def get_file_path(self):
+        # GUI と読み込みは使う時に読み込む（DSP だけ使う時は numpy / scipy しか読まない）
+        from gui_play import gui_play as gp
+        from audio_io import load_audio
+
         self.file = gp()
         self.file_path = self.file.gui_get_music()
         if not self.file_path:
             return None, None
 
-        # 他のクラスと統一してステレオ(mono=False)で読み込む
-        self.data, self.sr = librosa.load(
-            self.file_path, mono=False, sr=None, duration=180
-        )
+        # 他のクラスと統一してステレオで読み込む（モノラルは左右に複製される）
+        self.data, self.sr = load_audio(self.file_path)
         return self.data, self.sr
 
-    def syn_vol(self, data, sr):
+    def syn_vol(
+        self, data, sr, control_sr=None, raw_curve=None, seed=None, curve_bank=None
+    ):
+        """
+        :param control_sr: 指定するとゆらぎを間引いたレートで生成する
+        :param raw_curve: generate_one_f_batch で作り置きした生カーブ（省略時はここで生成）
+        :param seed: int または numpy.random.Generator（ゆらぎを再現したい時）
+        :param curve_bank: one_f_bank.one_f_bank（作り置きのゆらぎを切り出して使う）
+        """
         # グラフ描画用（vidメソッド）にsrを保存しておく
         self.sr = sr
 
@@ -35,19 +46,10 @@ class syn_volume:
 
         length = data.shape[1]
 
-        # 1/fゆらぎ生成
-        self.one_f = ofg.generate_one_f(length)
-        raw_multiplier = self.one_f.ifft_real_result
-
-        # ---------------------------------------------------------
-        # 【修正ポイント】 "ざざざ" ノイズ対策：移動平均でカドを取る
-        # ---------------------------------------------------------
-        # window_sizeを大きくするほど滑らかになります（推奨: 50〜100）
-        window_size = 50
-        window = np.ones(window_size) / window_size
-
-        # 畳み込み積分でスムージング（mode='same'でサイズを変えない）
-        multiplier = np.convolve(raw_multiplier, window, mode="same")
+        # 1/fゆらぎ生成（control_sr 指定時は間引いたレートで作って引き伸ばす）
+        multiplier = self.make_curve(
+            length, sr, control_sr, raw_curve, seed, curve_bank
+        )
 
         # 必要に応じてオフセット調整（例：極端に音が小さくなるのを防ぐ）
         # multiplier = (multiplier - np.mean(multiplier)) + 1.0
@@ -64,7 +66,62 @@ class syn_volume:
 
         return vol_data
 
+    def make_curve(
+        self, length, sr, control_sr=None, raw_curve=None, seed=None, curve_bank=None
+    ):
+        """
+        音量の倍率カーブだけを作る（音には掛けない。gain_stage でまとめて掛ける時用）
+        引数は syn_vol と同じです。
+        """
+        self.one_f, multiplier = ofg.one_f_curve(
+            length,
+            sr,
+            self._smooth_multiplier,
+            control_sr,
+            raw_curve,
+            seed,
+            bank=curve_bank,
+            window_size=self.window_size,
+        )
+        return multiplier
+
+    def _smooth_multiplier(self, raw_multiplier, hop=1.0, smoothed=False):
+        """
+        :param hop: コントロールレート1点あたりのサンプル数（音声レートなら 1.0）
+        :param smoothed: True なら移動平均済み（ゆらぎバンクから取ったカーブ）とみなす
+        """
+        # ---------------------------------------------------------
+        # 【修正ポイント】 "ざざざ" ノイズ対策：移動平均でカドを取る
+        # ---------------------------------------------------------
+        # コントロールレート換算
+        window_size = max(1, int(round(self.window_size / hop)))
+
+        # 累積和の移動平均でスムージング（窓の大きさに関係なく O(N)、サイズも変えない）
+        if smoothed:
+            return raw_multiplier
+        return smt.moving_average(raw_multiplier, window_size)
+
+    # ---------------------------------------------------------
+    # ブロック処理API（ストリーミング再生用）
+    # ---------------------------------------------------------
+    def init_block(self, sr, segment_sec=4.0):
+        """ブロック処理の状態を初期化する"""
+        self.sr = sr
+        self.latency = 0
+        self.curve = ofg.one_f_blocks(int(segment_sec * sr), self._block_multiplier)
+
+    def _block_multiplier(self, raw_multiplier):
+        multiplier = self._smooth_multiplier(raw_multiplier)
+        # 曲全体のピークは分からないので、区間内の最大値で割って音割れを防ぐ
+        return multiplier / np.max(np.abs(multiplier))
+
+    def syn_vol_block(self, block):
+        """(channels, n) のブロックに音量揺らぎを掛けて返す"""
+        return block * self.curve.read(block.shape[1])
+
     def vid(self, be, af):
+        import matplotlib.pyplot as plt
+
         # 1秒分だけ表示
         if hasattr(self, "limit"):
             limit = self.limit
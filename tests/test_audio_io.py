@@ -0,0 +1,44 @@
+import numpy as np
+import audioread
+import audio_io
+
+
+class fake_audioread:
+    """audioread.audio_open の代わり（16bit ステレオのバイト列を返す）"""
+
+    def __init__(self, n_buffers, duration=None):
+        self.channels = 2
+        self.samplerate = 8000
+        self.duration = duration
+        self.closed = False
+        self._n = n_buffers
+
+    def __iter__(self):
+        for _ in range(self._n):
+            yield np.zeros(2 * 1024, dtype="<i2").tobytes()
+
+    def close(self):
+        self.closed = True
+
+
+def _open(monkeypatch, tmp_path, fake):
+    monkeypatch.setattr(audioread, "audio_open", lambda path: fake)
+    path = tmp_path / "song.m4a"
+    path.write_bytes(b"not readable by soundfile")
+    return str(path)
+
+
+def test_empty_file_with_unknown_length(monkeypatch, tmp_path):
+    fake = fake_audioread(0)
+    data, sr = audio_io.load_audio(_open(monkeypatch, tmp_path, fake))
+    assert data.shape == (2, 0) and sr == 8000
+    assert fake.closed
+
+
+def test_early_exit_closes_file(monkeypatch, tmp_path):
+    """最後まで読まずに close() しても、audioread のファイルを閉じる"""
+    fake = fake_audioread(10)
+    blocks, _ = audio_io.open_blocks(_open(monkeypatch, tmp_path, fake), 512)
+    assert next(blocks).shape == (2, 512)
+    blocks.close()
+    assert fake.closed
@@ -0,0 +1,30 @@
+from batch import find_audio, output_names, run_batch
+
+
+def test_output_names_keep_unique_names():
+    assert output_names(["a/song.wav", "b.mp3"], "flac") == ["a/song.flac", "b.flac"]
+
+
+def test_output_names_split_collisions():
+    """拡張子だけ違う曲や、別の入力の同じ相対パスが同じ出力に重ならない"""
+    rels = ["song.wav", "song.flac", "x.mp3", "x.mp3", "song_wav.ogg"]
+    names = output_names(rels, "FLAC")
+    assert len(set(names)) == len(names)
+    assert names[1] == "song_flac.flac"
+    assert names[2:4] == ["x_mp3.flac", "x_mp3-2.flac"]
+    assert names[4] == "song_wav.flac"
+
+
+def test_find_audio_skips_same_file(tmp_path):
+    (tmp_path / "song.wav").write_bytes(b"")
+    (tmp_path / "notes.txt").write_bytes(b"")
+    found = find_audio([str(tmp_path), str(tmp_path / "song.wav")])
+    assert [rel for _, rel in found] == ["song.wav"]
+
+
+def test_unreadable_file_fails_alone(tmp_path, capsys):
+    """読めない曲は fail として飛ばし、バッチ全体は止めない"""
+    bad = tmp_path / "bad.wav"
+    bad.write_bytes(b"not audio")
+    assert run_batch([str(bad)], str(tmp_path / "out"), {"vol": 1.0}) == []
+    assert "fail: bad.wav" in capsys.readouterr().err
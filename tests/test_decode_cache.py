@@ -0,0 +1,30 @@
+import glob
+import os
+import numpy as np
+import pytest
+import soundfile as sf
+from decode_cache import decode_cache
+
+SR = 8000
+
+
+@pytest.mark.parametrize("channels", [1, 2])
+def test_cache_keeps_native_channels(tmp_path, channels):
+    """モノラルは1chのまま保存し、開く時にコピーせずに (2, n) のビューにする"""
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, (SR, channels))
+    path = str(tmp_path / "song.wav")
+    sf.write(path, audio, SR, subtype="FLOAT")
+    cache = decode_cache(str(tmp_path / "cache"))
+
+    first, sr = cache.load(path)
+    (stored,) = glob.glob(os.path.join(cache.directory, "*.npy"))
+    assert np.load(stored, mmap_mode="r").shape == (channels, SR)
+
+    second, _ = cache.load(path)  # 2回目はキャッシュから
+    expected = np.vstack([audio.T, audio.T])[:2]
+    for data in (first, second):
+        assert sr == SR and data.shape == (2, SR)
+        assert np.allclose(data, expected, atol=1e-7)
+    if channels == 1:
+        assert not second.flags.writeable
+        assert second.strides[0] == 0
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from one_f_bank import build_bank, one_f_bank
+
+SR = 8000
+
+
+@pytest.fixture(scope="module")
+def bank_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("bank")
+    build_bank(directory, 20 * SR, window_sizes=(50,), ref_length=60 * SR, seed=0)
+    return directory
+
+
+def test_take_scales_with_length(bank_dir):
+    """切り出したカーブは、長さの比の平方根で 1 からのずれを大きくする"""
+    bank = one_f_bank(bank_dir, seed=0, flip=False, reverse=False)
+    assert bank.ref_length == 60 * SR
+    raw = np.load(bank_dir / "one_f_w50.npy").astype(np.float64)
+    curve = bank.take(len(raw), 50)  # バンク全体なので、切り出す位置は先頭
+    assert np.allclose(curve - 1, (raw - 1) * np.sqrt(3))
+
+
+def test_crowded_bank_warns(bank_dir):
+    bank = one_f_bank(bank_dir, seed=0)
+    with pytest.warns(RuntimeWarning, match="crowded"):
+        for _ in range(3):
+            bank.take(15 * SR, 50, max_tries=5)
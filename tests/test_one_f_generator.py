@@ -0,0 +1,13 @@
+import numpy as np
+import one_f_generator as ofg
+
+
+def test_batch_rows_follow_their_own_seed():
+    """seed のリストなら、各行は他の行の有無に関係なく、その seed だけで決まる"""
+    seeds = np.random.SeedSequence(7).spawn(3)
+    batch = ofg.generate_one_f_batch(5000, 3, np.float32, seed=list(seeds))
+    pair = ofg.generate_one_f_batch(5000, 2, np.float32, seed=[seeds[0], seeds[2]])
+    single = ofg.generate_one_f_batch(5000, 1, np.float32, seed=seeds[2])
+    assert batch.shape == (3, 5000)
+    assert np.allclose(batch[[0, 2]], pair, atol=1e-5)
+    assert np.allclose(batch[2], single[0], atol=1e-5)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from pipeline import memory_budget, render_pipeline, stage_cache
+
+SR = 44100
+DEPTHS = {"vol": 0.5, "pan": 0.5, "pit": 0.5, "tim": 0.5, "rev": 0.5}
+
+
+@pytest.fixture(scope="module")
+def song():
+    return np.random.default_rng(0).standard_normal((2, SR * 2)) * 0.1
+
+
+def _render(song, depths, float32=False, cache=None):
+    pipe = render_pipeline(
+        SR,
+        depths,
+        float32=float32,
+        seed=7,
+        cache=cache,
+        source_key="song" if cache is not None else None,
+    )
+    # float32 モードはその場で書き換えるのでコピーを渡す
+    return pipe.render(song.copy())
+
+
+@pytest.mark.parametrize("float32", [False, True])
+def test_cache_does_not_change_output(song, float32):
+    """同じ seed なら、stage_cache の有無で音が変わらない"""
+    plain = _render(song, DEPTHS, float32)
+    cached = _render(song, DEPTHS, float32, stage_cache())
+    assert np.array_equal(plain, cached)
+
+
+def test_cache_hit_matches_fresh_render(song):
+    """キャッシュから途中で再開しても、最初から加工したのと同じ"""
+    cache = stage_cache()
+    _render(song, DEPTHS, cache=cache)
+    depths = dict(DEPTHS, rev=0.8)
+    resumed = _render(song, depths, cache=cache)
+    assert cache.hits > 0
+    assert np.array_equal(resumed, _render(song, depths))
+
+
+def test_over_budget_stage_warns():
+    """見積もりが外れて上限を超えた時は RuntimeWarning（止めはしない）"""
+    budget = memory_budget(limit_mb=1)
+    with budget:
+        budget.check("big", 0)
+        block = np.ones(2**19)  # 4 MB
+        with pytest.warns(RuntimeWarning, match="over the 1 MB budget"):
+            budget.record("big")
+        del block
+
+
+def test_read_only_input_is_copied(song):
+    """読み取り専用の入力（デコードキャッシュのモノラルのビュー）も float32 モードで加工できる"""
+    mono = np.broadcast_to(song[:1].astype(np.float32), song.shape)
+    out = render_pipeline(SR, DEPTHS, float32=True, seed=7).render(mono)
+    assert out.shape == song.shape and np.all(np.isfinite(out))
@@ -0,0 +1,20 @@
+import numpy as np
+from scipy import signal
+from psd_analysis import ideal_line, welch_accumulator
+
+
+def test_streaming_matches_welch():
+    x = np.random.default_rng(0).standard_normal(50000)
+    acc = welch_accumulator(8000)
+    for start in range(0, len(x), 3000):
+        acc.feed(x[start : start + 3000])
+    f, p = acc.result()
+    f_ref, p_ref = signal.welch(x, 8000, nperseg=1024)
+    assert np.allclose(f, f_ref) and np.allclose(p, p_ref)
+
+
+def test_nothing_fed_gives_empty_psd():
+    f, p = welch_accumulator(8000).result()
+    assert len(f) == 0 and len(p) == 0
+    f_ideal, p_ideal = ideal_line(f, p)
+    assert len(f_ideal) == 0 and len(p_ideal) == 0
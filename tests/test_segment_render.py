@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from segment_render import segment_renderer
+
+SR = 8000
+
+
+class failing_renderer(segment_renderer):
+    """Timbre の途中で失敗する（共有メモリの名前を覚えておく）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.names = []
+
+    def _share(self, shape, dtype=np.float64):
+        array, spec = super()._share(shape, dtype)
+        self.names.append(spec[0])
+        return array, spec
+
+    def _tim(self, data, state):
+        raise RuntimeError("stage failed")
+
+
+def test_empty_input():
+    out = segment_renderer(SR, {"tim": 0.5}, processes=1, seed=0).render(
+        np.zeros((2, 0))
+    )
+    assert out.shape == (2, 0)
+
+
+def test_failure_unlinks_shared_memory(monkeypatch):
+    """配列が残っていて閉じられなくても、元の例外を返して共有メモリは消す"""
+
+    close = shared_memory.SharedMemory.close
+    busy = set()
+
+    def _busy(shm):
+        # 1回目だけ失敗する（後で __del__ から閉じる時は閉じられる）
+        if shm.name not in busy:
+            busy.add(shm.name)
+            raise BufferError("cannot close exported pointers exist")
+        close(shm)
+
+    monkeypatch.setattr(shared_memory.SharedMemory, "close", _busy)
+    renderer = failing_renderer(SR, {"tim": 0.5}, processes=1, seed=0)
+    with pytest.raises(RuntimeError, match="stage failed"):
+        renderer.render(np.zeros((2, SR)))
+    monkeypatch.undo()
+
+    assert renderer.names
+    for name in renderer.names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
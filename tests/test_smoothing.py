@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+import smoothing as smt
+
+
+@pytest.mark.parametrize("window_size", [1, 50, 3000])
+def test_moving_average_keeps_float32(window_size):
+    x = np.random.default_rng(0).random(2000)
+    y32 = smt.moving_average(x.astype(np.float32), window_size)
+    y64 = smt.moving_average(x, window_size)
+    assert y32.dtype == np.float32 and y64.dtype == np.float64
+    assert np.allclose(y32, y64, atol=1e-6)
+    ref = np.convolve(x, np.ones(window_size) / window_size, mode="same")
+    assert np.allclose(y64, ref)
+
+
+def test_one_pole_keeps_float32():
+    x = np.random.default_rng(1).random(2000).astype(np.float32)
+    assert smt.one_pole(x, 100).dtype == np.float32
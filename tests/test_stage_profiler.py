@@ -0,0 +1,29 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from stage_profiler import stage_profiler, span, thread_initializer
+
+
+def _work(name):
+    with span(name):
+        pass
+
+
+def test_records_owner_and_adopted_threads_only():
+    """activate() したスレッドとプールのスレッドだけ記録し、関係ないスレッドは混ざらない"""
+    prof = stage_profiler(memory=False)
+    with prof.activate():
+        _work("owner")
+        with ThreadPoolExecutor(2, initializer=thread_initializer()) as pool:
+            pool.submit(_work, "pool").result()
+        other = threading.Thread(target=_work, args=("other",))
+        other.start()
+        other.join()
+    assert set(prof.summary()) == {"owner", "pool"}
+
+
+def test_inactive_span_is_noop():
+    prof = stage_profiler(memory=False)
+    with prof.activate():
+        pass
+    _work("after")
+    assert prof.events == []
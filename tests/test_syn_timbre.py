@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from syn_timbre import syn_timbre
+
+SR = 44100
+
+
+def _sweep(position, level=0.5, block=None):
+    timbre = syn_timbre()
+    timbre.sr = SR
+    timbre.init_filter(2)
+    x = np.full((2, len(position)), level)
+    if block is None:
+        return timbre._sweep(x, position)
+    return np.concatenate(
+        [
+            timbre._sweep(x[:, s : s + block], position[s : s + block])
+            for s in range(0, len(position), block)
+        ],
+        axis=1,
+    )
+
+
+def test_sweep_static_gain():
+    """カットオフが止まっている時は、ただのローパス（DC はそのまま通る）"""
+    y = _sweep(np.full(SR, 4.0))
+    assert np.allclose(y[:, -1000:], 0.5, atol=1e-6)
+
+
+@pytest.mark.parametrize("start, end", [(0.0, 8.0), (8.0, 0.0)])
+def test_sweep_step_peak(start, end):
+    """位置が端から端へ飛んでも、バターワース4次のオーバーシュート程度で収まる"""
+    n = SR * 2
+    y = _sweep(np.where(np.arange(n) < n // 2, start, end))
+    assert np.max(np.abs(y)) < 0.5 * 1.25
+
+
+@pytest.mark.parametrize("rate", [0.5, 5.0, 20.0])
+def test_sweep_fast_peak(rate):
+    """全範囲を速く往復させても、係数の切り替えで過渡応答が出ない"""
+    t = np.arange(SR * 2) / SR
+    y = _sweep(4.0 + 4.0 * np.sin(2 * np.pi * rate * t))
+    assert np.max(np.abs(y)) < 0.5 * 1.25
+
+
+def test_sweep_blocks_match_whole():
+    """ホップの倍数のブロックに分けて続けて呼んでも、一度に通した時と同じ"""
+    rng = np.random.default_rng(0)
+    position = np.clip(np.cumsum(rng.standard_normal(SR * 2)) * 0.01 + 4, 0, 8)
+    whole = _sweep(position)
+    blocks = _sweep(position, block=syn_timbre.sweep_hop * 40)
+    assert np.allclose(whole, blocks, atol=1e-12)